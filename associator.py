@@ -0,0 +1,116 @@
+import numpy as np
+from obspy.core import UTCDateTime
+import traveltimes
+from locator import read_stations, epicentral_distance
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  PHASE ASSOCIATOR
+#  groups the P onsets (Z channels) and S onsets (N, E channels) of all stations into
+#  events whose arrival times are consistent with a common source, using the 1-D model
+#  travel times (traveltimes.py) from a grid of candidate sources around the network
+#  (src/stations.net). The onsets are kept sorted by time, so each event only looks at
+#  the onsets within the largest moveout of the network after its first P.
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+class Associator(object):
+  """
+  associate(onsets) returns the events as find_coincidences does: [(time, [(station, P, P weight, S, S weight), ...]), ...]
+  min_num_stations: minimum number of stations with a consistent P onset
+  tolerance: largest P residual (s) for an onset to be consistent with a candidate source
+  s_tolerance: largest S residual (s)
+  grid_step, grid_margin: spacing and extension (degrees) around the stations of the candidate sources; depths in km
+  """
+
+  def __init__(self, station_file="src/stations.net", model_file="src/model.cru", min_num_stations=4, tolerance=1.5, s_tolerance=3.,
+               grid_step=0.1, grid_margin=1.5, depths=(5., 15., 30., 50.)):
+    self.min_num_stations = min_num_stations
+    self.tolerance = tolerance
+    self.s_tolerance = s_tolerance
+
+    stations = read_stations(station_file)
+    self.stations = sorted(stations)
+    self.index = dict((stname, i) for i, stname in enumerate(self.stations))
+    stlat = np.array([stations[stname][0] for stname in self.stations])
+    stlon = np.array([stations[stname][1] for stname in self.stations])
+
+    # P AND S TRAVEL TIMES FROM EVERY CANDIDATE SOURCE TO EVERY STATION (nodes x stations)
+    lats = np.arange(stlat.min() - grid_margin, stlat.max() + grid_margin + grid_step/2., grid_step)
+    lons = np.arange(stlon.min() - grid_margin, stlon.max() + grid_margin + grid_step/2., grid_step)
+    glat, glon = [a.ravel() for a in np.meshgrid(lats, lons, indexing="ij")]
+    table = traveltimes.load(model_file)
+    dist = epicentral_distance(glat[:, None], glon[:, None], stlat, stlon)
+    self.ttp = np.concatenate([table.lookup('P', dist, z) for z in depths]).astype(np.float32)
+    self.tts = np.concatenate([table.lookup('S', dist, z) for z in depths])
+
+    # largest P moveout after each station (the candidate onsets of an event first seen at that station), over all candidate sources
+    self.max_moveout = np.max(self.ttp.max(axis=1)[:, None] - self.ttp, axis=0)
+
+
+  def associate(self, onsets):
+    """
+    onsets: (station, phase, time) tuples, phase 'P' or 'S', time as epoch float or UTCDateTime; unknown stations are ignored
+    """
+    p_sta, p_time = self._sorted(onsets, 'P')
+    s_sta, s_time = self._sorted(onsets, 'S')
+    p_used = np.zeros(len(p_time), dtype=bool)
+    s_used = np.zeros(len(s_time), dtype=bool)
+
+    events = []
+    for i in range(len(p_time)):
+      if p_used[i]:
+        continue
+      # CANDIDATE ONSETS: not associated yet, other stations, within the largest moveout after this first P
+      j = np.searchsorted(p_time, p_time[i] + self.max_moveout[p_sta[i]], side="right")
+      k = i + 1 + np.flatnonzero(~p_used[i+1:j] & (p_sta[i+1:j] != p_sta[i]))
+      if len(np.unique(p_sta[k])) + 1 < self.min_num_stations:
+        continue
+
+      # P RESIDUALS OF EVERY CANDIDATE ONSET FOR EVERY CANDIDATE SOURCE (nodes x onsets), ORIGIN TIME FROM THE FIRST P
+      res = np.abs((p_time[k] - p_time[i]).astype(np.float32) - (self.ttp[:, p_sta[k]] - self.ttp[:, p_sta[i]][:, None]))
+      ok = res < self.tolerance
+
+      # number of stations with a consistent onset (one per station), best source: most stations, then smallest residuals
+      order = np.argsort(p_sta[k], kind="stable")
+      starts = np.flatnonzero(np.r_[True, np.diff(p_sta[k][order]) != 0])
+      ok_station = np.logical_or.reduceat(ok[:, order], starts, axis=1)
+      nstations = 1 + ok_station.sum(axis=1)
+      best_count = nstations.max()
+      if best_count < self.min_num_stations:
+        continue
+      candidates = np.flatnonzero(nstations == best_count)
+      node = candidates[np.argmin(np.sum(np.where(ok[candidates], res[candidates], 0.), axis=1))]
+
+      # ASSOCIATED P ONSETS: the one with the smallest residual at each station
+      members = {p_sta[i]: (i, 0.)}
+      for m in np.flatnonzero(ok[node]):
+        station = p_sta[k[m]]
+        if station not in members or res[node, m] < members[station][1]:
+          members[station] = (k[m], res[node, m])
+      p_used[[m for m, r in members.values()]] = True
+      origin = np.mean([p_time[m] - self.ttp[node, station] for station, (m, r) in members.items()])
+
+      # ASSOCIATED S ONSETS: the closest to the predicted S time at each station of the event
+      picks_list = []
+      for station, (m, r) in sorted(members.items(), key=lambda item: p_time[item[1][0]]):
+        pick = [self.stations[station], p_time[m], int(r > self.tolerance/2.), None, None]
+        ts = origin + self.tts[node, station]
+        i1, i2 = np.searchsorted(s_time, [ts - self.s_tolerance, ts + self.s_tolerance])
+        cand = i1 + np.flatnonzero(~s_used[i1:i2] & (s_sta[i1:i2] == station) & (s_time[i1:i2] > p_time[m]))
+        if len(cand) > 0:
+          n = cand[np.argmin(np.abs(s_time[cand] - ts))]
+          s_used[n] = True
+          pick[3:] = [s_time[n], int(abs(s_time[n] - ts) > self.s_tolerance/2.)]
+        picks_list.append(tuple(pick))
+
+      events.append((UTCDateTime(p_time[i]), picks_list))
+    return events
+
+
+  def _sorted(self, onsets, phase):
+    # station indices and times of the onsets of one phase, sorted by time
+    sel = [(self.index[station], float(time)) for station, ph, time in onsets if ph == phase and station in self.index]
+    sta = np.array([s for s, t in sel], dtype=int)
+    time = np.array([t for s, t in sel], dtype=float)
+    order = np.argsort(time, kind="stable")
+    return sta[order], time[order]
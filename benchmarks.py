@@ -0,0 +1,765 @@
+import os, io, time, shutil, resource, argparse, tempfile, subprocess, tracemalloc, contextlib, multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from obspy.core import read, UTCDateTime, Stream, Trace
+from obspy.signal import trigger
+from scripts import bcolors, preprocess_stream, trace_view
+from stalta import pack_stream, pack_groups, classic_sta_lta_2d, recursive_sta_lta_2d, trigger_onset_2d, coincidence_events
+from hypo71 import hypo71
+import locator, traveltimes, matchedfilter, magnitude, msindex, preprocess
+from picks import PickStore
+from scripts import export_picksfile, find_coincidences, decimated_triggers
+from catalog import read_catalog, score_times
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  BEFORE/AFTER BENCHMARKS OF THE DETECTION AND LOCATION STEPS
+#  usage: python benchmarks.py <benchmark> [options]    (python benchmarks.py -h for the list)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# DEFAULTS (same as run-autodetect.py)
+msfile = "src/msfiles/STREAM_2019.09.29_2019.10.01"
+starttime = "2019-09-30 18:45:00"
+endtime   = "2019-09-30 19:25:00"
+
+freqmin = 3.5
+freqmax = 10
+tapering = 0.05
+sta = 0.5
+lta = 10
+thr_on = 3.
+thr_off = 1.5
+time_before = lta
+time_after = 60*2
+min_num_stations = 4
+deadtime_between_coincidences = 10
+deadtime_after_pphase = 3
+
+# stations of the archive and their sampling rates (--archive-rates)
+ARCHIVE_RATES = {'CALL': 25., 'COP2': 25., 'COPA': 25., 'MANZ': 25., 'MAYA': 25., 'TOL1': 20., 'LONQ': 50.}
+
+
+def timeit(func, *args, **kwargs):
+  """
+  runs func(*args, **kwargs) and returns (result, wall time in s, peak of traced memory in MB)
+  """
+  tracemalloc.start()
+  t0 = time.perf_counter()
+  result = func(*args, **kwargs)
+  dt = time.perf_counter() - t0
+  peak = tracemalloc.get_traced_memory()[1]/1024.**2
+  tracemalloc.stop()
+  return result, dt, peak
+
+
+def report(name, dt, peak, ref=None):
+  pattern = "    %-28s %9.3f s   %9.1f MB" % (name, dt, peak)
+  if ref is not None:
+    pattern += "   (speed-up x%.1f)" % (ref/dt)
+  print(pattern)
+
+
+def synthetic_stream(starttime, endtime, sampling_rate=100., rates=None):
+  """
+  gaussian noise for the Z, N and E channels of the stations of src/stations.net (when no miniSEED is at hand)
+  rates: optional dictionary station -> sampling rate (e.g. ARCHIVE_RATES): only these stations, at these rates
+  """
+  network_info = np.loadtxt("src/stations.net", dtype="str")
+  rng = np.random.default_rng(0)
+  st = Stream()
+  for network, station in zip(network_info.T[0], network_info.T[1]):
+    if rates is not None and station not in rates:
+      continue
+    rate = rates[station] if rates is not None else sampling_rate
+    npts = int((endtime - starttime)*rate)
+    for component in "ZNE":
+      header = {'network': network, 'station': station, 'channel': "HH"+component, 'sampling_rate': rate, 'starttime': starttime}
+      st.append(Trace(data=rng.normal(0., 1000., npts).astype(np.int32), header=header))
+  return st
+
+
+def read_preprocessed(args):
+  if args.synthetic:
+    st = synthetic_stream(UTCDateTime(args.starttime), UTCDateTime(args.endtime), rates=ARCHIVE_RATES if args.archive_rates else None)
+  else:
+    st = read(args.msfile, starttime=UTCDateTime(args.starttime), endtime=UTCDateTime(args.endtime))
+  return preprocess_stream(st, freqmin, freqmax, tapering)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+def _cut_copy(st, stations, times):
+  # before: deep copy of the whole stream for each station of each coincidence, then trim
+  npicks = 0
+  for timeX in times:
+    for stname in stations:
+      st_short = st.copy().select(station=stname)
+      st_short.trim(timeX - time_before, timeX + time_after)
+      for tr in st_short.select(channel="*Z"):
+        cft = trigger.recursive_sta_lta(tr.data, int(tr.stats.sampling_rate*sta), int(tr.stats.sampling_rate*lta))
+        npicks += len(trigger.trigger_onset(cft, thr_on, thr_off)) > 0
+  return npicks
+
+
+def _cut_view(st, stations, times):
+  # after: read-only views on the samples of the already filtered traces
+  npicks = 0
+  for timeX in times:
+    for stname in stations:
+      st_short = Stream([trace_view(tr, timeX - time_before, timeX + time_after) for tr in st.select(station=stname)])
+      for tr in st_short.select(channel="*Z"):
+        cft = trigger.recursive_sta_lta(tr.data, int(tr.stats.sampling_rate*sta), int(tr.stats.sampling_rate*lta))
+        npicks += len(trigger.trigger_onset(cft, thr_on, thr_off)) > 0
+  return npicks
+
+
+def bench_segments(args):
+  """
+  cutting of the short P/S picking segments: st.copy() + trim against zero-copy views
+  """
+  st = read_preprocessed(args)
+  stations = sorted(set(tr.stats.station for tr in st))
+  t1 = max(tr.stats.starttime for tr in st) + time_before
+  t2 = min(tr.stats.endtime for tr in st) - time_after
+  times = [t1 + i*(t2 - t1)/args.ncoincidences for i in range(args.ncoincidences)]
+
+  print(bcolors.BOLD + "\n+ Cutting %i stations x %i coincidences (%i traces, %i samples)" % (len(stations), len(times), len(st), sum(tr.stats.npts for tr in st)) + bcolors.ENDC)
+  n_copy, dt_copy, peak_copy = timeit(_cut_copy, st, stations, times)
+  n_view, dt_view, peak_view = timeit(_cut_view, st, stations, times)
+  report("st.copy() + trim", dt_copy, peak_copy)
+  report("trace_view", dt_view, peak_view, ref=dt_copy)
+  if n_copy != n_view:
+    print(bcolors.FAIL + "    different number of P triggers: %i / %i" % (n_copy, n_view) + bcolors.ENDC)
+
+
+
+
+def _stalta_obspy(st, func):
+  # before: one python-level call per channel
+  out = []
+  for tr in st:
+    cft = func(tr.data, int(tr.stats.sampling_rate*sta), int(tr.stats.sampling_rate*lta))
+    out.append((cft, trigger.trigger_onset(cft, thr_on, thr_off)))
+  return out
+
+
+def _stalta_2d(groups, func):
+  # after: all channels of each time base at once (stalta.pack_groups), rows in the order of the groups
+  cft, on_off = [], []
+  for data, starttime, sampling_rate, ids in groups:
+    group_cft = func(data, int(sampling_rate*sta), int(sampling_rate*lta))
+    cft += list(group_cft)
+    on_off += trigger_onset_2d(group_cft, thr_on, thr_off)
+  return cft, on_off
+
+
+def bench_stalta(args):
+  """
+  classic and recursive STA/LTA + trigger onsets: obspy channel by channel against the 2-D engine (one 2-D array per time base,
+  so that the mixed sampling rates of the archive, --archive-rates, are benchmarked as they are)
+  """
+  st = read_preprocessed(args)
+  groups = pack_groups(st)
+  traces = dict((tr.id, tr) for tr in st)
+  st = Stream([traces[trace_id] for data, starttime, sampling_rate, ids in groups for trace_id in ids])
+  print(bcolors.BOLD + "\n+ STA/LTA of %i channels, %i samples in %i time bases (%s Hz)" % (len(st), sum(data.size for data, _, _, _ in groups),
+        len(groups), "/".join("%g" % rate for rate in sorted(set(tr.stats.sampling_rate for tr in st)))) + bcolors.ENDC)
+
+  for name, func, func_2d in (("classic", trigger.classic_sta_lta, classic_sta_lta_2d), ("recursive", trigger.recursive_sta_lta, recursive_sta_lta_2d)):
+    ref, dt_ref, peak_ref = timeit(_stalta_obspy, st, func)
+    (cft, on_off), dt, peak = timeit(_stalta_2d, groups, func_2d)
+    report("%s (obspy)" % name, dt_ref, peak_ref)
+    report("%s (2-D engine)" % name, dt, peak, ref=dt_ref)
+
+    maxerr = max(np.max(np.abs(row - ref_cft)) for row, (ref_cft, _) in zip(cft, ref))
+    same = all(np.array_equal(np.reshape(ref_on_off, (-1, 2)), row) for row, (_, ref_on_off) in zip(on_off, ref))
+    color = bcolors.OKGREEN if same and maxerr < 1e-6 else bcolors.FAIL
+    print(color + "    max |cft - cft_obspy| = %.2e   same onsets: %s" % (maxerr, same) + bcolors.ENDC)
+
+
+
+
+def _get_stat_values_awk(info_file):
+  # before: station list read through a shell awk pipeline, for every event
+  cmd = 'awk \'/^/ {print $1,$8,$9,$10}\' '+info_file
+  process = subprocess.Popen(cmd,shell=True,stdout=subprocess.PIPE)
+  output = process.communicate()[0]
+  outlist = output.split(b'\n')
+  strlist = []
+  for i in range(len(outlist)-1):
+    stat_name,stat_lat,stat_lon,stat_ev = outlist[i].split(b' ')
+    lat_deg,lat_dec = stat_lat.split(b'.')
+    lon_deg,lon_dec = stat_lon.split(b'.')
+    minutes_lat = '%05.2f' % (float(b'0.'+lat_dec)*60.)
+    minutes_lon = '%05.2f' % (float(b'0.'+lon_dec)*60.)
+    stat_name = str(stat_name, 'utf-8')
+    stat_name = stat_name + '_'*(4 - len(stat_name)) if len(stat_name) in (2, 3) else stat_name
+    lat_mark = 'N' if float(lat_deg) >= 0. else 'S'
+    lon_mark = 'E' if float(lon_deg) >= 0. else 'W'
+    stat_e = '%4s' % (str(int(float(stat_ev))))
+    strlist.append('  '+stat_name+'%02i' % (abs(int(lat_deg)))+minutes_lat+lat_mark+'%03i' % (abs(int(lon_deg)))+minutes_lon+lon_mark+stat_e+' 00.00\n')
+  return strlist
+
+
+def _event_io_awk(path, hypolines, info_file, velmod):
+  # before: hypo71.inp with the awk station list, DATE line of hypo71.prt found by a second awk process
+  outfile = open(path+'/hypo71.inp','w')
+  outfile.writelines(_get_stat_values_awk(info_file))
+  outfile.writelines(hypo71.prepare_vmod(velmod))
+  outfile.writelines(hypolines)
+  outfile.close()
+  output = subprocess.Popen('awk \'/^  DATE/ {print NR}\' '+path+'/hypo71.prt', shell=True, stdout=subprocess.PIPE).communicate()[0]
+  dat = open(path+'/hypo71.prt').readlines()
+  return hypo71.parse_location(dat, int(output))
+
+
+def _event_io(path, hypolines, info_file, velmod):
+  # after: cached station block, DATE line found in python
+  hypo71.generate_input(path, hypolines, info_file, velmod)
+  return hypo71.read_output(path)
+
+
+def bench_hypo71io(args):
+  """
+  per-event overhead of locating with HYPO71 (writing hypo71.inp + reading hypo71.prt, without running hypo71pc): awk helper processes against pure python
+  """
+  info_file = "hypo71/info_file"
+  velmod = "hypo71/velmod.hdr"
+  picks = hypo71.prepare_picks("hypo71/picks.txt")
+  hypolines = picks[sorted(picks)[-1]]['hypolines']
+  path = tempfile.mkdtemp(prefix='hypo71_')
+  shutil.copy("hypo71/hypo71.prt", path)
+
+  print(bcolors.BOLD + "\n+ Input/output of %i events (%i phase lines each)" % (args.nevents, len(hypolines)) + bcolors.ENDC)
+  try:
+    ref, dt_awk, peak_awk = timeit(lambda: [_event_io_awk(path, hypolines, info_file, velmod) for i in range(args.nevents)])
+    out, dt, peak = timeit(lambda: [_event_io(path, hypolines, info_file, velmod) for i in range(args.nevents)])
+  finally:
+    shutil.rmtree(path, ignore_errors=True)
+  report("awk", dt_awk, peak_awk)
+  report("python + cached stations", dt, peak, ref=dt_awk)
+  print("    per event: %.2f ms -> %.2f ms" % (1e3*dt_awk/args.nevents, 1e3*dt/args.nevents))
+  if ref != out:
+    print(bcolors.FAIL + "    different locations read" + bcolors.ENDC)
+
+
+
+
+def bench_traveltimes(args):
+  """
+  travel-time tables: built from the model against loaded (memory-mapped) from the on-disk cache, and vectorized lookups
+  """
+  built, dt_build, peak_build = timeit(traveltimes.TravelTimeTable.from_model, args.model)
+  traveltimes.load(args.model)        # makes sure the cache file exists
+  traveltimes._tables.clear()         # ... and is read from disk, not from this process' memory
+  loaded, dt_load, peak_load = timeit(traveltimes.load, args.model)
+  print(bcolors.BOLD + "\n+ P and S tables of %s (%i depths x %i distances)" % (args.model, len(built.depths), len(built.distances)) + bcolors.ENDC)
+  report("build", dt_build, peak_build)
+  report("load (mmap)", dt_load, peak_load, ref=dt_build)
+
+  rng = np.random.default_rng(0)
+  distance = rng.uniform(0., built.distances[-1], args.npairs)
+  depth = rng.uniform(0., built.depths[-1], args.npairs)
+  phase = np.where(rng.uniform(size=args.npairs) < 0.5, 'P', 'S')
+  times, dt, peak = timeit(loaded.lookup, phase, distance, depth)
+  report("lookup of %i pairs" % args.npairs, dt, peak)
+  if not np.array_equal(times, built.lookup(phase, distance, depth)):
+    print(bcolors.FAIL + "    cached tables differ from the built ones" + bcolors.ENDC)
+
+
+def bench_locator(args):
+  """
+  native locator against the HYPO71 locations of hypo71/eq.pha (same picks: hypo71/picks.txt)
+  """
+  picks = hypo71.prepare_picks("hypo71/picks.txt")
+  ref = hypo71.read_pha("hypo71/eq.pha")
+  table, dt_table, peak_table = timeit(traveltimes.load, "src/model.cru")
+  outs, dt, peak = timeit(locator.locate_events, picks, table=table)
+  print(bcolors.BOLD + "\n+ Locating %i events" % len(outs) + bcolors.ENDC)
+  report("travel-time tables (load)", dt_table, peak_table)
+  report("grid search + geiger", dt, peak)
+
+  print("\n    %-3s %-22s %8s %8s %8s %6s   %-13s %-13s" % ("", "origin (hypo71)", "dt (s)", "dh (km)", "dz (km)", "depth", "rms (h71/np)", "gap (h71/np)"))
+  for n, (out, hyp) in enumerate(zip(outs, ref)):
+    if not out['goodness']:
+      print("    %-3i %-22s   not located" % (n+1, hyp['origin_time'].strftime("%Y-%m-%d %H:%M:%S.%f")[:22]))
+      continue
+    dh = locator.epicentral_distance(float(hyp['ev_lat']), float(hyp['ev_lon']), float(out['ev_lat']), float(out['ev_lon']))
+    dz = float(out['ev_depth']) - float(hyp['ev_depth'])
+    print("    %-3i %-22s %8.2f %8.1f %8.1f %6.1f   %5.2f / %-5.2f %5s / %-5s" % (n+1, hyp['origin_time'].strftime("%Y-%m-%d %H:%M:%S.%f")[:22], out['origin_time'] - hyp['origin_time'], 
+                                                                             dh, dz, float(out['ev_depth']), float(hyp['RMS']), float(out['RMS']), hyp['gap'], out['gap']))
+  if len(outs) != len(ref):
+    print(bcolors.WARNING + "    %i events in picks.txt, %i in eq.pha" % (len(outs), len(ref)) + bcolors.ENDC)
+
+
+
+
+def _picks_text(coincidences_dict, path):
+  # before: picks file written and parsed back with one UTCDateTime per pick
+  with contextlib.redirect_stdout(io.StringIO()):
+    export_picksfile(coincidences_dict, pickfile=path)
+  return hypo71.prepare_picks(path)
+
+
+def _picks_stream(path):
+  # phase lines of one event at a time, none kept (as locating while the file is read)
+  nlines = 0
+  for num, hypolines in hypo71.iter_picks(path):
+    nlines += len(hypolines)
+  return nlines
+
+
+def _picks_store(coincidences_dict, path):
+  # after: columnar store, binary file, phase lines from the arrays
+  PickStore.from_coincidences(coincidences_dict).save(path)
+  return PickStore.load(path).hypo71_picks()
+
+
+def bench_picks(args):
+  """
+  picks of many events to HYPO71 phase lines: picks.txt + prepare_picks (all events, or streamed by hypo71.iter_picks) against the
+  columnar store (picks.PickStore) and its .npz file
+  """
+  network_info = np.loadtxt("src/stations.net", dtype="str")
+  rng = np.random.default_rng(0)
+  coincidences_dict = {}
+  t = UTCDateTime(starttime).timestamp
+  for n in range(args.nevents):
+    t += rng.uniform(10., 100.)
+    stations = rng.choice(network_info.T[1], size=rng.integers(4, len(network_info)+1), replace=False)
+    coincidences_dict["Event_%03i" % (n+1)] = [(stname, t + rng.uniform(0., 20.), int(rng.integers(0, 2)), 
+                                                t + rng.uniform(20., 40.) if rng.uniform() < 0.5 else None, int(rng.integers(0, 2))) for stname in stations]
+
+  path = tempfile.mkdtemp(prefix='picks_')
+  try:
+    ref, dt_text, peak_text = timeit(_picks_text, coincidences_dict, path+"/picks.txt")
+    nlines, dt_stream, peak_stream = timeit(_picks_stream, path+"/picks.txt")
+    out, dt, peak = timeit(_picks_store, coincidences_dict, path+"/picks.npz")
+    size_text, size = os.path.getsize(path+"/picks.txt"), os.path.getsize(path+"/picks.npz")
+  finally:
+    shutil.rmtree(path, ignore_errors=True)
+
+  print(bcolors.BOLD + "\n+ %i events, %i picks" % (args.nevents, sum(len(picks_list) for picks_list in coincidences_dict.values())) + bcolors.ENDC)
+  report("picks.txt + prepare_picks", dt_text, peak_text)
+  report("picks.txt, streamed", dt_stream, peak_stream)
+  report("PickStore (.npz)", dt, peak, ref=dt_text)
+  print("    file size: %.1f MB -> %.1f MB" % (size_text/1024.**2, size/1024.**2))
+  same = sum(a == b for n in ref for a, b in zip(ref[n]['hypolines'], out[n]['hypolines']))
+  print("    same phase lines: %i of %i (%i streamed)" % (same, sum(len(ref[n]['hypolines']) for n in ref), nlines))
+
+
+
+
+def _wood_anderson_obspy(traces, inventory, pad):
+  # before: remove_response + simulate of each trace (response evaluated every time)
+  peaks = []
+  for tr in traces:
+    tr = tr.copy()
+    sampling_rate = tr.stats.sampling_rate
+    tr.remove_response(inventory, output="DISP", pre_filt=(0.5, 1., 0.4*sampling_rate, 0.45*sampling_rate), water_level=60)
+    tr.simulate(paz_simulate=magnitude.WOOD_ANDERSON)
+    i = int(round(pad*sampling_rate))
+    peaks.append(1000.*np.abs(tr.data[i:tr.stats.npts-i]).max())
+  return np.array(peaks)
+
+
+def _wood_anderson_vectorized(traces, inventory, pad):
+  # after: cached filter per channel, the segments of each sampling rate in one 2-D FFT
+  peaks = np.empty(len(traces))
+  for sampling_rate in set(tr.stats.sampling_rate for tr in traces):
+    rows = [i for i, tr in enumerate(traces) if tr.stats.sampling_rate == sampling_rate]
+    seed_ids = sorted(set(traces[i].id for i in rows))
+    nfft = magnitude.next_pow_2(2*traces[rows[0]].stats.npts)
+    filters = np.array([magnitude.wood_anderson_filter(inventory, seed_id, traces[rows[0]].stats.starttime, sampling_rate, nfft) for seed_id in seed_ids])
+    index = np.array([seed_ids.index(traces[i].id) for i in rows])
+    peaks[rows] = magnitude.peak_amplitudes(np.array([traces[i].data for i in rows]), filters, index, int(round(pad*sampling_rate)))
+  return peaks
+
+
+def bench_magnitude(args):
+  """
+  Wood-Anderson peak amplitudes of the horizontal segments of many events (src/dataless responses): obspy per trace against magnitude.py
+  """
+  inventory = magnitude.load_inventory()
+  rng = np.random.default_rng(0)
+  t = UTCDateTime(starttime)
+  traces = []
+  for seed_id in inventory.get_contents()['channels']:
+    network, station, location, channel = seed_id.split(".")
+    if channel[-1] not in "NE12":
+      continue
+    sampling_rate = inventory.select(network=network, station=station, location=location, channel=channel)[0][0][0].sample_rate
+    npts = int(round(65.*sampling_rate))
+    for n in range(args.nevents):
+      traces.append(Trace(data=rng.normal(0., 100., npts), header={'network': network, 'station': station, 'location': location, 
+                                                                   'channel': channel, 'sampling_rate': sampling_rate, 'starttime': t}))
+  pad = 10.   # s not searched at both ends
+
+  print(bcolors.BOLD + "\n+ Wood-Anderson amplitudes: %i events x %i channels" % (args.nevents, len(traces)//args.nevents) + bcolors.ENDC)
+  ref, dt_ref, peak_ref = timeit(_wood_anderson_obspy, traces, inventory, pad)
+  out, dt, peak = timeit(_wood_anderson_vectorized, traces, inventory, pad)
+  report("remove_response + simulate", dt_ref, peak_ref)
+  report("magnitude.peak_amplitudes", dt, peak, ref=dt_ref)
+  print("    largest Ml difference: %.4f" % np.max(np.abs(np.log10(out/ref))))
+
+
+
+
+def _preprocess_obspy(st):
+  # before: obspy Stream methods on one thread (each filter pass returns a new array)
+  st.detrend("demean")
+  st.taper(max_percentage=tapering, type="hann")
+  st.merge(method=1, fill_value='interpolate')
+  st.filter("bandpass", freqmin=freqmin, freqmax=freqmax)
+  st.sort()
+  for tr in st:
+    dt = tapering*(tr.stats.endtime-tr.stats.starttime)
+    tr.trim(tr.stats.starttime+dt, tr.stats.endtime-dt)
+  return st
+
+
+def _trace_throughput(raw, func):
+  # samples per second of func on each trace of raw (on a copy), one trace at a time
+  rates = []
+  for tr in raw:
+    tr = tr.copy()
+    t0 = time.perf_counter()
+    func(tr)
+    rates.append(tr.stats.npts/(time.perf_counter() - t0))
+  return np.array(rates)
+
+
+def _preprocess_trace_obspy(tr):
+  tr.detrend("demean")
+  tr.taper(max_percentage=tapering, type="hann")
+  tr.filter("bandpass", freqmin=freqmin, freqmax=freqmax)
+
+
+def _preprocess_trace(tr):
+  preprocess.demean_taper(tr, tapering)
+  preprocess.bandpass_inplace(tr, freqmin, freqmax)
+
+
+def bench_preprocess(args):
+  """
+  pre-processing only (demean, taper, merge, band-pass, corners removed): obspy Stream methods against scripts.preprocess_stream
+  (preprocess.py, in place, 1 and --threads threads); throughput in samples/s per trace and in total
+  """
+  if args.synthetic:
+    raw = synthetic_stream(UTCDateTime(args.starttime), UTCDateTime(args.endtime))
+  else:
+    raw = read(args.msfile, starttime=UTCDateTime(args.starttime), endtime=UTCDateTime(args.endtime))
+  nsamples = sum(tr.stats.npts for tr in raw)
+  print(bcolors.BOLD + "\n+ Pre-processing %i traces, %.1f M samples (%i cores)" % (len(raw), nsamples/1e6, os.cpu_count() or 1) + bcolors.ENDC)
+
+  st = raw.copy()
+  ref, dt_ref, peak_ref = timeit(_preprocess_obspy, st)
+  report("obspy Stream methods", dt_ref, peak_ref)
+  print("    %-28s %9.2f M samples/s" % ("  throughput", nsamples/dt_ref/1e6))
+  for threads in sorted(set([1, args.threads or os.cpu_count() or 1])):
+    st = raw.copy()
+    out, dt, peak = timeit(preprocess_stream, st, freqmin, freqmax, tapering, threads=threads)
+    report("preprocess_stream, %i thread%s" % (threads, "s" if threads > 1 else ""), dt, peak, ref=dt_ref)
+    print("    %-28s %9.2f M samples/s" % ("  throughput", nsamples/dt/1e6))
+  same = [tr.id for tr in out] == [tr.id for tr in ref] and all(np.array_equal(x.data, y.data) for x, y in zip(out, ref))
+  print("    same samples: %s" % same)
+
+  # one trace at a time, without merge (throughput of the trace kernels)
+  for name, func in (("obspy, per trace", _preprocess_trace_obspy), ("preprocess.py, per trace", _preprocess_trace)):
+    rates = _trace_throughput(raw, func)
+    print("    %-28s median %.2f, min %.2f, max %.2f M samples/s" % (name, np.median(rates)/1e6, rates.min()/1e6, rates.max()/1e6))
+
+
+
+
+def _inject_events(st, catalog):
+  # adds a P (Z, weaker on N/E) and an S (N/E) wavelet of every catalog event to the traces, at the travel times of
+  # src/model.cru, with an amplitude growing with Ml and decaying with distance
+  stations = locator.read_stations("src/stations.net")
+  table = traveltimes.load("src/model.cru")
+  t = np.arange(0., 4., 0.01)
+  wavelet = np.sin(2*np.pi*6.*t)*np.exp(-t/0.6)
+  for event in catalog:
+    for tr in st:
+      if tr.stats.station not in stations:
+        continue
+      stlat, stlon = stations[tr.stats.station]
+      distance = locator.epicentral_distance(event['lat'], event['lon'], stlat, stlon)
+      amplitude = 10000.*10**(event['ml'] - 2.)*20./max(np.hypot(distance, event['depth']), 20.)
+      for phase, scale in (("P", 1. if tr.stats.channel.endswith("Z") else 0.3), ("S", 0.3 if tr.stats.channel.endswith("Z") else 1.5)):
+        i = int(round((event['origin_time'] + float(table.lookup(phase, distance, event['depth'])) - tr.stats.starttime.timestamp)*tr.stats.sampling_rate))
+        w = np.interp(np.arange(len(t))/tr.stats.sampling_rate, t, wavelet)[:max(min(len(t), tr.stats.npts - i), 0)]
+        if i >= 0 and len(w) > 0:
+          tr.data[i:i+len(w)] += (scale*amplitude*w).astype(tr.data.dtype)
+  return st
+
+
+def _coincidence_trigger(st, trigger_rate):
+  # trigger stage only: obspy's coincidence_trigger at full rate, or the Z channels decimated one at a time (scripts.decimated_triggers)
+  if trigger_rate is None:
+    return trigger.coincidence_trigger("recstalta", thr_on=thr_on, thr_off=thr_off, stream=st.select(channel="*Z"), thr_coincidence_sum=min_num_stations,
+                                       sta=sta, lta=lta, trigger_off_extension=0, similarity_threshold=0.7, details=True)
+  return coincidence_events(decimated_triggers(st.select(channel="*Z"), trigger_rate, sta, lta, thr_on, thr_off, freqmax), min_num_stations)
+
+
+def bench_tworate(args):
+  """
+  coincidence trigger at full rate against the Z channels decimated to --trigger-rate (picks at full rate in both): time and memory
+  of the trigger stage, recall against src/catalogo.txt (with --synthetic, the catalog events are added to the noise), pick differences
+  """
+  catalog = read_catalog("src/catalogo.txt", UTCDateTime(args.starttime), UTCDateTime(args.endtime))
+  if args.synthetic:
+    raw = _inject_events(synthetic_stream(UTCDateTime(args.starttime), UTCDateTime(args.endtime), rates=ARCHIVE_RATES if args.archive_rates else None), catalog)
+  else:
+    raw = read(args.msfile, starttime=UTCDateTime(args.starttime), endtime=UTCDateTime(args.endtime))
+  st = preprocess_stream(raw, freqmin, freqmax, tapering)
+  z = st.select(channel="*Z")
+  rates = dict((tr.stats.station, tr.stats.sampling_rate) for tr in z)
+  decimated = [tr.id for tr in z if preprocess.decimate_trace(tr, args.trigger_rate, freqmax).stats.sampling_rate < tr.stats.sampling_rate]
+  print(bcolors.BOLD + "\n+ Coincidence trigger over %i Z channels at %s Hz and at %g Hz, %i catalog events" %
+        (len(z), "/".join("%g" % rate for rate in sorted(set(rates.values()))), args.trigger_rate, len(catalog)) + bcolors.ENDC)
+  print("    %i of %i Z channels decimated (freqmax = %g Hz): %s" % (len(decimated), len(z), freqmax, ", ".join(decimated) or "none"))
+
+  # the native trigger without decimation (target at the highest rate: factor 1 everywhere) separates the gain of the decimation
+  # from the one of the native coincidence
+  ref, dt_ref, peak_ref = timeit(_coincidence_trigger, st, None)
+  native, dt_native, peak_native = timeit(_coincidence_trigger, st, max(rates.values()))
+  out, dt, peak = timeit(_coincidence_trigger, st, args.trigger_rate)
+  report("trigger, full rate", dt_ref, peak_ref)
+  report("trigger, native, full rate", dt_native, peak_native, ref=dt_ref)
+  report("trigger, native, decimated", dt, peak, ref=dt_ref)
+  print("    decimation alone: speed-up x%.1f, memory ratio x%.1f" % (dt_native/dt, peak_native/peak))
+
+  # whole detection (trigger + full-rate picks), scored against the catalog; picks of the coincidences found both ways
+  for cache_cft in (False, True):
+    results = []
+    for trigger_rate in (None, args.trigger_rate):
+      with contextlib.redirect_stdout(io.StringIO()):
+        coincidences = find_coincidences(st, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before,
+                                         time_after, deadtime_after_pphase, cache_cft=cache_cft, trigger_rate=trigger_rate,
+                                         freqmax=freqmax)
+      results.append(coincidences)
+      score = score_times([float(c[0].timestamp) for c in coincidences], catalog['origin_time'])
+      name = "full rate" if trigger_rate is None else "trigger at %g Hz" % trigger_rate
+      print("    %-28s %i detections, %i/%i events (recall %.3f, precision %.3f)" %
+            (name + (", cache_cft" if cache_cft else ""), score['ndetections'], score['hits'], score['nevents'], score['recall'], score['precision']))
+
+    diffs = []
+    for time_ref, picks_ref in results[0]:
+      same = [picks for t, picks in results[1] if abs(t - time_ref) < 1.]
+      picks = dict((pick[0], pick) for pick in same[0]) if len(same) > 0 else {}
+      for pick in picks_ref:
+        if pick[0] in picks:
+          diffs.append(abs(pick[1] - picks[pick[0]][1])*rates[pick[0]])
+          if pick[3] is not None and picks[pick[0]][3] is not None:
+            diffs.append(abs(pick[3] - picks[pick[0]][3])*rates[pick[0]])
+    if len(diffs) > 0:
+      diffs = np.array(diffs)
+      print("    %i common picks: %.1f %% identical, %.1f %% within one sample, largest difference %.1f samples" %
+            (len(diffs), 100.*np.mean(diffs < 1e-6), 100.*np.mean(diffs <= 1. + 1e-6), diffs.max()))
+
+
+
+
+def _detect_rss(args, dtype, cache_cft):
+  # run in a fresh process: pre-processing + detection in dtype, returns (coincidences, sampling rate, time in s, peak RSS in MB
+  # before and after)
+  rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+  t0 = time.perf_counter()
+  if args.synthetic:
+    catalog = read_catalog("src/catalogo.txt", UTCDateTime(args.starttime), UTCDateTime(args.endtime))
+    raw = _inject_events(synthetic_stream(UTCDateTime(args.starttime), UTCDateTime(args.endtime)), catalog)
+  else:
+    raw = read(args.msfile, starttime=UTCDateTime(args.starttime), endtime=UTCDateTime(args.endtime))
+  with contextlib.redirect_stdout(io.StringIO()):
+    st = preprocess_stream(raw, freqmin, freqmax, tapering, dtype=dtype)
+    coincidences = find_coincidences(st, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before,
+                                     time_after, deadtime_after_pphase, cache_cft=cache_cft)
+  return coincidences, st[0].stats.sampling_rate, time.perf_counter() - t0, rss0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+def bench_float32(args):
+  """
+  detection (pre-processing, trigger, picks) in float64 and in float32, each in a fresh process: peak RSS, and pick times of the
+  float32 mode against the float64 ones (in samples)
+  """
+  context = multiprocessing.get_context("spawn")
+  for cache_cft in (False, True):
+    print(bcolors.BOLD + "\n+ Detection in float64 and float32%s" % (" (cache_cft)" if cache_cft else "") + bcolors.ENDC)
+    results = []
+    for dtype in (np.float64, np.float32):
+      with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        coincidences, df, dt, rss0, rss = pool.submit(_detect_rss, args, dtype, cache_cft).result()
+      results.append(coincidences)
+      print("    %-8s %3i detections  %8.3f s   peak RSS %7.1f MB (%6.1f MB above the imports)" % (np.dtype(dtype).name, len(coincidences), dt, rss, rss - rss0))
+
+    diffs, missing = [], 0
+    for time_ref, picks_ref in results[0]:
+      same = [picks for t, picks in results[1] if abs(t - time_ref) < 1.]
+      if len(same) == 0:
+        missing += 1
+        continue
+      picks = dict((pick[0], pick) for pick in same[0])
+      for pick in picks_ref:
+        if pick[0] not in picks:
+          missing += 1
+          continue
+        diffs.append(abs(pick[1] - picks[pick[0]][1]))
+        if pick[3] is not None and picks[pick[0]][3] is not None:
+          diffs.append(abs(pick[3] - picks[pick[0]][3]))
+    if len(diffs) > 0:
+      diffs = np.array(diffs)*df
+      within = np.mean(diffs <= 1. + 1e-6)
+      color = bcolors.OKGREEN if within == 1. and missing == 0 else bcolors.FAIL
+      print(color + "    %i picks: %.1f %% identical, %.1f %% within one sample, largest difference %.2f samples, %i events/stations missing" %
+            (len(diffs), 100.*np.mean(diffs < 1e-6), 100.*within, diffs.max(), missing) + bcolors.ENDC)
+
+
+
+
+def bench_msindex(args):
+  """
+  windows of a miniSEED file: obspy read(starttime, endtime) of the whole file against msindex.read_window on its record index
+  """
+  tmpdir = tempfile.mkdtemp()
+  try:
+    if args.synthetic:
+      path = os.path.join(tmpdir, "synthetic.mseed")
+      synthetic_stream(UTCDateTime(args.starttime), UTCDateTime(args.endtime)).write(path, format="MSEED", reclen=512, encoding="STEIM2")
+    else:
+      path = os.path.join(tmpdir, os.path.basename(args.msfile))   # copy, so that no index is left next to the data
+      shutil.copy(args.msfile, path)
+
+    index, dt_scan, peak_scan = timeit(msindex.load_index, path)
+    t1, t2 = index['start'].min(), index['end'].max()
+    rng = np.random.default_rng(0)
+    windows = [(UTCDateTime(t), UTCDateTime(t + args.window)) for t in rng.uniform(t1, max(t1, t2 - args.window), args.nwindows)]
+    print(bcolors.BOLD + "\n+ %i windows of %i s of a %.1f h file (%i records, %.1f MB)" %
+          (args.nwindows, args.window, (t2 - t1)/3600., len(index), os.path.getsize(path)/1024.**2) + bcolors.ENDC)
+    ref, dt_ref, peak_ref = timeit(lambda: [read(path, starttime=w1, endtime=w2) for w1, w2 in windows])
+    out, dt, peak = timeit(lambda: [msindex.read_window(path, w1, w2) for w1, w2 in windows])
+    report("index scan (once)", dt_scan, peak_scan)
+    report("read(starttime, endtime)", dt_ref, peak_ref)
+    report("msindex.read_window", dt, peak, ref=dt_ref)
+    same = all(len(a) == len(b) and all(x.id == y.id and x.stats.starttime == y.stats.starttime and np.array_equal(x.data, y.data)
+                                        for x, y in zip(sorted(a, key=lambda tr: (tr.id, tr.stats.starttime)), 
+                                                        sorted(b, key=lambda tr: (tr.id, tr.stats.starttime)))) for a, b in zip(ref, out))
+    print("    same traces: %s" % same)
+  finally:
+    shutil.rmtree(tmpdir)
+
+
+
+
+def _mixed_rates(st, rates=(20., 25., 50.), stagger=30.):
+  # the stations of st decimated in turn to each of rates (when the factor is an integer) and starting stagger s after each other,
+  # as the archive (TOL1 at 20 Hz, the GM BH? channels at 25 Hz, LONQ at 50 Hz)
+  mixed = Stream()
+  for k, station in enumerate(sorted(set(tr.stats.station for tr in st))):
+    for tr in st.select(station=station):
+      factor = tr.stats.sampling_rate/rates[k % len(rates)]
+      if factor > 1 and factor == int(factor):
+        tr = preprocess.decimate_trace(tr, rates[k % len(rates)])
+      mixed.append(trace_view(tr, tr.stats.starttime + (k % 3)*stagger, tr.stats.endtime))
+  return mixed
+
+
+def bench_matchedfilter(args):
+  """
+  matched-filter scan (FFT correlation of every channel with all templates + stacking): time per hour of data, extrapolated to one day,
+  also with mixed sampling rates and staggered start times
+  """
+  st = read_preprocessed(args)
+  stations = locator.read_stations("src/stations.net")
+  table = traveltimes.load("src/model.cru")
+  rng = np.random.default_rng(0)
+  t1 = max(tr.stats.starttime for tr in st)
+  hours = (min(tr.stats.endtime for tr in st) - t1)/3600.
+
+  # templates cut from the data itself at random origins, with the moveout of random sources around the network
+  events = []
+  for n in range(args.ntemplates):
+    origin = t1 + 60 + rng.uniform(0, 600)
+    lat, lon = rng.uniform(-38.5, -37.5), rng.uniform(-72., -71.)
+    tt = dict((stname, locator.epicentral_distance(lat, lon, stlat, stlon)) for stname, (stlat, stlon) in stations.items())
+    events.append({'origin_time': origin, 'Tobs': dict((stname, float(table.lookup('P', d, 10.))) for stname, d in tt.items()),
+                   'TobsS': dict((stname, float(table.lookup('S', d, 10.))) for stname, d in tt.items())})
+  templates = matchedfilter.make_templates(st, events)
+
+  print(bcolors.BOLD + "\n+ Matched filter: %i templates x %i channels, %.2f h of data" % (len(templates), len(st), hours) + bcolors.ENDC)
+  detections, dt, peak = timeit(matchedfilter.scan_stream, st, templates)
+  report("scan_stream", dt, peak)
+  print("    %.1f s per hour of data -> %.1f min per day on one core (%i detections)" % (dt/hours, 24*dt/hours/60., len(detections)))
+
+  # SAME TEMPLATES CUT FROM THE MIXED-RATE STREAM (each channel correlated at its own rate and over its own span)
+  st = _mixed_rates(st)
+  templates = matchedfilter.make_templates(st, events)
+  rates = sorted(set(tr.stats.sampling_rate for tr in st))
+  print(bcolors.BOLD + "\n+ Mixed rates (%s Hz), staggered starts: %i templates x %i channels" % (", ".join("%g" % rate for rate in rates), len(templates), len(st)) + bcolors.ENDC)
+  detections, dt, peak = timeit(matchedfilter.scan_stream, st, templates)
+  report("scan_stream (mixed rates)", dt, peak)
+  print("    %.1f s per hour of data -> %.1f min per day on one core (%i detections)" % (dt/hours, 24*dt/hours/60., len(detections)))
+
+
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="before/after benchmarks of the detection and location steps")
+  parser.add_argument("--msfile", default=msfile, help="miniSEED file (default: %(default)s)")
+  parser.add_argument("--starttime", default=starttime, help="default: %(default)s")
+  parser.add_argument("--endtime", default=endtime, help="default: %(default)s")
+  parser.add_argument("--synthetic", action="store_true", help="use gaussian noise for the stations of src/stations.net instead of --msfile")
+  parser.add_argument("--archive-rates", action="store_true", help="with --synthetic, only the stations of the archive at their sampling rates (ARCHIVE_RATES: 20/25/50 Hz) instead of all at 100 Hz")
+  subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+  p = subparsers.add_parser("segments", help=bench_segments.__doc__.strip())
+  p.add_argument("--ncoincidences", type=int, default=20)
+  p.set_defaults(func=bench_segments)
+
+  p = subparsers.add_parser("stalta", help=bench_stalta.__doc__.strip())
+  p.set_defaults(func=bench_stalta)
+
+  p = subparsers.add_parser("hypo71io", help=bench_hypo71io.__doc__.strip())
+  p.add_argument("--nevents", type=int, default=200)
+  p.set_defaults(func=bench_hypo71io)
+
+  p = subparsers.add_parser("traveltimes", help=bench_traveltimes.__doc__.strip())
+  p.add_argument("--model", default="src/model.cru")
+  p.add_argument("--npairs", type=int, default=1000000)
+  p.set_defaults(func=bench_traveltimes)
+
+  p = subparsers.add_parser("matchedfilter", help=bench_matchedfilter.__doc__.strip())
+  p.add_argument("--ntemplates", type=int, default=8)
+  p.set_defaults(func=bench_matchedfilter)
+
+  p = subparsers.add_parser("picks", help=bench_picks.__doc__.strip())
+  p.add_argument("--nevents", type=int, default=20000)
+  p.set_defaults(func=bench_picks)
+
+  p = subparsers.add_parser("magnitude", help=bench_magnitude.__doc__.strip())
+  p.add_argument("--nevents", type=int, default=50)
+  p.set_defaults(func=bench_magnitude)
+
+  p = subparsers.add_parser("preprocess", help=bench_preprocess.__doc__.strip())
+  p.add_argument("--threads", type=int, default=None, help="default: number of cores")
+  p.set_defaults(func=bench_preprocess)
+
+  p = subparsers.add_parser("tworate", help=bench_tworate.__doc__.strip())
+  p.add_argument("--trigger-rate", type=float, default=25.)
+  p.set_defaults(func=bench_tworate)
+
+  p = subparsers.add_parser("float32", help=bench_float32.__doc__.strip())
+  p.set_defaults(func=bench_float32)
+
+  p = subparsers.add_parser("msindex", help=bench_msindex.__doc__.strip())
+  p.add_argument("--window", type=float, default=40*60)
+  p.add_argument("--nwindows", type=int, default=20)
+  p.set_defaults(func=bench_msindex)
+
+  p = subparsers.add_parser("locator", help=bench_locator.__doc__.strip())
+  p.set_defaults(func=bench_locator)
+
+  args = parser.parse_args()
+  args.func(args)
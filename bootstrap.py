@@ -0,0 +1,97 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import locator, traveltimes
+from hypo71 import hypo71
+from picks import PickStore, EVENT_DTYPE
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  BOOTSTRAP LOCATION UNCERTAINTY
+#  every located event is relocated niter times with its arrival times perturbed by
+#  gaussian noise; the spread of the relocations gives the errors in km east (errx),
+#  north (erry) and depth (errz) and the epicentral error ellipse. The perturbed copies
+#  of one event are relocated together: one Geiger run vectorized over the copies
+#  (numpy backend) or one single hypo71pc run with a copy per event block (hypo71
+#  backend). The events are spread over a process pool
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+def perturbed_readings(readings, niter, sigma, rng):
+  """
+  niter copies of the readings of one event (rows of a picks.PickStore) with times perturbed by gaussian noise of sigma s,
+  as one store (one event per copy)
+  """
+  picks = np.tile(readings, niter)
+  picks['event'] = np.repeat(np.arange(1, niter+1), len(readings))
+  picks['time'] += rng.normal(0., sigma, size=len(picks))
+  events = np.zeros(niter, dtype=EVENT_DTYPE)
+  events['event'] = np.arange(1, niter+1)
+  events['time'] = picks['time'].reshape(niter, -1).min(axis=1) if len(readings) > 0 else np.nan
+  return PickStore(picks, events)
+
+
+def error_stats(lats, lons, depths, origins):
+  """
+  spread of the relocations of one event: standard deviations in km east (errx), north (erry) and depth (errz) and of the
+  origin time in s (errt), 1-sigma epicentral error ellipse (smajor, sminor in km, azimuth of the major axis in degrees from north)
+  """
+  lat0 = np.mean(lats)
+  dx = (lons - np.mean(lons))*locator.KM_PER_DEG*np.cos(np.radians(lat0))
+  dy = (lats - lat0)*locator.KM_PER_DEG
+  evals, evecs = np.linalg.eigh(np.cov(np.vstack((dx, dy))))   # ascending eigenvalues
+  return {'errx': float(np.std(dx, ddof=1)), 'erry': float(np.std(dy, ddof=1)), 'errz': float(np.std(depths, ddof=1)), 
+          'errt': float(np.std(origins, ddof=1)), 'smajor': float(np.sqrt(max(evals[1], 0.))), 'sminor': float(np.sqrt(max(evals[0], 0.))),
+          'azimuth': float(np.degrees(np.arctan2(evecs[0, 1], evecs[1, 1])) % 180.), 'nboot': len(lats)}
+
+
+def bootstrap_event(readings, hypocenter, niter=200, sigma=0.2, seed=0, backend="numpy", station_file="src/stations.net",
+                    model_file="src/model.cru", info_file="hypo71/info_file", velmod="hypo71/velmod.hdr"):
+  """
+  + RELOCATE ONE EVENT niter TIMES WITH ITS ARRIVAL TIMES PERTURBED BY GAUSSIAN NOISE OF sigma s
+  + RETURN THE DICTIONARY OF error_stats (None IF LESS THAN 3 RELOCATIONS)
+  readings: rows of the event in a picks.PickStore (PICK_DTYPE)
+  hypocenter: (lat, lon, depth) of the event, starting point of the relocations (numpy backend: no grid search)
+  seed: seed of the noise of this event, so that the results do not depend on the number of workers
+  """
+  rng = np.random.default_rng(seed)
+  if backend == "numpy":
+    stations = locator.read_stations(station_file)
+    table = traveltimes.load(model_file)
+    stnames = hypo71.station_names(readings['station']).tolist()
+    usable = locator.weighted_readings(stnames, readings['phase'], readings['time'], readings['weight'].astype(int), stations)
+    if usable is None:
+      return None
+    stnames, phases, times, w, stlat, stlon = usable
+    tobs = (times - times.min()) + rng.normal(0., sigma, size=(niter, len(times)))
+    origins, lats, lons, depths, res = locator.relocate(stlat, stlon, phases, tobs, w, table, *hypocenter)
+  else:
+    # all copies in one hypo71pc run, each copy as one event of the input file
+    outs = hypo71.locate_events_batch(perturbed_readings(readings, niter, sigma, rng).hypo71_picks(), info_file, velmod)
+    outs = [out for out in outs if out['goodness']]
+    lats = np.array([float(out['ev_lat']) for out in outs])
+    lons = np.array([float(out['ev_lon']) for out in outs])
+    depths = np.array([float(out['ev_depth']) for out in outs])
+    origins = np.array([out['origin_time'].timestamp for out in outs])
+  if len(lats) < 3:
+    return None
+  return error_stats(lats, lons, depths, origins - np.mean(origins))
+
+
+def bootstrap_events(store, hypocenters, niter=200, sigma=0.2, seed=0, backend="numpy", workers=None, **kwargs):
+  """
+  + BOOTSTRAP (see bootstrap_event) OF THE EVENTS OF store (picks.PickStore) LOCATED AT hypocenters
+  hypocenters: dictionary event id -> (lat, lon, depth); only these events are relocated
+  workers: number of processes (default: number of cores)
+  returns a dictionary event id -> error_stats dictionary (or None)
+  """
+  if workers is None:
+    workers = os.cpu_count() or 1
+  events = [(event, readings) for event, readings in store.by_event() if event in hypocenters]
+  calls = [(readings, hypocenters[event], niter, sigma, (seed, event), backend) for event, readings in events]
+  if workers > 1 and len(calls) > 1:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = [pool.submit(bootstrap_event, *args, **kwargs) for args in calls]
+      results = [future.result() for future in futures]
+  else:
+    results = [bootstrap_event(*args, **kwargs) for args in calls]
+  return dict((event, result) for (event, readings), result in zip(events, results))
@@ -0,0 +1,234 @@
+import numpy as np
+from obspy.core import UTCDateTime
+from locator import epicentral_distance
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  CATALOG COMPARISON
+#  the reference catalog (src/catalogo.txt) and the located events (hypo71/eq.pha or the
+#  events_dict of runHypo71) are read into structured arrays (one row per event, one
+#  column per field, origin times as epoch floats) and matched on their sorted origin
+#  times, within a time and an epicentral distance tolerance
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+CATALOG_DTYPE = np.dtype([('evid', 'i4'), ('origin_time', 'f8'), ('lon', 'f8'), ('lat', 'f8'), ('depth', 'f8'), ('ml', 'f8'),
+                          ('errx', 'f8'), ('erry', 'f8'), ('errz', 'f8'), ('status', 'U16')])
+
+# columns of the catalog file as read by np.loadtxt
+_CATALOG_COLUMNS = np.dtype([('evid', 'U16'), ('date', 'U10'), ('time', 'U16'), ('lon', 'f8'), ('lat', 'f8'), ('depth', 'f8'), ('ml', 'f8'),
+                             ('errx', 'f8'), ('erry', 'f8'), ('errz', 'f8'), ('status', 'U16')])
+
+EVENT_DTYPE = np.dtype([('evid', 'i4'), ('origin_time', 'f8'), ('lat', 'f8'), ('lon', 'f8'), ('depth', 'f8'), ('nphases', 'i4'),
+                        ('gap', 'f8'), ('rms', 'f8')])
+
+
+def _select(events, starttime, endtime):
+  # events sorted by origin time, optionally only starttime <= origin time < endtime
+  events = events[np.argsort(events['origin_time'], kind="stable")]
+  if starttime is not None:
+    events = events[events['origin_time'] >= UTCDateTime(starttime).timestamp]
+  if endtime is not None:
+    events = events[events['origin_time'] < UTCDateTime(endtime).timestamp]
+  return events
+
+
+def read_catalog(catalog_file="src/catalogo.txt", starttime=None, endtime=None):
+  """
+  reads the catalog, lines like
+  [155]   2019-09-29 13:06:02   -71.6024 -38.3997     8.0 km    Ml 4.0     3.6 km   5.7 km   5.4 km     manual
+  returns a structured array (CATALOG_DTYPE) sorted by origin time (epoch floats), optionally only starttime <= origin time < endtime
+  """
+  columns = np.loadtxt(catalog_file, dtype=_CATALOG_COLUMNS, usecols=(0, 1, 2, 3, 4, 5, 8, 9, 11, 13, 15), comments="#", ndmin=1)
+  catalog = np.zeros(len(columns), dtype=CATALOG_DTYPE)
+  catalog['evid'] = np.char.strip(columns['evid'], "[]").astype(int)
+  catalog['origin_time'] = np.char.add(np.char.add(columns['date'], "T"), columns['time']).astype("datetime64[ms]").astype(np.int64)/1e3
+  for name in ('lon', 'lat', 'depth', 'ml', 'errx', 'erry', 'errz', 'status'):
+    catalog[name] = columns[name]
+  return _select(catalog, starttime, endtime)
+
+
+def read_events(event_file="hypo71/eq.pha", starttime=None, endtime=None):
+  """
+  reads the event lines of a .pha file (hypo71.write_pha), e.g.
+  # 2019 09 30 18 58 52.21 -37.5005 -71.4992 35.00  13 144.00 1.7500 0.0 1
+  returns a structured array (EVENT_DTYPE) sorted by origin time, optionally only starttime <= origin time < endtime
+  """
+  infile = open(event_file, "r")
+  lines = [line[1:] for line in infile if line[0] == "#"]
+  infile.close()
+
+  events = np.zeros(len(lines), dtype=EVENT_DTYPE)
+  if len(lines) > 0:
+    fields = np.loadtxt(lines, usecols=tuple(range(12)) + (-1,), ndmin=2)
+    year, month, day, hour, minute = fields[:, :5].astype(int).T
+    date = (year - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (month - 1).astype("timedelta64[M]")
+    days = date.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+    events['origin_time'] = days.astype(np.int64)*86400. + hour*3600. + minute*60. + fields[:, 5]
+    for column, name in ((6, 'lat'), (7, 'lon'), (8, 'depth'), (9, 'nphases'), (10, 'gap'), (11, 'rms'), (12, 'evid')):
+      events[name] = fields[:, column]
+  return _select(events, starttime, endtime)
+
+
+def events_to_array(events_dict, starttime=None, endtime=None):
+  """
+  returns the events_dict of scripts.runHypo71 (Event_001: {'origin_time', 'evlat', 'evlon', 'evdep', 'nphases', 'gap', 'rms'}, ...)
+  as a structured array (EVENT_DTYPE) sorted by origin time, optionally only starttime <= origin time < endtime
+  """
+  events = np.zeros(len(events_dict), dtype=EVENT_DTYPE)
+  for n, evname in enumerate(events_dict):
+    info = events_dict[evname]
+    events[n] = (int(evname.split("_")[-1]), info['origin_time'].timestamp, info['evlat'], info['evlon'], info['evdep'], info['nphases'],
+                 info['gap'], info['rms'])
+  return _select(events, starttime, endtime)
+
+
+def match_times(times, origin_times, before=5., after=30.):
+  """
+  one-to-one matching of detection times to catalog origin times (epoch floats): in time order, each catalog event takes
+  the first detection not matched yet within [origin time - before, origin time + after]
+  returns the index arrays (catalog, detection) of the matched pairs
+  """
+  times = np.asarray(times, dtype=float)
+  origin_times = np.asarray(origin_times, dtype=float)
+  order = np.argsort(times, kind="stable")
+  sorted_times = times[order]
+  first = np.searchsorted(sorted_times, origin_times - before, side="left")
+  last = np.searchsorted(sorted_times, origin_times + after, side="right")
+
+  cat_idx, det_idx = [], []
+  next_free = 0
+  for n in np.argsort(origin_times, kind="stable"):
+    i = max(first[n], next_free)
+    if i < last[n]:
+      cat_idx.append(n)
+      det_idx.append(order[i])
+      next_free = i + 1
+  return np.array(cat_idx, dtype=int), np.array(det_idx, dtype=int)
+
+
+def score_times(times, origin_times, before=5., after=30.):
+  """
+  precision, recall and time differences (detection - origin time) of the detection times against the catalog origin times
+  returns a dictionary: ndetections, nevents, hits, precision, recall, f1, dt_median, dt_mad (s; nan without hits)
+  """
+  cat_idx, det_idx = match_times(times, origin_times, before=before, after=after)
+  hits = len(cat_idx)
+  precision = hits/float(len(times)) if len(times) > 0 else 0.
+  recall = hits/float(len(origin_times)) if len(origin_times) > 0 else 0.
+  dt = np.asarray(times, dtype=float)[det_idx] - np.asarray(origin_times, dtype=float)[cat_idx]
+  return {'ndetections': len(times), 'nevents': len(origin_times), 'hits': hits, 'precision': precision, 'recall': recall,
+          'f1': 2.*precision*recall/(precision + recall) if hits > 0 else 0.,
+          'dt_median': float(np.median(dt)) if hits > 0 else np.nan,
+          'dt_mad': float(np.median(np.abs(dt - np.median(dt)))) if hits > 0 else np.nan}
+
+
+def match_events(reference, events, max_dt=5., max_distance=20.):
+  """
+  one-to-one matching of events to reference events (structured arrays with origin_time, lat, lon): candidate pairs are within max_dt s
+  (binary search on the sorted origin times) and max_distance km of epicentral distance, the pairs with the smallest 
+  |dt|/max_dt + distance/max_distance are taken first
+  returns the index arrays (reference, events) of the matched pairs, in reference order
+  """
+  ref_time = reference['origin_time']
+  order = np.argsort(events['origin_time'], kind="stable")
+  ev_time = events['origin_time'][order]
+
+  # CANDIDATE PAIRS WITHIN max_dt
+  first = np.searchsorted(ev_time, ref_time - max_dt, side="left")
+  count = np.searchsorted(ev_time, ref_time + max_dt, side="right") - first
+  ref_idx = np.repeat(np.arange(len(reference)), count)
+  ev_idx = order[np.repeat(first - np.cumsum(count) + count, count) + np.arange(count.sum())]
+  dt = np.abs(events['origin_time'][ev_idx] - ref_time[ref_idx])
+  dist = epicentral_distance(reference['lat'][ref_idx], reference['lon'][ref_idx], events['lat'][ev_idx], events['lon'][ev_idx])
+  ok = (dt <= max_dt) & (dist <= max_distance)
+  ref_idx, ev_idx = ref_idx[ok], ev_idx[ok]
+  cost = dt[ok]/max_dt + dist[ok]/max_distance
+
+  # GREEDY ASSIGNMENT IN ROUNDS: the pairs that are the best one of both their reference event and their event are accepted, 
+  # (ties broken by pair index, so the best remaining pair is always accepted), the pairs sharing an accepted event are dropped
+  matched_ref, matched_ev = [], []
+  pair = np.arange(len(cost))
+  while len(pair) > 0:
+    best = _best_of_group(ref_idx, cost, pair) & _best_of_group(ev_idx, cost, pair)
+    matched_ref.append(ref_idx[best])
+    matched_ev.append(ev_idx[best])
+    keep = ~np.isin(ref_idx, ref_idx[best]) & ~np.isin(ev_idx, ev_idx[best])
+    pair, ref_idx, ev_idx, cost = pair[keep], ref_idx[keep], ev_idx[keep], cost[keep]
+
+  matched_ref = np.concatenate(matched_ref) if len(matched_ref) > 0 else np.empty(0, dtype=int)
+  matched_ev = np.concatenate(matched_ev) if len(matched_ev) > 0 else np.empty(0, dtype=int)
+  order = np.argsort(matched_ref)
+  return matched_ref[order], matched_ev[order]
+
+
+def _best_of_group(group, cost, pair):
+  # True for the pair of smallest (cost, pair index) of each group
+  order = np.lexsort((pair, cost, group))
+  best = np.zeros(len(group), dtype=bool)
+  best[order[np.r_[True, group[order][1:] != group[order][:-1]]]] = True
+  return best
+
+
+def _stats(x):
+  # mean, median, standard deviation, median absolute deviation and 90th percentile of |x| (nan if empty)
+  if len(x) == 0:
+    return dict((name, np.nan) for name in ('mean', 'median', 'std', 'mad', 'p90'))
+  median = np.median(x)
+  return {'mean': float(np.mean(x)), 'median': float(median), 'std': float(np.std(x)), 'mad': float(np.median(np.abs(x - median))),
+          'p90': float(np.percentile(np.abs(x), 90))}
+
+
+def compare(reference, events, max_dt=5., max_distance=20.):
+  """
+  compares events to the reference catalog (see match_events)
+  returns a dictionary with the number of reference events and events, hits, misses (reference events not matched), false alarms 
+  (events not matched), precision and recall, the index arrays of the matched pairs ('reference_index', 'event_index') and 
+  the statistics (see _stats) of the residuals event - reference: origin time 'dt' (s), epicentral 'distance', 'dlat' (north), 
+  'dlon' (east) and 'ddepth' (km)
+  """
+  ref_idx, ev_idx = match_events(reference, events, max_dt=max_dt, max_distance=max_distance)
+  hits = len(ref_idx)
+  ref, ev = reference[ref_idx], events[ev_idx]
+  kmlon = 111.19*np.cos(np.radians(ref['lat']))
+
+  report = {'nreference': len(reference), 'nevents': len(events), 'hits': hits, 'misses': len(reference) - hits, 'false_alarms': len(events) - hits,
+            'precision': hits/float(len(events)) if len(events) > 0 else 0., 'recall': hits/float(len(reference)) if len(reference) > 0 else 0.,
+            'reference_index': ref_idx, 'event_index': ev_idx}
+  report['dt'] = _stats(ev['origin_time'] - ref['origin_time'])
+  report['distance'] = _stats(epicentral_distance(ref['lat'], ref['lon'], ev['lat'], ev['lon']))
+  report['dlat'] = _stats(111.19*(ev['lat'] - ref['lat']))
+  report['dlon'] = _stats(kmlon*(ev['lon'] - ref['lon']))
+  report['ddepth'] = _stats(ev['depth'] - ref['depth'])
+  return report
+
+
+def format_report(report):
+  """
+  returns the lines of a compare report
+  """
+  lines = ["reference events %i   events %i   hits %i   misses %i   false alarms %i   precision %.3f   recall %.3f" % 
+           (report['nreference'], report['nevents'], report['hits'], report['misses'], report['false_alarms'], report['precision'], report['recall']),
+           "residual (event - reference)      mean    median       std       mad       p90"]
+  for name, label in (('dt', 'origin time (s)'), ('distance', 'epicentral distance (km)'), ('dlat', 'north (km)'), ('dlon', 'east (km)'), ('ddepth', 'depth (km)')):
+    stats = report[name]
+    lines.append("%-28s %9.2f %9.2f %9.2f %9.2f %9.2f" % (label, stats['mean'], stats['median'], stats['std'], stats['mad'], stats['p90']))
+  return lines
+
+
+def format_matches(report, reference, events):
+  """
+  returns one line per reference event and per event of a compare report: hits (both evids and the residuals), misses and false alarms
+  """
+  lines = ["# status   ref_evid   evid                 origin time     dt (s)  dist (km)  ddepth (km)"]
+  matched = dict(zip(report['reference_index'].tolist(), report['event_index'].tolist()))
+  for i in range(len(reference)):
+    ref = reference[i]
+    if i in matched:
+      ev = events[matched[i]]
+      lines.append("  hit      %8i %6i  %s %10.2f %10.2f %12.2f" % (ref['evid'], ev['evid'], UTCDateTime(ref['origin_time']).strftime("%Y-%m-%d %H:%M:%S.%f")[:-4],
+                   ev['origin_time'] - ref['origin_time'], epicentral_distance(ref['lat'], ref['lon'], ev['lat'], ev['lon']), ev['depth'] - ref['depth']))
+    else:
+      lines.append("  miss     %8i %6s  %s" % (ref['evid'], "-", UTCDateTime(ref['origin_time']).strftime("%Y-%m-%d %H:%M:%S.%f")[:-4]))
+  false_alarms = np.setdiff1d(np.arange(len(events)), report['event_index'])
+  for j in false_alarms:
+    lines.append("  false    %8s %6i  %s" % ("-", events[j]['evid'], UTCDateTime(events[j]['origin_time']).strftime("%Y-%m-%d %H:%M:%S.%f")[:-4]))
+  return lines
@@ -8,18 +8,16 @@ from obspy.geodetics.base import degrees2kilometers, calc_vincenty_inverse
 pickfile = "picks.txt"
 maxgap = 360
 
-picks = hypo71.prepare_picks(pickfile)
-
 # define output file
 event_file = "eq.pha"
 if os.path.isfile(event_file):
   os.remove(event_file)
 
-# loop over each event in picks file
+# loop over each event in picks file (read one event at a time)
 count = 1
-for npick in picks:
+for npick, hypolines in hypo71.iter_picks(pickfile):
   # generate input file "hypo71_input"
-  hypo71.generate_input(".", picks[npick]["hypolines"], "info_file", "velmod.hdr") 
+  hypo71.generate_input(".", hypolines, "info_file", "velmod.hdr") 
   # run hypo71
   hypo71.call_Hypo71(".")
   # read hypo71 results
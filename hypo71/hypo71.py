@@ -2,9 +2,15 @@
 #coding=utf-8
 
 from obspy.core import UTCDateTime
-import subprocess, os
+import subprocess, os, shutil, tempfile
 from subprocess import Popen
+from concurrent.futures import ThreadPoolExecutor
 from pylab import *
+import numpy as np
+
+#hypo71pc and its libg2c.so.0 live next to this module
+HYPO71_DIR = os.path.dirname(os.path.abspath(__file__))
+HYPO71PC = os.path.join(HYPO71_DIR, 'hypo71pc')
 
 """
 module for calling HYPO71 from Python and evaluating its output
@@ -18,106 +24,158 @@ def get_stat_values(info_file):
   info_file: path to the file containing the station information
   returns a list of strings readymade for the HYPO71.inp file
   """
-  cmd = 'awk \'/^/ {print $1,$8,$9,$10}\' '+info_file
-  process = subprocess.Popen(cmd,shell=True,stdout=subprocess.PIPE)
-  output = process.communicate()[0]
-  outlist = output.split(b'\n')
+  infile = open(info_file,'r')
+  lines = infile.readlines()
+  infile.close()
   strlist = []
-  for i in range(len(outlist)-1):
-    if outlist[i][0] != '#':
-      stat_name,stat_lat,stat_lon,stat_ev = outlist[i].split(b' ')
-      lat_deg,lat_dec = stat_lat.split(b'.')
-      lon_deg,lon_dec = stat_lon.split(b'.')
-      #convert decimal degrees into minutes
-      minutes_lat = '%05.2f' % (float(b'0.'+lat_dec)*60.)
-      minutes_lon = '%05.2f' % (float(b'0.'+lon_dec)*60.)
-      #expand station names shorter than 4 characters with _ or __
-      stat_name = str(stat_name, 'utf-8')
-      if len(stat_name) == 2:
-        stat_name = stat_name+'__'
-      elif len(stat_name) == 3:
-        stat_name = stat_name+'_'
-      #determine hemisphere(s)
-      if float(lat_deg) >= 0.:
-        lat_mark = 'N'
-      else:
-        lat_mark = 'S'
-      if float(lon_deg) >= 0.:
-        lon_mark = 'E'
-      else:
-        lon_mark = 'W'
-      #format decimal degrees
-      lat_d = '%02i' % (abs(int(lat_deg)))
-      lon_d = '%03i' % (abs(int(lon_deg)))
-
-      #format station elevations
-      
+  for line in lines:
+    fields = line.split()
+    if len(fields) < 10 or fields[0][0] == '#':
+      continue
+    stat_name,stat_lat,stat_lon,stat_ev = fields[0],fields[7],fields[8],fields[9]
+    lat_deg,lat_dec = stat_lat.split('.')
+    lon_deg,lon_dec = stat_lon.split('.')
+    #convert decimal degrees into minutes
+    minutes_lat = '%05.2f' % (float('0.'+lat_dec)*60.)
+    minutes_lon = '%05.2f' % (float('0.'+lon_dec)*60.)
+    #expand station names shorter than 4 characters with _ or __
+    if len(stat_name) == 2:
+      stat_name = stat_name+'__'
+    elif len(stat_name) == 3:
+      stat_name = stat_name+'_'
+    #determine hemisphere(s)
+    if float(lat_deg) >= 0.:
+      lat_mark = 'N'
+    else:
+      lat_mark = 'S'
+    if float(lon_deg) >= 0.:
+      lon_mark = 'E'
+    else:
+      lon_mark = 'W'
+    #format decimal degrees
+    lat_d = '%02i' % (abs(int(lat_deg)))
+    lon_d = '%03i' % (abs(int(lon_deg)))
+
+    #format station elevations
+    if stat_ev == 'XXX':
+      stat_e = '   0'
+    else:
       stat_e = '%4s' % (str(int(float(stat_ev))))
-      if stat_ev == 'XXX':
-        stat_e = '   0'
-      
-      #all into a string for this one station
-      stg = '  '+stat_name+lat_d+minutes_lat+lat_mark+lon_d+minutes_lon+lon_mark+stat_e+' 00.00\n'
-      #append that string to the list
-      strlist.append(stg)
+    
+    #all into a string for this one station
+    stg = '  '+stat_name+lat_d+minutes_lat+lat_mark+lon_d+minutes_lon+lon_mark+stat_e+' 00.00\n'
+    #append that string to the list
+    strlist.append(stg)
   return strlist
 
+_station_blocks = {}
+
+def station_block(info_file):
+  """
+  station list of info_file formatted for hypo71.inp (get_stat_values joined in one string)
+  built once per station file and kept until the file is modified (cache keyed on path and mtime)
+  """
+  key = (os.path.abspath(info_file), os.path.getmtime(info_file))
+  block = _station_blocks.get(key)
+  if block is None:
+    block = ''.join(get_stat_values(info_file))
+    _station_blocks[key] = block
+  return block
+
+def station_names(stations):
+  """
+  station names as written in the phase lines (2 and 3 letter names padded with '_' to 4)
+  """
+  stations = np.asarray(stations, dtype=str)
+  lengths = np.char.str_len(stations)
+  return np.where((lengths == 2) | (lengths == 3), np.char.ljust(stations, 4, '_'), stations)
+
+def phase_lines(stations, p_time, p_weight, s_time, s_weight):
+  """
+  phase lines in hypo71 input format of arrays of readings (epoch floats, s_time nan where there is no S-phase), e.g.
+  TOL1IP_1 1909301859 5.35      21.02IS_0
+  the S time is counted from the minute of the P time, as the P seconds
+  """
+  # times in hundredths of a second (as in the picks file), so that a P at 59.996 s is written as 0.00 s of the next minute
+  p_centi = np.rint(np.asarray(p_time, dtype=float)*100.)
+  s_centi = np.rint(np.asarray(s_time, dtype=float)*100.)
+  minute = np.floor(p_centi/6000.)*6000.
+  stamp = np.datetime_as_string((minute/100.).astype(np.int64).astype("datetime64[s]"), unit="m")   # YYYY-MM-DDThh:mm
+  date = [s[2:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16] for s in stamp.tolist()]
+
+  lines = []
+  for sta, pw, d, ps, ss, sw in zip(station_names(stations).tolist(), np.asarray(p_weight).tolist(), date, ((p_centi - minute)/100.).tolist(), 
+                                    ((s_centi - minute)/100.).tolist(), np.asarray(s_weight).tolist()):
+    if ss == ss:   # not nan
+      lines.append("%sIP_%i %s%5.2f      %6.2fIS_%i\n" % (sta, pw, d, ps, ss, sw))
+    else:
+      lines.append("%sIP_%i %s%5.2f\n" % (sta, pw, d, ps))
+  return lines
+
+def iter_picks(phase_file, batch_size=20000):
+  """
+  reads the phase picks file in one pass and yields (event number, hypolines) for each event, as soon as it has been read
+  hypolines: input strings needed for hypo71.inp (in alphabetical order)
+  the times of batch_size readings at most are converted together, so that the memory does not grow with the size of the file
+  """
+  stations, p_times, p_weights, s_times, s_weights = [], [], [], [], []
+  events = []   # (event number, index of its first reading) of the events read and not yet yielded
+  num = 0
+  current = None
+
+  def flush(events):
+    lines = phase_lines(stations, p_times, p_weights, s_times, s_weights)
+    bounds = [first for n, first in events[1:]] + [len(lines)]
+    for (n, first), last in zip(events, bounds):
+      yield n, sorted(lines[first:last])
+    for column in (stations, p_times, p_weights, s_times, s_weights):
+      del column[:]
+
+  phases = open(phase_file,'r')
+  for line in phases:
+    if line[0] == '#':
+      if current is not None:
+        events.append(current)
+      if len(stations) >= batch_size:
+        for event in flush(events):
+          yield event
+        events = []
+      num += 1
+      current = (num, len(stations))
+      continue
+    fields = line.split()
+    if current is None:   # lines before the first header
+      continue
+    if len(fields) == 0:   # a blank line ends the event
+      events.append(current)
+      current = None
+      continue
+    stations.append(fields[0])
+    p_times.append(float(fields[2]))
+    p_weights.append(int(fields[3]))
+    if len(fields) >= 7:
+      s_times.append(float(fields[5]))
+      s_weights.append(int(fields[6]))
+    else:
+      s_times.append(np.nan)
+      s_weights.append(0)
+  phases.close()
+
+  if current is not None:
+    events.append(current)
+  for event in flush(events):
+    yield event
+
 def prepare_picks(phase_file): #indict: Anpassung gemacht!!
   """
   convert phase arrivals into the format read by Hypo71
   phase_file: Path to the file containing the phase picks
-  returns dictionaries hypo_dict and nr_dict
+  returns dictionary hypo_dict
   hypo_dict: for each event number, a list of the input strings needed for hypo71.inp (in alphabetical order)
-  orig_dict: event header for each event number (for later evaluation)
   """
-  phases = open(phase_file,'r')
-  ph_data = phases.readlines()
-  phases.close()
-
   indict = {}
-  num = 0
-  for a in range(len(ph_data)):
-    if ph_data[a][0] == '#':
-      str_list = []
-      indict[num+1] = {}
-      indict[num+1]['hypolines'] = []
-      for b in range((a+1),(a+2000)):
-        #if b < len(ph_data):
-          if ph_data[b] == '\n':
-            num += 1
-            break
-          if ph_data[b][0] == '#':
-            num += 1
-            break
-          sflag = False
-          try: 
-            stat,typP,ppick,weight = ph_data[b].split(None)
-          except:
-            stat,typP,ppick,weight,typS,spick,weightS = ph_data[b].split(None)
-            sflag = True
-          picktime = UTCDateTime(float(ppick))
-          if sflag:
-            picktimeS = UTCDateTime(float(spick))
-          if len(stat) == 2:
-            stat = stat+'__'
-          elif len(stat) == 3:
-            stat = stat+'_'
-          hyp_year = str(picktime.year)[2:]
-          hyp_month = '%02d' % (picktime.month)
-          hyp_day = '%02d' % (picktime.day)
-          hyp_hour = '%02d' % (picktime.hour)
-          hyp_min = '%02d' % (picktime.minute)
-          sc = picktime.second
-          msec = picktime.microsecond
-          t_sec = float(sc + msec/1e6)
-          hyp_sec = '%5.2f' % (t_sec)
-          if sflag:
-            sptime = '%6.2f' % ( (picktimeS - picktime) + picktime.second )
-            strg = stat+'IP_'+weight+' '+hyp_year+hyp_month+hyp_day+hyp_hour+hyp_min+hyp_sec+'      '+sptime+'IS_'+weightS+'\n'
-          else:
-            strg = stat+'IP_'+weight+' '+hyp_year+hyp_month+hyp_day+hyp_hour+hyp_min+hyp_sec+'\n' #weight 0 for all picks
-          indict[num+1]['hypolines'].append(strg)
-      indict[num]['hypolines'].sort()
+  for num, hypolines in iter_picks(phase_file):
+    indict[num] = {'hypolines': hypolines}
   return indict
 
 
@@ -146,13 +204,31 @@ def generate_input(path,phase_dict,info_file,velmod,fdep=35,w1=500,w2=999,vpvs=1
   vpvs: vp/vs ratio for calculation of S-velocity model (default: 1.73)
   """
   outfile = open(path+'/hypo71.inp','w')
+  write_input_header(outfile,info_file,velmod,fdep,w1,w2,vpvs)
+  write_phase_block(outfile,phase_dict)
+  outfile.close()
+
+def generate_input_batch(path,phase_dicts,info_file,velmod,fdep=35,w1=500,w2=999,vpvs=1.73):
+  """
+  same as generate_input, but for several events located in one single HYPO71 run: the station list, velocity model 
+  and control card are written once, followed by the phase block of each event (each one closed by its instruction card)
+  phase_dicts: list of entries of hypo_dict (as returned by prepare_picks), one per event
+  """
+  outfile = open(path+'/hypo71.inp','w')
+  write_input_header(outfile,info_file,velmod,fdep,w1,w2,vpvs)
+  for phase_dict in phase_dicts:
+    write_phase_block(outfile,phase_dict)
+  outfile.close()
+
+def write_input_header(outfile,info_file,velmod,fdep=35,w1=500,w2=999,vpvs=1.73):
+  """
+  writes the TEST variables, station list, velocity model and control card of hypo71.inp to the open file outfile
+  """
   # setting the TEST variables
   strg = 'HEAD                     HYPO71PC FOR AUTO GIANT\nRESET TEST(01)=0.100000\nRESET TEST(02)=10.000000\nRESET TEST(03)=2.000000\nRESET TEST(04)=0.050000\nRESET TEST(05)=5.000000\nRESET TEST(06)=4.000000\nRESET TEST(07)=-0.870000\nRESET TEST(08)=2.000000\nRESET TEST(09)=0.003500\nRESET TEST(10)=100.000000\nRESET TEST(11)=20.00000\nRESET TEST(12)=0.500000\nRESET TEST(13)=1.000000\n\n'
   outfile.write(strg)
-  #fetching station coordinates and elevations
-  statlist = get_stat_values(info_file)
-  for g in statlist:
-    outfile.write(g)
+  #fetching station coordinates and elevations (formatted once per station file)
+  outfile.write(station_block(info_file))
   #add empty line
   outfile.write('\n')
   #fetching velocity model
@@ -166,12 +242,16 @@ def generate_input(path,phase_dict,info_file,velmod,fdep=35,w1=500,w2=999,vpvs=1
   vpvs = '%4.2f' %(vpvs)
   controlcards = fdep+'. '+str(w1)+'. '+str(w2)+'. '+str(vpvs)+'    2    1   18         1         1   11                    \n'
   outfile.write(controlcards)
+
+def write_phase_block(outfile,phase_dict):
+  """
+  writes the phase lines of one event followed by its instruction card to the open file outfile
+  """
   #fetching phase pick data (get via event number from dictionary)
   for i in phase_dict:
     outfile.write(i)
   #last line
   outfile.write('                 10                                                             \n')
-  outfile.close()
 
 def initialize(path,phase_file): #Anpassung indict gemacht !!
   """
@@ -189,13 +269,80 @@ def initialize(path,phase_file): #Anpassung indict gemacht !!
   return indict
   
 
+def write_hypo71_input(path):
+  """
+  writes the piping file hypo71_input (answers to the file name prompts of hypo71pc) to the given path
+  """
+  outfile = open(path+'/hypo71_input','w')
+  outfile.write('hypo71.inp\nhypo71.prt\nhypo71.pun\n')
+  outfile.close()
+
 def call_Hypo71(path):
   """
-  calls HYPO71 via system call; output written to file hypo71.prt
+  calls HYPO71 in the working directory path (which must contain hypo71_input and hypo71.inp); output written to file hypo71.prt
+  the process working directory is not changed, so several calls can run at the same time in different paths
+  """
+  env = dict(os.environ)
+  env['LD_LIBRARY_PATH'] = HYPO71_DIR + os.pathsep + env.get('LD_LIBRARY_PATH', '')
+  infile = open(path+'/hypo71_input','r')
+  logfile = open(path+'/out.log','w')
+  subprocess.call([HYPO71PC], stdin=infile, stdout=logfile, stderr=subprocess.STDOUT, cwd=path, env=env)
+  infile.close()
+  logfile.close()
+
+def locate_event(hypolines, info_file, velmod, **kwargs):
+  """
+  locates one event in its own temporary working directory (removed afterwards)
+  hypolines: picks for one single event in hypo71 input format (one entry of prepare_picks)
+  info_file, velmod: paths to the station and velocity model files
+  kwargs: control card values passed to generate_input
+  returns the dictionary of read_output (failed_location() if hypo71pc gave no readable output, so that one bad event does not
+  stop the location of the others)
+  """
+  path = tempfile.mkdtemp(prefix='hypo71_')
+  try:
+    generate_input(path, hypolines, info_file, velmod, **kwargs)
+    write_hypo71_input(path)
+    call_Hypo71(path)
+    return read_output(path)
+  except (OSError, IndexError, ValueError): #no hypo71.prt written, or a truncated summary block
+    return failed_location()
+  finally:
+    shutil.rmtree(path, ignore_errors=True)
+
+def locate_events_batch(picks, info_file, velmod, **kwargs):
+  """
+  locates all events of picks (as returned by prepare_picks) with one single hypo71pc run in a temporary working directory
+  (station list and velocity model written once, no process spawn per event)
+  returns the read_output dictionaries in event order
   """
-  inp_file = path+'/hypo71_input'
-  cmd = 'hypo71pc < '+inp_file + '> out.log'
-  os.system(cmd)
+  phase_dicts = [picks[num]['hypolines'] for num in sorted(picks)]
+  path = tempfile.mkdtemp(prefix='hypo71_')
+  try:
+    generate_input_batch(path, phase_dicts, info_file, velmod, **kwargs)
+    write_hypo71_input(path)
+    call_Hypo71(path)
+    return read_output_batch(path, phase_dicts)
+  finally:
+    shutil.rmtree(path, ignore_errors=True)
+
+def locate_events(picks, info_file, velmod, workers=None, **kwargs):
+  """
+  locates all events of picks (as returned by prepare_picks, or the (event number, hypolines) of iter_picks: each event is then 
+  submitted as soon as it has been read), each one in its own temporary working directory, 
+  running at most `workers` hypo71pc processes at the same time (default: number of cores)
+  returns the read_output dictionaries in event order
+  """
+  if workers is None:
+    workers = os.cpu_count() or 1
+  if isinstance(picks, dict):
+    picks = [(num, picks[num]['hypolines']) for num in sorted(picks)]
+  info_file = os.path.abspath(info_file)
+  velmod = os.path.abspath(velmod)
+  pool = ThreadPoolExecutor(max_workers=workers)
+  futures = [pool.submit(locate_event, hypolines, info_file, velmod, **kwargs) for num, hypolines in picks]
+  pool.shutdown(wait=True)
+  return [future.result() for future in futures]
 
 def read_output(path):
   """
@@ -208,109 +355,181 @@ def read_output(path):
   dat = infile.readlines()
   infile.close()
   
-  cmd = 'awk \'/^  DATE/ {print NR}\' '+prt_file
-  process = subprocess.Popen(cmd,shell=True,stdout=subprocess.PIPE)
-  output = process.communicate()[0]
+  #line number (1-based) of the summary header; there must be exactly one for a single event
+  nums = date_lines(dat)
   try:
-    num = int(output)
-    header_line = dat[num-1] #extract hemisphere information
-    dum,dum,dum,n,dum,e,dum = header_line.split(None,6)
-    sum_line = dat[num]
-    #extraction of vital information from summary hypocenter line
-    yr = sum_line[1:3]
-    if int(yr) < 10:
-      year = '200'+yr.strip(' ')
-    else:
-      year = '20'+yr
-    mn = sum_line[3:5]
-    day = sum_line[5:7]
-    hr = sum_line[8:10]
-    min = sum_line[10:12]
-    sec = sum_line[13:18]
-    origin_time = UTCDateTime(int(year),int(mn),int(day),int(hr),int(min),float(sec))
-    # revision needed here -- currently would lead to false results for negative coordinate (i.e. S and W hemispheres)
-    lat_deg,lat_min = sum_line[19:27].split('-')
-    ev_lat = str(float(lat_deg) + (float(lat_min)/60.))
-    lon_deg,lon_min = sum_line[28:37].split('-')
-    ev_lon = str(float(lon_deg) + (float(lon_min)/60.))
-    ev_depth = sum_line[38:44].strip(' ') #to get rid of leading spaces...
-    Nobs = sum_line[52:54].strip(' ')
-    gap = sum_line[58:61].strip(' ')
-    RMS = sum_line[63:68].strip(' ')
-    loc_dict = {}
-    if n=='S': ev_lat='-'+ev_lat #adjustment for western and southern hemispheres
-    if e=='W': ev_lon='-'+ev_lon
-    loc_dict['origin_time'] = origin_time
-    loc_dict['ev_lat'] = ev_lat 
-    loc_dict['ev_lon'] = ev_lon
-    loc_dict['ev_depth'] = ev_depth
-    loc_dict['nphases'] = Nobs
-    loc_dict['gap'] = gap
-  #  loc_dict['RMS'] = RMS  #disabled --> RMS will be determined further down directly from station residuals
-    loc_dict['goodness'] = True
-    loc_dict['Tobs'] = {}
-    loc_dict['TobsS'] = {}
-    loc_dict['Sweight'] = {}
-    loc_dict['Sres'] = {}
-    loc_dict['Sstatw'] = {}
-    loc_dict['static_weight'] = {}
-    loc_dict['polarity'] = {}  
-    loc_dict['P_weight'] = {}
-    loc_dict['P_station_res'] = {}
-    #getting station residuals from further down in prt file
-    res_lst = []
-    for i in range((num+3),(num+1000)):
-      if dat[i] == '\n' or dat[i][3:7] == 'DATE' or dat[i][0] == '1':
-        break
-      sta = dat[i][1:5]
-      stat_w = dat[i][23:24]
-      pol = dat[i][22:23]
-      tpobs = dat[i][36:41]
-      if tpobs[0] == '0': #should have been three digit...otherwise this field would stay blank...
-        tpobs = '1'+tpobs
-      pweight = dat[i][61:65]
-      res = dat[i][53:59]
-      spobs = dat[i][109:115] #become spaces if no S pick exists 
-      s_swgt = dat[i][102:103]
-      sweight = dat[i][124:127]
-      sres = dat[i][115:121]
-      loc_dict['P_station_res'][sta] = res
-      loc_dict['Tobs'][sta] = tpobs
-      loc_dict['static_weight'][sta] = stat_w
-      loc_dict['polarity'][sta] = pol
-      loc_dict['P_weight'][sta] = pweight
-      if spobs.strip(' ') != '': #existence of S phase
-        loc_dict['TobsS'][sta] = spobs #relative to origin time
-        loc_dict['Sweight'][sta] = sweight
-        loc_dict['Sres'][sta] = sres
-        loc_dict['Sstatw'][sta] = s_swgt
-      try: 
-        res_lst.append(float(res))
-        res_lst.append(float(sres))
-      except:
-        pass  
-      '''if res == '******':
-        del loc_dict['P_weight'][sta]
-        del loc_dict['polarity'][sta]
-        del loc_dict['static_weight'][sta]
-        del loc_dict['Tobs'][sta]
-        del loc_dict['P_station_res'][sta]
-      '''  #later: should also incorporate S...
-    val = 0
-    for t in range(len(res_lst)): 
-      v = res_lst[t]**2
-      val += v
-    val /= float(len(res_lst))
-    rms = sqrt(val)
-    loc_dict['RMS'] = str('%5.2f'%(rms)) #calculation "by hand" because in some cases HYPO71 sets internal weighting for stations with huge residuals to 0 --> those are then not included in determination of HYPO71's RMS
-    #print loc_dict
-    return loc_dict
+    if len(nums) != 1:
+      raise ValueError
+    return parse_location(dat, nums[0])
   except ValueError: #i.e. no location was obtained, line in hypo71.prt does not exist
-    loc_dict = {}
-    loc_dict['RMS'] = 99.#RMS dummy
-    loc_dict['ev_depth'] = 999. #depth dummy
-    loc_dict['goodness'] = False
-    return loc_dict
+    return failed_location()
+
+def date_lines(dat):
+  """
+  line numbers (1-based) of the summary headers ("  DATE ...") in the lines dat of a .prt-file
+  """
+  return [i+1 for i in range(len(dat)) if dat[i].startswith('  DATE')]
+
+def failed_location():
+  """
+  dictionary returned when no location was obtained for an event
+  """
+  loc_dict = {}
+  loc_dict['RMS'] = 99.#RMS dummy
+  loc_dict['ev_depth'] = 999. #depth dummy
+  loc_dict['goodness'] = False
+  return loc_dict
+
+def parse_location(dat, num):
+  """
+  extracts the location whose summary header ("  DATE ...") is line number num (1-based) of the lines dat of a .prt-file
+  returns loc_dict (see read_output); raises ValueError if the summary line cannot be read
+  """
+  header_line = dat[num-1] #extract hemisphere information
+  dum,dum,dum,n,dum,e,dum = header_line.split(None,6)
+  sum_line = dat[num]
+  #extraction of vital information from summary hypocenter line
+  yr = sum_line[1:3]
+  if int(yr) < 10:
+    year = '200'+yr.strip(' ')
+  else:
+    year = '20'+yr
+  mn = sum_line[3:5]
+  day = sum_line[5:7]
+  hr = sum_line[8:10]
+  min = sum_line[10:12]
+  sec = sum_line[13:18]
+  origin_time = UTCDateTime(int(year),int(mn),int(day),int(hr),int(min),float(sec))
+  # revision needed here -- currently would lead to false results for negative coordinate (i.e. S and W hemispheres)
+  lat_deg,lat_min = sum_line[19:27].split('-')
+  ev_lat = str(float(lat_deg) + (float(lat_min)/60.))
+  lon_deg,lon_min = sum_line[28:37].split('-')
+  ev_lon = str(float(lon_deg) + (float(lon_min)/60.))
+  ev_depth = sum_line[38:44].strip(' ') #to get rid of leading spaces...
+  Nobs = sum_line[52:54].strip(' ')
+  gap = sum_line[58:61].strip(' ')
+  RMS = sum_line[63:68].strip(' ')
+  loc_dict = {}
+  if n=='S': ev_lat='-'+ev_lat #adjustment for western and southern hemispheres
+  if e=='W': ev_lon='-'+ev_lon
+  loc_dict['origin_time'] = origin_time
+  loc_dict['ev_lat'] = ev_lat 
+  loc_dict['ev_lon'] = ev_lon
+  loc_dict['ev_depth'] = ev_depth
+  loc_dict['nphases'] = Nobs
+  loc_dict['gap'] = gap
+#  loc_dict['RMS'] = RMS  #disabled --> RMS will be determined further down directly from station residuals
+  loc_dict['goodness'] = True
+  loc_dict['Tobs'] = {}
+  loc_dict['TobsS'] = {}
+  loc_dict['Sweight'] = {}
+  loc_dict['Sres'] = {}
+  loc_dict['Sstatw'] = {}
+  loc_dict['static_weight'] = {}
+  loc_dict['polarity'] = {}  
+  loc_dict['P_weight'] = {}
+  loc_dict['P_station_res'] = {}
+  #getting station residuals from further down in prt file
+  res_lst = []
+  for i in range((num+3),(num+1000)):
+    if dat[i] == '\n' or dat[i][3:7] == 'DATE' or dat[i][0] == '1':
+      break
+    sta = dat[i][1:5]
+    stat_w = dat[i][23:24]
+    pol = dat[i][22:23]
+    tpobs = dat[i][36:41]
+    if tpobs[0] == '0': #should have been three digit...otherwise this field would stay blank...
+      tpobs = '1'+tpobs
+    pweight = dat[i][61:65]
+    res = dat[i][53:59]
+    spobs = dat[i][109:115] #become spaces if no S pick exists 
+    s_swgt = dat[i][102:103]
+    sweight = dat[i][124:127]
+    sres = dat[i][115:121]
+    loc_dict['P_station_res'][sta] = res
+    loc_dict['Tobs'][sta] = tpobs
+    loc_dict['static_weight'][sta] = stat_w
+    loc_dict['polarity'][sta] = pol
+    loc_dict['P_weight'][sta] = pweight
+    if spobs.strip(' ') != '': #existence of S phase
+      loc_dict['TobsS'][sta] = spobs #relative to origin time
+      loc_dict['Sweight'][sta] = sweight
+      loc_dict['Sres'][sta] = sres
+      loc_dict['Sstatw'][sta] = s_swgt
+    try: 
+      res_lst.append(float(res))
+      res_lst.append(float(sres))
+    except:
+      pass  
+    '''if res == '******':
+      del loc_dict['P_weight'][sta]
+      del loc_dict['polarity'][sta]
+      del loc_dict['static_weight'][sta]
+      del loc_dict['Tobs'][sta]
+      del loc_dict['P_station_res'][sta]
+    '''  #later: should also incorporate S...
+  val = 0
+  for t in range(len(res_lst)): 
+    v = res_lst[t]**2
+    val += v
+  val /= float(len(res_lst))
+  rms = sqrt(val)
+  loc_dict['RMS'] = str('%5.2f'%(rms)) #calculation "by hand" because in some cases HYPO71 sets internal weighting for stations with huge residuals to 0 --> those are then not included in determination of HYPO71's RMS
+  #print loc_dict
+  return loc_dict
+
+def read_output_batch(path, phase_dicts):
+  """
+  reads the hypo71.prt file of a run with several events (see generate_input_batch) and splits it into one dictionary 
+  per event (as read_output does for a single event)
+  phase_dicts: the phase blocks given to generate_input_batch, in the same order
+  returns a list of loc_dict in the order of phase_dicts (failed_location() for events without a location)
+  """
+  infile = open(path+'/hypo71.prt','r')
+  dat = infile.readlines()
+  infile.close()
+
+  #key of each event: station, hour-minute and seconds of each P pick
+  owner = {}
+  for n, phase_dict in enumerate(phase_dicts):
+    for line in phase_dict:
+      owner.setdefault((line[0:4], line[15:19], line[19:24]), n)
+
+  out = [None]*len(phase_dicts)
+  nextevent = 0
+  for num in date_lines(dat):
+    try:
+      loc_dict = parse_location(dat, num)
+    except ValueError:
+      continue
+    #the first station line of the block tells which event it belongs to (events without location print no block)
+    stline = dat[num+3] if num+3 < len(dat) else ''
+    n = owner.get((stline[1:5].replace(' ','_'), stline[25:29], stline[30:35]))
+    if n is None or out[n] is not None:
+      n = nextevent
+    if n < len(out):
+      out[n] = loc_dict
+      nextevent = n + 1
+
+  return [loc_dict if loc_dict is not None else failed_location() for loc_dict in out]
+
+def read_pha(event_file):
+  '''
+  reads a .pha file written by write_pha
+  returns a list with one dictionary per event (keys of read_output: origin_time, ev_lat, ev_lon, ev_depth, nphases, gap, RMS, Tobs, TobsS)
+  '''
+  events = []
+  infile = open(event_file,'r')
+  for line in infile:
+    if line[0] == '#':
+      yr,mo,dy,hr,mn,sc,lat,lon,dep,nph,gap,rms = line[1:].split()[:12]
+      events.append({'origin_time': UTCDateTime(int(yr),int(mo),int(dy),int(hr),int(mn))+float(sc), 'ev_lat': lat, 'ev_lon': lon, 'ev_depth': dep,
+                     'nphases': nph, 'gap': gap, 'RMS': rms, 'Tobs': {}, 'TobsS': {}})
+    elif line.strip() != '':
+      sta,tobs,w,phase = line.split()
+      events[-1]['Tobs' if phase == 'P' else 'TobsS'][sta] = tobs
+  infile.close()
+  return events
 
 def write_pha(out, event_file, n):
   '''
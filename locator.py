@@ -0,0 +1,253 @@
+import numpy as np
+from obspy.core import UTCDateTime
+import traveltimes
+from hypo71.hypo71 import station_names
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  NATIVE HYPOCENTER LOCATOR (in-process alternative to hypo71pc)
+#  P and S first-arrival tables of the 1-D layered model of src/model.cru (traveltimes.py),
+#  vectorized grid search + Geiger (Gauss-Newton) iterations.
+#  locate_events takes the picks of hypo71.prepare_picks and returns the same
+#  dictionaries as hypo71.read_output, so runHypo71 can use either backend
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+EARTH_RADIUS = 6371.
+KM_PER_DEG = np.pi*EARTH_RADIUS/180.
+
+# HYPO71 pick weight codes -> least squares weights
+WEIGHTS = np.array([1., 0.75, 0.5, 0.25, 0.])
+
+
+def read_stations(station_file="src/stations.net"):
+  """
+  reads the station list (network, station, lat, lon, elevation)
+  returns a dictionary station -> (lat, lon)
+  """
+  network_info = np.loadtxt(station_file, dtype="str", ndmin=2)
+  return dict((station, (float(lat), float(lon))) for station, lat, lon in network_info[:, 1:4])
+
+
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  LOCATION
+
+def epicentral_distance(lat1, lon1, lat2, lon2):
+  """
+  great circle distance in km (arrays broadcast together)
+  """
+  lat1, lon1, lat2, lon2 = [np.radians(a) for a in (lat1, lon1, lat2, lon2)]
+  a = np.sin((lat2 - lat1)/2.)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2.)**2
+  return 2.*EARTH_RADIUS*np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+
+
+def azimuthal_gap(lat, lon, stlat, stlon):
+  """
+  largest azimuthal gap (degrees) between the stations seen from the epicenter
+  """
+  dlon = np.radians(stlon - lon)
+  lat, stlat = np.radians(lat), np.radians(stlat)
+  az = np.sort(np.degrees(np.arctan2(np.sin(dlon)*np.cos(stlat), np.cos(lat)*np.sin(stlat) - np.sin(lat)*np.cos(stlat)*np.cos(dlon))) % 360.)
+  if len(az) < 2:
+    return 360.
+  return np.max(np.diff(np.append(az, az[0] + 360.)))
+
+
+def hypolines_to_phases(hypolines):
+  """
+  reads the phase lines of one event as written by hypo71.prepare_picks
+  returns (stations, phases, times (epoch floats), weight codes), one entry per P or S reading
+  """
+  stations, phases, times, codes = [], [], [], []
+  for line in hypolines:
+    minute = UTCDateTime(2000 + int(line[9:11]), int(line[11:13]), int(line[13:15]), int(line[15:17]), int(line[17:19])).timestamp
+    stations.append(line[0:4])
+    phases.append('P')
+    times.append(minute + float(line[19:24]))
+    codes.append(int(line[7]))
+    if len(line) > 39 and line[36:38] == 'IS':
+      stations.append(line[0:4])
+      phases.append('S')
+      times.append(minute + float(line[30:36]))
+      codes.append(int(line[39]))
+  return stations, np.array(phases), np.array(times), np.array(codes)
+
+
+def _origin_times(tobs, tt, w):
+  # weighted least squares origin time of every node (last axis: phases) and the residuals
+  t0 = np.sum(w*(tobs - tt), axis=-1)/np.sum(w)
+  res = tobs - tt - t0[..., None]
+  return t0, res
+
+
+def locate(stlat, stlon, phases, tobs, w, table, grid_half_width=3., grid_step=0.1, depth_step=5., max_depth=60., max_iterations=20):
+  """
+  hypocenter of one event from its readings (arrays: station coordinates, 'P'/'S', epoch times, weights)
+  grid search over +/- grid_half_width degrees around the first station reached, then Geiger iterations (depth kept within 0-max_depth km)
+  returns (origin time (epoch), lat, lon, depth, residuals)
+  """
+  tmin = tobs.min()
+  tobs = tobs - tmin   # relative times, so that the normal equations are well scaled
+  first = np.argmin(np.where(phases == 'P', tobs, np.inf))
+
+  # GRID SEARCH (all nodes at once)
+  offsets = np.arange(-grid_half_width, grid_half_width + grid_step/2., grid_step)
+  lat0 = stlat[first]
+  lon0 = stlon[first]
+  lats = lat0 + offsets
+  lons = lon0 + offsets/np.cos(np.radians(lat0))
+  max_depth = min(max_depth, table.depths[-1])
+  depths = np.arange(0., max_depth + depth_step/2., depth_step)
+  glat, glon = np.meshgrid(lats, lons, indexing="ij")
+  dist = epicentral_distance(glat[..., None], glon[..., None], stlat, stlon)          # (nlat, nlon, nphases)
+  misfit = np.empty((len(depths),) + glat.shape)
+  for k, z in enumerate(depths):
+    t0, res = _origin_times(tobs, table.lookup(phases, dist, z), w)
+    misfit[k] = np.sum(w*res**2, axis=-1)
+  k, i, j = np.unravel_index(np.argmin(misfit), misfit.shape)
+  lat, lon, z = lats[i], lons[j], depths[k]
+
+  # GEIGER ITERATIONS
+  t0, lat, lon, z, res = relocate(stlat, stlon, phases, tobs[None], w, table, lat, lon, z, max_depth=max_depth, max_iterations=max_iterations)
+  return tmin + t0[0], lat[0], lon[0], z[0], res[0]
+
+
+def relocate(stlat, stlon, phases, tobs, w, table, lat, lon, depth, max_depth=60., max_iterations=20):
+  """
+  Geiger iterations from the hypocenter (lat, lon, depth) for several sets of arrival times of the same readings
+  tobs: (nsets, nphases) times relative to a common reference, each set iterated on its own (vectorized over the sets)
+  returns (origin times (relative), lats, lons, depths, residuals) of every set
+  """
+  nsets = len(tobs)
+  lat = np.full(nsets, float(lat))
+  lon = np.full(nsets, float(lon))
+  z = np.full(nsets, float(depth))
+  max_depth = min(max_depth, table.depths[-1])
+  sw = np.sqrt(w)
+  damping = 1e-3*np.eye(4)
+
+  # (origin time, north, east, depth) by damped least squares, derivatives by finite differences
+  h = 0.1
+  active = np.arange(nsets)
+  for it in range(max_iterations):
+    la, lo, zz0 = lat[active, None], lon[active, None], z[active, None]
+    kmlon = KM_PER_DEG*np.cos(np.radians(la))
+    dist = epicentral_distance(la, lo, stlat, stlon)
+    tt = table.lookup(phases, dist, zz0)
+    dn = (table.lookup(phases, epicentral_distance(la + h/KM_PER_DEG, lo, stlat, stlon), zz0) - tt)/h
+    de = (table.lookup(phases, epicentral_distance(la, lo + h/kmlon, stlat, stlon), zz0) - tt)/h
+    zz = np.minimum(zz0 + h, max_depth)
+    dz = (table.lookup(phases, dist, zz) - table.lookup(phases, dist, zz - h))/h
+    t0, res = _origin_times(tobs[active], tt, w)
+
+    A = np.stack((np.ones(tt.shape), dn, de, dz), axis=-1)*sw[:, None]     # (nsets, nphases, 4)
+    b = res*sw
+    AtA = np.einsum('kij,kil->kjl', A, A)
+    AtA_damped = AtA + damping*(np.diagonal(AtA, axis1=1, axis2=2)[:, None, :] + 1e-9)
+    step = np.linalg.solve(AtA_damped, np.einsum('kij,ki->kj', A, b)[..., None])[..., 0]
+    step[:, 1:] = np.clip(step[:, 1:], -10., 10.)
+    lat[active] += step[:, 1]/KM_PER_DEG
+    lon[active] += step[:, 2]/kmlon[:, 0]
+    z[active] = np.clip(z[active] + step[:, 3], 0., max_depth)
+    active = active[~np.all(np.abs(step[:, 1:]) < 0.01, axis=1)]
+    if len(active) == 0:
+      break
+
+  tt = table.lookup(phases, epicentral_distance(lat[:, None], lon[:, None], stlat, stlon), z[:, None])
+  t0, res = _origin_times(tobs, tt, w)
+  return t0, lat, lon, z, res
+
+
+def locate_event(hypolines, stations, table, **kwargs):
+  """
+  locates one event (phase lines of hypo71.prepare_picks) and returns a dictionary in the format of hypo71.read_output
+  """
+  stnames, phases, times, codes = hypolines_to_phases(hypolines)
+  return locate_readings(stnames, phases, times, codes, stations, table, **kwargs)
+
+
+def weighted_readings(stnames, phases, times, codes, stations):
+  """
+  readings of one event usable for a location (known station, weight code below 4)
+  returns (station names, phases, times, weights, station latitudes, station longitudes), or None if there are less than 
+  4 readings or 3 stations
+  """
+  known = np.array([stname.strip('_') in stations for stname in stnames], dtype=bool)
+  w = WEIGHTS[np.clip(codes, 0, 4)]*known
+  if np.count_nonzero(w) < 4 or len(set(np.array(stnames)[w > 0])) < 3:
+    return None
+
+  sel = w > 0
+  stnames = [stname for stname, s in zip(stnames, sel) if s]
+  stlat = np.array([stations[stname.strip('_')][0] for stname in stnames])
+  stlon = np.array([stations[stname.strip('_')][1] for stname in stnames])
+  return stnames, phases[sel], times[sel], w[sel], stlat, stlon
+
+
+def locate_readings(stnames, phases, times, codes, stations, table, **kwargs):
+  """
+  locates one event from its readings (station names as in the phase lines, 'P'/'S', epoch times, HYPO71 weight codes) 
+  and returns a dictionary in the format of hypo71.read_output
+  """
+  readings = weighted_readings(stnames, phases, times, codes, stations)
+  if readings is None:
+    return _failed()
+  stnames, phases, times, w, stlat, stlon = readings
+
+  origin, lat, lon, depth, res = locate(stlat, stlon, phases, times, w, table, **kwargs)
+
+  loc_dict = {}
+  loc_dict['origin_time'] = UTCDateTime(origin)
+  loc_dict['ev_lat'] = "%.4f" % lat
+  loc_dict['ev_lon'] = "%.4f" % lon
+  loc_dict['ev_depth'] = "%.2f" % depth
+  loc_dict['nphases'] = str(len(phases))
+  loc_dict['gap'] = "%i" % round(azimuthal_gap(lat, lon, stlat, stlon))
+  loc_dict['RMS'] = "%5.2f" % np.sqrt(np.mean(res**2))
+  loc_dict['goodness'] = True
+  loc_dict['Tobs'] = {}
+  loc_dict['TobsS'] = {}
+  loc_dict['P_station_res'] = {}
+  loc_dict['Sres'] = {}
+  for stname, phase, t, r in zip(stnames, phases, times, res):
+    if phase == 'P':
+      loc_dict['Tobs'][stname] = "%5.2f" % (t - origin)
+      loc_dict['P_station_res'][stname] = "%6.2f" % r
+    else:
+      loc_dict['TobsS'][stname] = "%6.2f" % (t - origin)
+      loc_dict['Sres'][stname] = "%6.2f" % r
+  return loc_dict
+
+
+def _failed():
+  # same as hypo71.failed_location
+  return {'RMS': 99., 'ev_depth': 999., 'goodness': False}
+
+
+def locate_events(picks, station_file="src/stations.net", model_file="src/model.cru", table=None, **kwargs):
+  """
+  locates every event of picks (as returned by hypo71.prepare_picks, or the (event number, hypolines) of hypo71.iter_picks,
+  located while the file is read)
+  returns the dictionaries (format of hypo71.read_output) in event order
+  """
+  stations = read_stations(station_file)
+  if table is None:
+    table = traveltimes.load(model_file)
+  if isinstance(picks, dict):
+    picks = [(num, picks[num]['hypolines']) for num in sorted(picks)]
+  return [locate_event(hypolines, stations, table, **kwargs) for num, hypolines in picks]
+
+
+def locate_store(store, station_file="src/stations.net", model_file="src/model.cru", table=None, **kwargs):
+  """
+  locates every event of a picks.PickStore from its arrays (no phase lines written and parsed back)
+  returns the dictionaries (format of hypo71.read_output) in event order
+  """
+  stations = read_stations(station_file)
+  if table is None:
+    table = traveltimes.load(model_file)
+  outs = []
+  for event, readings in store.by_event():
+    stnames = station_names(readings['station']).tolist()
+    outs.append(locate_readings(stnames, readings['phase'], readings['time'], readings['weight'].astype(int), stations, table, **kwargs))
+  return outs
@@ -0,0 +1,205 @@
+import os, glob, pickle, hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from obspy import read_inventory
+from obspy.core import UTCDateTime
+from obspy.core.inventory import Inventory
+from obspy.signal.invsim import cosine_taper, cosine_sac_taper, invert_spectrum, paz_to_freq_resp
+from obspy.signal.util import next_pow_2
+from timing import sample_index
+from msindex import load_index, read_window
+import locator
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  LOCAL MAGNITUDE (Ml) FROM THE DATALESS METADATA (src/dataless)
+#  the dataless files are parsed once (inventory pickled in src/invcache); the spectrum
+#  that turns counts into Wood-Anderson displacement (inverse instrument response,
+#  Wood-Anderson response, pre-filter) is computed once per channel and segment length.
+#  The horizontal segments of all events of a piece of the archive are deconvolved
+#  together (one 2-D FFT), the peak amplitudes give Ml (Hutton & Boore, 1987) at the
+#  hypocentral distance. The pieces of the archive run in a process pool
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Wood-Anderson seismograph (displacement to displacement), gain of Uhrhammer & Collins (1990)
+WOOD_ANDERSON = {'poles': [-6.283 + 4.7124j, -6.283 - 4.7124j], 'zeros': [0j, 0j], 'gain': 1., 'sensitivity': 2080.}
+
+# inventories and Wood-Anderson filters already built in this process
+_inventories = {}
+_filters = {}
+
+
+def load_inventory(dataless_dir="src/dataless", cache_dir="src/invcache"):
+  """
+  returns the Inventory of all the dataless SEED files of dataless_dir: from this process' memory, else from its pickle in cache_dir,
+  else parsed and pickled to cache_dir (keyed on the names, sizes and modification times of the files; cache_dir=None: no disk cache)
+  """
+  files = sorted(glob.glob(os.path.join(dataless_dir, "*.dataless")))
+  key = hashlib.sha1(repr([(os.path.basename(f), os.path.getsize(f), os.path.getmtime(f)) for f in files]).encode()).hexdigest()[:16]
+  if key in _inventories:
+    return _inventories[key]
+
+  path = os.path.join(cache_dir, "inv_%s.pickle" % key) if cache_dir is not None else None
+  if path is not None and os.path.isfile(path):
+    infile = open(path, "rb")
+    inventory = pickle.load(infile)
+    infile.close()
+  else:
+    inventory = Inventory()
+    for f in files:
+      inventory += read_inventory(f, format="SEED")
+    if path is not None:
+      if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+      # written under a temporary name first, so that concurrent processes never load a partial file
+      tmp = "%s.%i.tmp" % (path, os.getpid())
+      outfile = open(tmp, "wb")
+      pickle.dump(inventory, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+      outfile.close()
+      os.replace(tmp, path)
+
+  _inventories[key] = inventory
+  return inventory
+
+
+def wood_anderson_filter(inventory, seed_id, time, sampling_rate, nfft, pre_filt=None, water_level=60.):
+  """
+  spectrum (rfft of length nfft) turning the counts of channel seed_id into Wood-Anderson displacement in m: inverse of the
+  displacement response of the instrument (water level in dB) times the Wood-Anderson response and the pre_filt cosine taper
+  (f1, f2, f3, f4 in Hz; default: 0.5, 1, 0.4 and 0.45 times the sampling rate), as obspy's remove_response + simulate
+  cached per response, sampling rate and nfft
+  """
+  response = inventory.get_response(seed_id, time)
+  if pre_filt is None:
+    pre_filt = (0.5, 1., 0.4*sampling_rate, 0.45*sampling_rate)
+  key = (id(response), sampling_rate, nfft, tuple(pre_filt), water_level)
+  if key not in _filters:
+    t_samp = 1./sampling_rate
+    freq_response, freqs = response.get_evalresp_response(t_samp, nfft, output="DISP")
+    invert_spectrum(freq_response, water_level)
+    wa = paz_to_freq_resp(WOOD_ANDERSON['poles'], WOOD_ANDERSON['zeros'], WOOD_ANDERSON['gain']*WOOD_ANDERSON['sensitivity'], t_samp, nfft)
+    _filters[key] = cosine_sac_taper(freqs, flimit=pre_filt)*freq_response*wa
+  return _filters[key]
+
+
+def peak_amplitudes(data, filters, index, pad=0):
+  """
+  peak Wood-Anderson amplitudes in mm of segments of raw counts (2-D array, one row per segment, same sampling rate) in one pass:
+  demean, 5 % cosine taper, rfft, times the wood_anderson_filter of each row, irfft
+  filters: the different filters (2-D array), index: the row of filters of each segment
+  pad: number of samples at both ends that are not searched (taper and edge effects of the deconvolution)
+  """
+  data = np.array(data, dtype=float)
+  npts = data.shape[1]
+  nfft = 2*(filters.shape[1] - 1)
+  data -= data.mean(axis=1)[:, None]
+  data *= cosine_taper(npts, 0.05, sactaper=True, halfcosine=False)
+  spectra = np.fft.rfft(data, n=nfft, axis=1)
+  for k in range(len(filters)):
+    spectra[index == k] *= filters[k]
+  spectra[:, -1] = np.abs(spectra[:, -1])
+  wa = np.fft.irfft(spectra, n=nfft, axis=1)[:, pad:npts-pad]
+  return 1000.*np.abs(wa).max(axis=1)
+
+
+def local_magnitude(amplitude, distance):
+  """
+  Ml of Hutton & Boore (1987) of Wood-Anderson amplitudes in mm at hypocentral distances in km (arrays)
+  """
+  return np.log10(amplitude) + 1.110*np.log10(distance/100.) + 0.00189*(distance - 100.) + 3.
+
+
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+def magnitudes_piece(msfile, events, time_before=5., time_after=40., pad=10., station_file="src/stations.net",
+                     dataless_dir="src/dataless", cache_dir="src/invcache", pre_filt=None, water_level=60.):
+  """
+  + Ml OF THE events OF ONE PIECE OF msfile (READ ONCE, RAW COUNTS)
+  events: list of (name, origin time, lat, lon, depth, {station: P time}) (epoch floats)
+  the peak amplitude of each horizontal channel of the stations with a P pick is searched in [P-time_before, P+time_after]
+  (segments read pad s longer on both sides for the deconvolution)
+  returns a dictionary name -> (Ml: median of the channels, number of channels) for the events with at least one channel
+  """
+  inventory = load_inventory(dataless_dir, cache_dir)
+  known = set(inventory.get_contents()['channels'])
+  stations = locator.read_stations(station_file)
+  p_times = [tp for event in events for tp in event[5].values()]
+  if len(p_times) == 0:
+    return {}
+  st = read_window(msfile, UTCDateTime(min(p_times) - time_before - pad), UTCDateTime(max(p_times) + time_after + pad))
+  st.merge(method=1, fill_value='interpolate')
+
+  # SEGMENTS OF ALL EVENTS, GROUPED BY SAMPLING RATE (one 2-D pass per group)
+  groups = {}
+  for name, origin, lat, lon, depth, picks in events:
+    for stname in picks:
+      if stname not in stations:
+        continue
+      distance = np.hypot(locator.epicentral_distance(lat, lon, stations[stname][0], stations[stname][1]), depth)
+      for tr in st.select(station=stname):
+        if tr.id not in known or tr.stats.channel[-1] not in "NE12":
+          continue
+        sampling_rate = tr.stats.sampling_rate
+        npts = int(round((time_before + time_after + 2*pad)*sampling_rate))
+        i1 = sample_index(tr, picks[stname] - time_before - pad)
+        if i1 < 0 or i1 + npts > tr.stats.npts:   # not covered by the data
+          continue
+        group = groups.setdefault((sampling_rate, npts), ([], {}, [], [], []))
+        if tr.id not in group[1]:
+          group[1][tr.id] = len(group[1])
+        group[0].append(tr.data[i1:i1+npts])
+        group[2].append(group[1][tr.id])
+        group[3].append(name)
+        group[4].append(distance)
+
+  readings = {}
+  for (sampling_rate, npts), (data, channels, index, names, distances) in groups.items():
+    nfft = next_pow_2(2*npts)
+    filters = np.array([wood_anderson_filter(inventory, seed_id, UTCDateTime(events[0][1]), sampling_rate, nfft, pre_filt, water_level)
+                        for seed_id in sorted(channels, key=channels.get)])
+    amplitudes = peak_amplitudes(data, filters, np.array(index), int(round(pad*sampling_rate)))
+    for name, ml in zip(names, local_magnitude(amplitudes, np.array(distances))):
+      if np.isfinite(ml):
+        readings.setdefault(name, []).append(ml)
+  return dict((name, (float(np.median(readings[name])), len(readings[name]))) for name in readings)
+
+
+def event_magnitudes(msfile, store, events_dict, workers=1, piece_length=30*60, **kwargs):
+  """
+  + Ml OF THE LOCATED EVENTS OF events_dict (as returned by runHypo71) FROM THE RAW WAVEFORMS OF msfile
+  + THE EVENTS ARE SPLIT IN PIECES OF AT MOST piece_length s OF msfile (each piece read once), THE PIECES RUN IN A PROCESS POOL
+  store: picks.PickStore of the events (the P picks give the stations and the measurement windows)
+  kwargs: passed on to magnitudes_piece
+  adds 'ml' and 'nml' (number of channels) to the entries of events_dict with a magnitude, returns events_dict
+  """
+  p_picks = dict((event, readings[readings['phase'] == 'P']) for event, readings in store.by_event())
+  events = []
+  for evname in sorted(events_dict, key=lambda evname: events_dict[evname]['origin_time']):
+    info = events_dict[evname]
+    p = p_picks.get(info.get('event'))
+    if p is not None and len(p) > 0:
+      events.append((evname, info['origin_time'].timestamp, info['evlat'], info['evlon'], info['evdep'], dict(zip(p['station'].tolist(), p['time'].tolist()))))
+
+  # pieces of consecutive events
+  pieces = []
+  for event in events:
+    if len(pieces) == 0 or event[1] - pieces[-1][0][1] > piece_length:
+      pieces.append([])
+    pieces[-1].append(event)
+
+  # the inventory is parsed (and pickled) and msfile indexed once, before the workers load them
+  load_inventory(kwargs.get('dataless_dir', "src/dataless"), kwargs.get('cache_dir', "src/invcache"))
+  load_index(msfile)
+  if workers > 1 and len(pieces) > 1:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = [pool.submit(magnitudes_piece, msfile, piece, **kwargs) for piece in pieces]
+      results = [future.result() for future in futures]
+  else:
+    results = [magnitudes_piece(msfile, piece, **kwargs) for piece in pieces]
+
+  for result in results:
+    for evname, (ml, nml) in result.items():
+      events_dict[evname].update({'ml': ml, 'nml': nml})
+  return events_dict
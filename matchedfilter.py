@@ -0,0 +1,281 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.signal import fftconvolve
+from obspy.core import UTCDateTime
+from hypo71 import hypo71
+from scripts import bcolors, preprocess_stream, trace_view
+from msindex import load_index, read_window
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  MATCHED-FILTER (TEMPLATE MATCHING) DETECTION
+#  templates are cut around the P (Z channel) and S (N, E channels) arrivals of the
+#  events located in hypo71/eq.pha; each channel of the continuous data is correlated
+#  with all the templates at once (FFT, normalized cross-correlation) at its own rate and
+#  over its own span, the correlations are shifted by the moveout of each template and
+#  stacked over its channels on an absolute time grid, and the stack peaks above
+#  threshold*MAD are the detections
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+class Template(object):
+  """
+  one template event: name, origin (epoch), sampling_rate (of its stack: the highest rate of its channels), ids (trace id of each
+  channel), rates (sampling rate of each channel), offsets (start of each channel window, in stack samples after the first one),
+  data (one demeaned, unit norm array per channel, at the rate of the channel), phases ('P' or 'S' of each channel), prepick (s from
+  the start of each window to its arrival), shift (s from the first channel window to the origin)
+  """
+  __slots__ = ("name", "origin", "sampling_rate", "ids", "rates", "offsets", "data", "phases", "prepick", "shift")
+
+  @property
+  def span(self):
+    # seconds covered by the template, from its first channel window to the end of its last one
+    return max(offset/self.sampling_rate + len(data)/rate for offset, data, rate in zip(self.offsets, self.data, self.rates))
+
+
+def make_templates(st, events, prepick=0.5, length=4., min_channels=3):
+  """
+  cuts the templates of events (as returned by hypo71.read_pha) from the pre-processed stream st
+  each channel window starts prepick seconds before the arrival and lasts length seconds, at the sampling rate of its trace
+  returns a list of Template (events with less than min_channels channels are skipped)
+  """
+  templates = []
+  for n, event in enumerate(events):
+    origin = event['origin_time'].timestamp
+    windows = []
+    for phase, key, channels in (('P', 'Tobs', "*Z"), ('S', 'TobsS', "*[NE]")):
+      for stname, tobs in event[key].items():
+        for tr in st.select(station=stname.strip('_'), channel=channels):
+          t1 = origin + float(tobs) - prepick
+          data = trace_view(tr, t1, t1 + length).data
+          npts = int(round(length*tr.stats.sampling_rate))
+          if len(data) >= npts and np.any(data[:npts] != data[0]):
+            windows.append((tr.id, t1, phase, tr.stats.sampling_rate, np.array(data[:npts], dtype=np.float64)))
+    if len(windows) < min_channels:
+      continue
+
+    template = Template()
+    template.name = "Event_%03i" % (n + 1)
+    template.origin = origin
+    template.sampling_rate = max(w[3] for w in windows)
+    t0 = min(w[1] for w in windows)
+    template.ids = [w[0] for w in windows]
+    template.rates = np.array([w[3] for w in windows])
+    template.offsets = np.array([int(round((w[1] - t0)*template.sampling_rate)) for w in windows])
+    template.phases = [w[2] for w in windows]
+    data = [w[4] - w[4].mean() for w in windows]
+    template.data = [d/np.linalg.norm(d) for d in data]
+    template.prepick = prepick
+    template.shift = origin - t0
+    templates.append(template)
+  return templates
+
+
+def templates_from_pha(msfile, freqmin, freqmax, tapering, event_file="hypo71/eq.pha", **kwargs):
+  """
+  reads the data around each event of event_file from msfile, pre-processes it as the continuous data and cuts the templates
+  kwargs: passed on to make_templates
+  """
+  templates = []
+  for n, event in enumerate(hypo71.read_pha(event_file)):
+    ttmax = max([float(t) for t in list(event['Tobs'].values()) + list(event['TobsS'].values())] + [0.])
+    t1 = event['origin_time'] - 60
+    t2 = event['origin_time'] + ttmax + 60
+    st = read_window(msfile, t1, t2)
+    if len(st) == 0:
+      continue
+    preprocess_stream(st, freqmin, freqmax, tapering)
+    for template in make_templates(st, [event], **kwargs):
+      template.name = "Event_%03i" % (n + 1)
+      templates.append(template)
+  return templates
+
+
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+def normalized_xcorr(data, templates):
+  """
+  normalized cross-correlation of the 1-D data with every row of templates (demeaned, unit norm), computed by FFT
+  returns (ntemplates, len(data) - npts + 1); windows of data without variance (e.g. gaps filled with zeros) give 0
+  """
+  npts = templates.shape[1]
+  data = np.asarray(data, dtype=np.float64)
+  csum = np.cumsum(np.r_[0., data])
+  csum2 = np.cumsum(np.r_[0., data*data])
+  var = (csum2[npts:] - csum2[:-npts]) - (csum[npts:] - csum[:-npts])**2/npts
+  std = np.sqrt(np.maximum(var, 0.))
+
+  cc = fftconvolve(data[None, :], templates[:, ::-1], mode="valid", axes=1)
+  valid = std > 1e-8*max(std.max(), 1e-300)
+  cc[:, valid] /= std[valid]
+  cc[:, ~valid] = 0.
+  return cc
+
+
+def scan_stream(st, templates, threshold=8., trig_int=2., min_channels=3, lag=0.5, window=None):
+  """
+  + CORRELATE EVERY CHANNEL OF THE PRE-PROCESSED STREAM st WITH THE TEMPLATES, STACK OVER THE CHANNELS OF EACH TEMPLATE
+  + DETECTIONS: STACK PEAKS ABOVE threshold*MAD (median absolute deviation of the stack), AT LEAST trig_int SECONDS APART
+  + RETURN A LIST OF DETECTIONS (dictionaries: template, time (origin, epoch), cc (mean over channels), threshold, picks)
+    picks: (station, 'P' or 'S') -> (cc, arrival time), the arrival of each channel moved by the lag (within +/- lag s) 
+           of its largest correlation
+  window: optional (t1, t2) tuple, only detections with t1 <= time < t2 are returned
+  each trace is correlated over its own span and at its own sampling rate; the correlations are stacked on an absolute time grid
+  at the rate of the template (interpolated if the channel has a lower rate), where a channel not covering a sample adds 0 to it
+  """
+  traces = dict((tr.id, tr) for tr in st if tr.stats.npts > 0)
+
+  # CHANNELS OF EACH TEMPLATE FOUND IN THE DATA (at the same sampling rate), START AND LENGTH OF ITS STACK: from the first to the
+  # last time of the first channel window of the template seen by any of its channels
+  channels = {}
+  grids = {}
+  stacks = {}
+  for template in templates:
+    channels[template.name] = [c for c, trace_id in enumerate(template.ids) if trace_id in traces and len(traces[trace_id].data) >= len(template.data[c])
+                               and template.rates[c] == traces[trace_id].stats.sampling_rate]
+    if len(channels[template.name]) >= min_channels:
+      starts, ends = [], []
+      for c in channels[template.name]:
+        tr = traces[template.ids[c]]
+        starts.append(tr.stats.starttime.timestamp - template.offsets[c]/template.sampling_rate)
+        ends.append(starts[-1] + (len(tr.data) - len(template.data[c]))/template.rates[c])
+      grids[template.name] = min(starts)
+      stacks[template.name] = np.zeros(int(round((max(ends) - min(starts))*template.sampling_rate)) + 1)
+
+  # CORRELATION OF EACH CHANNEL WITH ALL THE TEMPLATES SHARING IT (one FFT of the data per channel and template length), 
+  # added to the stacks right away at the absolute time of each sample, shifted by the offset of the channel in each template
+  for trace_id, tr in traces.items():
+    users = [(template, c) for template in templates if template.name in stacks for c in channels[template.name] if template.ids[c] == trace_id]
+    for npts in set(len(template.data[c]) for template, c in users):
+      group = [(template, c) for template, c in users if len(template.data[c]) == npts]
+      xcorr = normalized_xcorr(tr.data, np.array([template.data[c] for template, c in group]))
+      for (template, c), x in zip(group, xcorr):
+        stack = stacks[template.name]
+        t0 = tr.stats.starttime.timestamp - template.offsets[c]/template.sampling_rate - grids[template.name]
+        if template.rates[c] == template.sampling_rate:
+          i0 = int(round(t0*template.sampling_rate))
+          n = min(len(x), len(stack) - i0)
+          stack[i0:i0 + n] += x[:n]
+        else:
+          i1 = int(np.ceil(t0*template.sampling_rate - 1e-6))
+          i2 = min(int(np.floor((t0 + (len(x) - 1)/template.rates[c])*template.sampling_rate + 1e-6)), len(stack) - 1)
+          stack[i1:i2 + 1] += np.interp(np.arange(i1, i2 + 1)/template.sampling_rate, t0 + np.arange(len(x))/template.rates[c], x)
+      del xcorr
+
+  detections = []
+  for template in templates:
+    if template.name not in stacks:
+      continue
+    stack = stacks[template.name]
+    stack /= len(channels[template.name])
+
+    # THRESHOLD + PEAKS AT LEAST trig_int APART (the largest first)
+    mad = np.median(np.abs(stack - np.median(stack)))
+    thr = threshold*mad
+    above = np.flatnonzero((stack > thr) & (stack >= np.r_[-np.inf, stack[:-1]]) & (stack >= np.r_[stack[1:], -np.inf]))
+    peaks = []
+    for i in above[np.argsort(stack[above])[::-1]]:
+      if all(abs(i - j) >= trig_int*template.sampling_rate for j in peaks):
+        peaks.append(i)
+
+    for i in sorted(peaks):
+      time = grids[template.name] + i/template.sampling_rate + template.shift
+      if window is not None and not (window[0].timestamp <= time < window[1].timestamp):
+        continue
+
+      # ARRIVALS: best correlation of each channel within +/- lag of its place in the template (S: best of N and E)
+      picks = {}
+      for c in channels[template.name]:
+        tr = traces[template.ids[c]]
+        rate = template.rates[c]
+        j0 = int(round((time - template.shift + template.offsets[c]/template.sampling_rate - tr.stats.starttime.timestamp)*rate))
+        nlag = int(round(lag*rate))
+        j1 = max(j0 - nlag, 0)
+        segment = tr.data[j1:max(j0 + nlag + len(template.data[c]), 0)]
+        if len(segment) < len(template.data[c]):
+          continue
+        x = normalized_xcorr(segment, template.data[c][None, :])[0]
+        j = j1 + np.argmax(x)
+        arrival = (float(x[j - j1]), tr.stats.starttime.timestamp + int(j)/rate + template.prepick)
+        key = (template.ids[c].split('.')[1], template.phases[c])
+        picks[key] = max(picks.get(key, arrival), arrival)
+      detections.append({'template': template.name, 'time': time, 'cc': float(stack[i]), 'threshold': float(thr), 'nchannels': len(channels[template.name]), 'picks': picks})
+  return detections
+
+
+
+def detections_to_coincidences(detections, trig_int=2., similarity_threshold=0.7):
+  """
+  + KEEP THE BEST DETECTION (largest cc) OF ALL TEMPLATES WITHIN trig_int SECONDS
+  + RETURN A TIME-ORDERED LIST OF (time, picks list) IN THE FORMAT OF scripts.find_coincidences (to number_coincidences, 
+    export_picksfile, runHypo71): picks with a correlation below similarity_threshold get weight 1, the others 0
+  """
+  kept = []
+  for detection in sorted(detections, key=lambda d: d['cc'], reverse=True):
+    if all(abs(detection['time'] - other['time']) >= trig_int for other in kept):
+      kept.append(detection)
+
+  coincidences = []
+  for detection in sorted(kept, key=lambda d: d['time']):
+    picks_list = []
+    for (station, phase), (cc, time) in sorted(detection['picks'].items(), key=lambda item: item[1][1]):
+      if phase != 'P':
+        continue
+      pick = [station, time, int(cc < similarity_threshold), None, None]
+      if (station, 'S') in detection['picks']:
+        cc_s, time_s = detection['picks'][(station, 'S')]
+        pick[3:] = [time_s, int(cc_s < similarity_threshold)]
+      picks_list.append(tuple(pick))
+    coincidences.append((UTCDateTime(detection['time']), picks_list))
+  return coincidences
+
+
+def scan_window(msfile, t1, t2, templates, freqmin, freqmax, tapering, pad_before=0, pad_after=0, **kwargs):
+  """
+  + READ [t1-pad_before, t2+pad_after] FROM msfile, PRE-PROCESS IT AND SCAN IT WITH THE TEMPLATES
+  + RETURN ONLY THE DETECTIONS INSIDE [t1, t2)
+  kwargs: passed on to scan_stream
+  """
+  print(bcolors.HEADER + "\n+ Scanning %s - %s" % (t1.strftime("%Y-%m-%d %H:%M:%S"), t2.strftime("%Y-%m-%d %H:%M:%S")) + bcolors.ENDC)
+  st = read_window(msfile, t1-pad_before, t2+pad_after)
+  if len(st) == 0:
+    return []
+  preprocess_stream(st, freqmin, freqmax, tapering)
+  return scan_stream(st, templates, window=(t1, t2), **kwargs)
+
+
+def scan_archive(msfile, starttime, endtime, templates, freqmin, freqmax, tapering, chunk_length=3600., workers=1, lag=0.5, **kwargs):
+  """
+  + SCAN [starttime, endtime] OF msfile WITH THE TEMPLATES IN CHUNKS OF chunk_length SECONDS (padded with the taper and 
+    the span of the templates after their origin, so no detection is lost at the seams), ON workers PROCESSES
+  + RETURN THE DETECTIONS OF ALL TEMPLATES (see scan_stream)
+  kwargs: passed on to scan_stream (threshold, trig_int, min_channels)
+  """
+  if len(templates) == 0:
+    return []
+  after = max(template.span - template.shift for template in templates) + lag
+  taper = tapering*(chunk_length + after)/(1. - 2.*tapering)
+  pad_before, pad_after = taper, after + taper
+
+  chunks = []
+  t1 = starttime
+  while t1 < endtime:
+    t2 = min(t1 + chunk_length, endtime)
+    chunks.append((t1, t2))
+    t1 = t2
+
+  args = (templates, freqmin, freqmax, tapering)
+  detections = []
+  if workers > 1:
+    load_index(msfile)   # scanned once here, the workers load the saved index
+    print(bcolors.BOLD + "\n+ Scanning %i chunks with %i templates on %i workers..." % (len(chunks), len(templates), workers) + bcolors.ENDC)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = [pool.submit(scan_window, msfile, t1, t2, *args, pad_before=pad_before, pad_after=pad_after, lag=lag, **kwargs) for t1, t2 in chunks]
+      for future in futures:
+        detections += future.result()
+  else:
+    for t1, t2 in chunks:
+      detections += scan_window(msfile, t1, t2, *args, pad_before=pad_before, pad_after=pad_after, lag=lag, **kwargs)
+  return detections
@@ -0,0 +1,255 @@
+import os, io, mmap, fnmatch
+import numpy as np
+from obspy.core import read, UTCDateTime, Stream
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  RECORD-LEVEL INDEX OF miniSEED FILES
+#  every record of a file is scanned once (fixed header and blockette 1000 only, no
+#  decompression) into one row: channel, time of its first and last sample, byte offset
+#  and length. The index is saved next to the data (msfile.idx.npz) and kept in memory;
+#  read_window memory-maps the file and decodes only the records of the requested
+#  channels overlapping the requested time range, instead of obspy's read(starttime,
+#  endtime), which goes through the whole multi-day file for every window
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+INDEX_DTYPE = np.dtype([('id', 'U15'), ('code', 'i4'), ('start', 'f8'), ('end', 'f8'), ('reach', 'f8'), ('rate', 'f8'), ('offset', 'i8'),
+                        ('length', 'i4')])
+
+# indexes already loaded in this process: path -> (size, mtime, index)
+_indexes = {}
+
+
+def _integers(buf, offsets, pos, size, byteorder, signed=False):
+  # header field of size bytes at pos of every record, as int64
+  value = np.zeros(len(offsets), dtype=np.int64)
+  for k in range(size):
+    shift = 8*(size - 1 - k) if byteorder == ">" else 8*k
+    value |= buf[offsets + pos + k].astype(np.int64) << shift
+  if signed:
+    value = np.where(value >= 1 << (8*size - 1), value - (1 << 8*size), value)
+  return value
+
+
+def _text(buf, offsets, pos, size):
+  # fixed-width ASCII header field of every record (2-D array of bytes, one row per record)
+  return buf[offsets[:, None] + np.arange(pos, pos + size)]
+
+
+def _byteorder(buf, offset):
+  # byte order of the record at offset, from the plausibility of its year
+  if 1900 <= (int(buf[offset + 20]) << 8 | int(buf[offset + 21])) <= 2100:
+    return ">"
+  return "<"
+
+
+def _record_length(buf, offset, byteorder):
+  # length of the record at offset, from its blockette 1000 (None if it has none)
+  next_blockette = int(_integers(buf, np.array([offset]), 46, 2, byteorder)[0])
+  while 48 <= next_blockette < len(buf) - offset - 6:
+    header = _integers(buf, np.array([offset + next_blockette]), 0, 2, byteorder)[0]
+    if header == 1000:
+      return 1 << int(buf[offset + next_blockette + 6])
+    next_blockette = int(_integers(buf, np.array([offset + next_blockette]), 2, 2, byteorder)[0])
+  return None
+
+
+def record_offsets(buf):
+  """
+  byte offsets and lengths of the records of a miniSEED file (array of bytes): all records are first assumed to have the length
+  of the first one, which is checked on every record; files with mixed lengths are walked record by record
+  raises ValueError if buf is not miniSEED with blockette 1000
+  """
+  if len(buf) < 48 or chr(buf[6]) not in "DRQM":
+    raise ValueError("not a miniSEED file")
+  byteorder = _byteorder(buf, 0)
+  length = _record_length(buf, 0, byteorder)
+  if length is None:
+    raise ValueError("miniSEED record without blockette 1000")
+
+  if len(buf) % length == 0:
+    offsets = np.arange(0, len(buf), length, dtype=np.int64)
+    # blockette 1000 of every record, following the chain of blockettes (e.g. 1001 first) a few steps
+    position = _integers(buf, offsets, 46, 2, byteorder)
+    exponent = np.full(len(offsets), -1)
+    for step in range(4):
+      pending = np.flatnonzero((exponent < 0) & (position >= 48) & (position + 7 <= length))
+      if len(pending) == 0:
+        break
+      blockette = offsets[pending] + position[pending]
+      found = _integers(buf, blockette, 0, 2, byteorder) == 1000
+      exponent[pending[found]] = buf[blockette[found] + 6]
+      position[pending[~found]] = _integers(buf, blockette[~found], 2, 2, byteorder)
+    if np.all(exponent == exponent[0]):
+      return offsets, np.full(len(offsets), length, dtype=np.int32)
+
+  offsets, lengths = [], []
+  offset = 0
+  while offset + 48 <= len(buf):
+    length = _record_length(buf, offset, _byteorder(buf, offset))
+    if length is None:
+      raise ValueError("miniSEED record without blockette 1000 at byte %i" % offset)
+    offsets.append(offset)
+    lengths.append(length)
+    offset += length
+  return np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int32)
+
+
+def scan(msfile):
+  """
+  index (INDEX_DTYPE) of every record of the miniSEED file msfile: seed id (and its number among the sorted ids of the file),
+  epoch times of the first and last sample, latest last sample of the records of the channel so far (reach), sampling rate, byte
+  offset, length; sorted by channel and time, so that select_records only does binary searches
+  """
+  infile = open(msfile, "rb")
+  try:
+    buf = np.frombuffer(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ), dtype=np.uint8)
+  except ValueError:   # empty file
+    buf = np.zeros(0, dtype=np.uint8)
+  infile.close()
+  offsets, lengths = record_offsets(buf)
+  index = np.zeros(len(offsets), dtype=INDEX_DTYPE)
+  index['offset'] = offsets
+  index['length'] = lengths
+  if len(offsets) == 0:
+    return index
+
+  # byte order of each record, from the plausibility of its year
+  year = _integers(buf, offsets, 20, 2, ">")
+  is_big = (year >= 1900) & (year <= 2100)
+
+  for byteorder, sel in ((">", is_big), ("<", ~is_big)):
+    if not np.any(sel):
+      continue
+    o = offsets[sel]
+    # seed id, formatted once per distinct (station, location, channel, network)
+    codes = np.ascontiguousarray(_text(buf, o, 8, 12)).view("S12").ravel()
+    unique, inverse = np.unique(codes, return_inverse=True)
+    ids = np.array(["%s.%s.%s.%s" % (c[10:12].strip(), c[0:5].strip(), c[5:7].strip(), c[7:10].strip()) for c in (u.decode("ascii", "replace") for u in unique)])
+    index['id'][sel] = ids[inverse.reshape(-1)]
+
+    # start time (BTIME + time correction, unless already applied)
+    year = _integers(buf, o, 20, 2, byteorder)
+    doy = _integers(buf, o, 22, 2, byteorder)
+    days = (year - 1970).astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64) + doy - 1
+    seconds = days*86400. + buf[o + 24]*3600. + buf[o + 25]*60. + buf[o + 26] + _integers(buf, o, 28, 2, byteorder)*1e-4
+    correction = _integers(buf, o, 40, 4, byteorder, signed=True)*1e-4
+    seconds += np.where(buf[o + 36] & 2, 0., correction)
+
+    # sampling rate (factor and multiplier, SEED rules) and time of the last sample
+    nsamples = _integers(buf, o, 30, 2, byteorder)
+    factor = _integers(buf, o, 32, 2, byteorder, signed=True).astype(float)
+    multiplier = _integers(buf, o, 34, 2, byteorder, signed=True).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+      rate = np.where(factor > 0, np.where(multiplier >= 0, factor*np.abs(multiplier), -factor/multiplier),
+                      np.where(multiplier > 0, -multiplier/factor, 1./(factor*multiplier)))
+      duration = np.where((rate > 0) & np.isfinite(rate) & (nsamples > 0), (nsamples - 1)/rate, 0.)
+    index['start'][sel] = seconds
+    index['end'][sel] = seconds + duration
+    index['rate'][sel] = np.where(np.isfinite(rate), rate, 0.)
+  index['code'] = np.unique(index['id'], return_inverse=True)[1].reshape(-1)
+
+  index = index[np.lexsort((index['start'], index['code']))]
+  bounds = np.searchsorted(index['code'], np.arange(index['code'][-1] + 2))
+  for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+    index['reach'][lo:hi] = np.maximum.accumulate(index['end'][lo:hi])
+  return index
+
+
+def index_path(msfile):
+  """
+  file of the index of msfile (next to it)
+  """
+  return msfile + ".idx.npz"
+
+
+def load_index(msfile):
+  """
+  returns the index of msfile: from this process' memory, else from index_path(msfile) if it was made for the present size and
+  modification time of msfile, else scanned and saved there (kept in memory only if the directory is not writable)
+  """
+  info = os.stat(msfile)
+  cached = _indexes.get(os.path.abspath(msfile))
+  if cached is not None and cached[:2] == (info.st_size, info.st_mtime):
+    return cached[2]
+
+  path = index_path(msfile)
+  index = None
+  try:
+    arrays = np.load(path, allow_pickle=False)
+    if (int(arrays['size']), float(arrays['mtime'])) == (info.st_size, info.st_mtime) and arrays['index'].dtype == INDEX_DTYPE:
+      index = arrays['index']
+  except (IOError, OSError, KeyError, ValueError):
+    pass
+
+  if index is None:
+    index = scan(msfile)
+    # written under a temporary name first, so that concurrent processes never load a partial file
+    tmp = "%s.%i.tmp.npz" % (path[:-4], os.getpid())
+    try:
+      np.savez(tmp, index=index, size=info.st_size, mtime=info.st_mtime)
+      os.replace(tmp, path)
+    except (IOError, OSError):
+      pass
+
+  _indexes[os.path.abspath(msfile)] = (info.st_size, info.st_mtime, index)
+  return index
+
+
+def select_records(index, starttime=None, endtime=None, network="*", station="*", location="*", channel="*"):
+  """
+  rows of index of the channels matching network, station, location and channel (wildcards as in Stream.select) with samples
+  within one sample of [starttime, endtime] (UTCDateTime, epoch floats or None)
+  """
+  if len(index) == 0:
+    return index
+  t1 = float(UTCDateTime(starttime).timestamp) if starttime is not None else -np.inf
+  t2 = float(UTCDateTime(endtime).timestamp) if endtime is not None else np.inf
+  pattern = ("%s.%s.%s.%s" % (network, station, location, channel)).upper()
+
+  # rows of each channel, then of the time range by binary search (one sample + 1 s of slack, exact test below)
+  bounds = np.searchsorted(index['code'], np.arange(index['code'][-1] + 2))
+  rows = []
+  for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+    if lo == hi or not fnmatch.fnmatch(index['id'][lo].upper(), pattern):
+      continue
+    slack = 1. + (1./index['rate'][lo] if index['rate'][lo] > 0 else 0.)
+    i1 = lo + np.searchsorted(index['reach'][lo:hi], t1 - slack, side="left")
+    i2 = lo + np.searchsorted(index['start'][lo:hi], t2 + slack, side="right")
+    rows.append(np.arange(i1, i2))
+  records = index[np.concatenate(rows)] if len(rows) > 0 else index[:0]
+
+  # margin of one sample: trim keeps the nearest sample
+  with np.errstate(divide="ignore"):
+    margin = np.where(records['rate'] > 0, 1./records['rate'], 0.)
+  return records[(records['end'] + margin >= t1) & (records['start'] - margin <= t2)]
+
+
+def read_window(msfile, starttime=None, endtime=None, network="*", station="*", location="*", channel="*"):
+  """
+  + SAME STREAM AS read(msfile, starttime=starttime, endtime=endtime).select(...), BUT ONLY THE RECORDS OF THE SELECTED CHANNELS
+    OVERLAPPING [starttime, endtime] ARE TAKEN FROM THE (MEMORY-MAPPED) FILE AND DECODED, USING ITS RECORD INDEX (load_index)
+  + FILES THAT ARE NOT miniSEED ARE READ WITH OBSPY
+  """
+  try:
+    index = load_index(msfile)
+  except ValueError:
+    return read(msfile, starttime=starttime, endtime=endtime).select(network=network, station=station, location=location, channel=channel)
+
+  records = select_records(index, starttime, endtime, network, station, location, channel)
+  if len(records) == 0:
+    return Stream()
+  # records in file order, contiguous ones copied as one block
+  records = records[np.argsort(records['offset'], kind="stable")]
+  infile = open(msfile, "rb")
+  buf = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    ends = records['offset'] + records['length']
+    breaks = np.flatnonzero(records['offset'][1:] != ends[:-1]) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks, [len(records)])) - 1
+    data = b"".join(buf[records['offset'][i]:ends[j]] for i, j in zip(first.tolist(), last.tolist()))
+  finally:
+    buf.close()
+    infile.close()
+  return read(io.BytesIO(data), format="MSEED", starttime=UTCDateTime(starttime) if starttime is not None else None,
+              endtime=UTCDateTime(endtime) if endtime is not None else None)
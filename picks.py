@@ -0,0 +1,155 @@
+import numpy as np
+from hypo71.hypo71 import phase_lines
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  COLUMNAR PICK STORE
+#  the readings of all events in one structured array (one row per P or S reading:
+#  event id, station, phase, epoch time, weight) and the events in another one, instead
+#  of lists of tuples that are written to picks.txt and parsed back with one UTCDateTime
+#  per pick. Saved as a binary .npz file; converted to text (picks file, HYPO71 phase
+#  lines) only where hypo71pc or the user needs it
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+PICK_DTYPE = np.dtype([('event', 'i4'), ('station', 'U5'), ('phase', 'U1'), ('time', 'f8'), ('weight', 'i1')])
+EVENT_DTYPE = np.dtype([('event', 'i4'), ('time', 'f8')])
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+class PickStore(object):
+  """
+  picks: structured array (PICK_DTYPE) with the readings, grouped by event (in event order)
+  events: structured array (EVENT_DTYPE) with the event ids and times (coincidence time or first P)
+  """
+
+  def __init__(self, picks=None, events=None):
+    self.picks = np.zeros(0, dtype=PICK_DTYPE) if picks is None else picks
+    self.events = np.zeros(0, dtype=EVENT_DTYPE) if events is None else events
+
+  def __len__(self):
+    return len(self.events)
+
+  @classmethod
+  def from_coincidences(cls, coincidences_dict, times=None):
+    """
+    store of the coincidences_dict of autodetect (Event_001: [(station, P time, P weight, S time or None, S weight), ...], ...)
+    times: optional event times (epoch floats, in the order of coincidences_dict); default: first P of each event
+    """
+    columns = dict((name, []) for name in PICK_DTYPE.names)   # one list per column (no tuple per reading)
+    events = np.zeros(len(coincidences_dict), dtype=EVENT_DTYPE)
+    for n, evname in enumerate(coincidences_dict):
+      for stname, alert_P, weight_P, alert_S, weight_S in coincidences_dict[evname]:
+        for phase, alert, weight in (('P', alert_P, weight_P), ('S', alert_S, weight_S)):
+          if alert is not None:
+            columns['event'].append(n+1)
+            columns['station'].append(stname)
+            columns['phase'].append(phase)
+            columns['time'].append(alert)
+            columns['weight'].append(weight)
+      p_times = [pick[1] for pick in coincidences_dict[evname]]
+      events[n] = (n+1, times[n] if times is not None else (min(p_times) if len(p_times) > 0 else np.nan))
+
+    picks = np.zeros(len(columns['event']), dtype=PICK_DTYPE)
+    for name in PICK_DTYPE.names:
+      picks[name] = columns.pop(name)
+    return cls(picks, events)
+
+  @classmethod
+  def read_picksfile(cls, pickfile):
+    """
+    store of a picks file written by scripts.export_picksfile (one '#' line before the readings of each event)
+    """
+    rows = []
+    nevents = 0
+    infile = open(pickfile, "r")
+    for line in infile:
+      if line[0] == '#':
+        nevents += 1
+        continue
+      fields = line.split()
+      if len(fields) >= 4:
+        rows.append((nevents, fields[0], 'P', fields[2], fields[3]))
+      if len(fields) >= 7:
+        rows.append((nevents, fields[0], 'S', fields[5], fields[6]))
+    infile.close()
+
+    # event times: first P of each event
+    picks = np.array(rows, dtype=PICK_DTYPE)
+    first = np.full(nevents + 1, np.inf)
+    p = picks[picks['phase'] == 'P']
+    np.minimum.at(first, p['event'], p['time'])
+    events = np.zeros(nevents, dtype=EVENT_DTYPE)
+    events['event'] = np.arange(1, nevents+1)
+    events['time'] = np.where(np.isinf(first[1:]), np.nan, first[1:])
+    return cls(picks, events)
+
+  @classmethod
+  def load(cls, path):
+    """
+    reads a store saved by save
+    """
+    arrays = np.load(path, allow_pickle=False)
+    return cls(arrays['picks'], arrays['events'])
+
+  def save(self, path):
+    """
+    writes the picks and events arrays to the binary file path (compressed .npz)
+    """
+    np.savez_compressed(path, picks=self.picks, events=self.events)
+
+  def by_event(self):
+    """
+    yields (event id, readings of the event) for every event, the readings being a view on picks
+    """
+    first = np.searchsorted(self.picks['event'], self.events['event'], side="left")
+    last = np.searchsorted(self.picks['event'], self.events['event'], side="right")
+    for event, i1, i2 in zip(self.events['event'].tolist(), first.tolist(), last.tolist()):
+      yield event, self.picks[i1:i2]
+
+  def stations(self):
+    """
+    one row per (event, station) with its P reading and the S reading of the same station, if any
+    returns (event, station, p_time, p_weight, s_time (nan if no S), s_weight (0 if no S)) arrays, in the order of the P readings
+    """
+    is_p = self.picks['phase'] == 'P'
+    names, codes = np.unique(self.picks['station'], return_inverse=True)
+    key = self.picks['event'].astype(np.int64)*len(names) + codes.reshape(-1)
+    p = self.picks[is_p]
+    s = self.picks[~is_p]
+
+    # S reading of the same (event, station) as each P reading, by binary search on the sorted keys
+    s_time = np.full(len(p), np.nan)
+    s_weight = np.zeros(len(p), dtype=PICK_DTYPE['weight'])
+    if len(s) > 0:
+      order = np.argsort(key[~is_p], kind="stable")
+      s_key = key[~is_p][order]
+      i = np.minimum(np.searchsorted(s_key, key[is_p]), len(s_key) - 1)
+      found = s_key[i] == key[is_p]
+      s_time[found] = s['time'][order][i[found]]
+      s_weight[found] = s['weight'][order][i[found]]
+    return p['event'], p['station'], p['time'], p['weight'], s_time, s_weight
+
+  def to_coincidences(self):
+    """
+    returns the store as a coincidences_dict (Event_001: [(station, P time, P weight, S time or None, S weight), ...], ...)
+    """
+    event, station, p_time, p_weight, s_time, s_weight = self.stations()
+    coincidences_dict = dict(("Event_%03i" % n, []) for n in self.events['event'].tolist())
+    for ev, sta, tp, wp, ts, ws in zip(event.tolist(), station.tolist(), p_time.tolist(), p_weight.tolist(), s_time.tolist(), s_weight.tolist()):
+      coincidences_dict["Event_%03i" % ev].append((sta, tp, wp, None, None) if np.isnan(ts) else (sta, tp, wp, ts, ws))
+    return coincidences_dict
+
+  def hypo71_picks(self, chunk_size=10000):
+    """
+    returns the HYPO71 phase lines of every event, as hypo71.prepare_picks: {event id: {'hypolines': [lines sorted by station]}}
+    """
+    event, station, p_time, p_weight, s_time, s_weight = self.stations()
+    picks = dict((n, {'hypolines': []}) for n in self.events['event'].tolist())
+    for i in range(0, len(event), chunk_size):   # formatted by chunks, so that only the lines themselves take memory
+      j = slice(i, i + chunk_size)
+      for ev, line in zip(event[j].tolist(), phase_lines(station[j], p_time[j], p_weight[j], s_time[j], s_weight[j])):
+        picks[ev]['hypolines'].append(line)
+    for n in picks:
+      picks[n]['hypolines'].sort()
+    return picks
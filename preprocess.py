@@ -0,0 +1,119 @@
+import os
+import warnings
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy.signal import iirfilter, sosfilt, firwin, upfirdn
+from scipy.signal.windows import hann
+from obspy.core import Trace
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  THREADED PRE-PROCESSING OF THE RAW TRACES
+#  same steps and results as obspy's detrend("demean"), taper(type="hann"), merge and
+#  filter("bandpass") on a Stream, but trace by trace in a thread pool (the NumPy and
+#  SciPy kernels release the GIL) and with the band-pass run in place on the trace data,
+#  by chunks carrying the filter state (no full-length temporary per trace and pass).
+#  The samples can be kept in float32 (half the memory; the filters still compute in
+#  float64). decimate_trace gives the low-rate copies of the coincidence trigger
+#  (two-rate detection)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# filters already designed in this process: (freqmin, freqmax, sampling rate, corners) -> sos, decimation factor -> FIR
+_sos = {}
+_fir = {}
+
+
+def bandpass_sos(freqmin, freqmax, sampling_rate, corners=4):
+  """
+  second order sections of the Butterworth band-pass of obspy.signal.filter.bandpass (a high-pass at freqmin if freqmax
+  is at or above Nyquist, as obspy)
+  """
+  key = (freqmin, freqmax, sampling_rate, corners)
+  if key not in _sos:
+    fe = 0.5*sampling_rate
+    low, high = freqmin/fe, freqmax/fe
+    if high - 1.0 > -1e-6:
+      warnings.warn("Selected high corner frequency (%s) of bandpass is at or above Nyquist (%s). Applying a high-pass instead." % (freqmax, fe))
+      _sos[key] = iirfilter(corners, low, btype="highpass", ftype="butter", output="sos")
+    elif low > 1:
+      raise ValueError("Selected low corner frequency is above Nyquist.")
+    else:
+      _sos[key] = iirfilter(corners, [low, high], btype="band", ftype="butter", output="sos")
+  return _sos[key]
+
+
+def sosfilt_inplace(sos, data, zerophase=False, chunk_size=65536):
+  """
+  filters the 1-D float array data in place with the second order sections sos, chunk_size samples at a time
+  (the same samples as scipy's sosfilt, computed in float64 also for float32 data; zerophase: then backwards again, as obspy's
+  zerophase=True)
+  """
+  for view in ((data, data[::-1]) if zerophase else (data,)):
+    zi = np.zeros((len(sos), 2))
+    for i in range(0, len(view), chunk_size):
+      view[i:i+chunk_size], zi = sosfilt(sos, view[i:i+chunk_size], zi=zi)
+  return data
+
+
+def demean_taper(tr, max_percentage, dtype=np.float64):
+  """
+  demeans and tapers (hann, max_percentage of the trace at each end) the data of tr in place, as obspy's tr.detrend("demean") 
+  and tr.taper(max_percentage, type="hann"); the data becomes a dtype array (float64 as obspy, or float32)
+  """
+  npts = len(tr.data)
+  if npts == 0:
+    return tr
+  if np.dtype(dtype) == np.float64:
+    data = tr.data - tr.data.mean(keepdims=True)   # the only copy (needed anyway for integer counts)
+  else:
+    data = np.empty(npts, dtype=dtype)   # demeaned in float64 (by the ufunc buffers), then rounded
+    np.subtract(tr.data, tr.data.mean(dtype=np.float64), out=data, casting="same_kind")
+  wlen = min(int(max_percentage*npts), int(npts/2))
+  if wlen > 0:
+    sides = hann(2*wlen if 2*wlen == npts else 2*wlen + 1)
+    data[:wlen] *= sides[:wlen]
+    data[npts-wlen:] *= sides[len(sides)-wlen:]
+  tr.data = data
+  return tr
+
+
+def bandpass_inplace(tr, freqmin, freqmax, corners=4, zerophase=False, chunk_size=65536):
+  """
+  band-pass (bandpass_sos) of the float data of tr, in place (sosfilt_inplace)
+  """
+  sosfilt_inplace(bandpass_sos(freqmin, freqmax, tr.stats.sampling_rate, corners), tr.data, zerophase, chunk_size)
+  return tr
+
+
+def decimate_trace(tr, sampling_rate, freqmax=None):
+  """
+  copy of tr decimated by the largest integer factor keeping its rate at or above sampling_rate (same starttime; for traces already
+  at or below sampling_rate, a new Trace sharing the float samples of tr): anti-alias low-pass FIR (8*factor+1 taps, Kaiser window, cut-off at the new Nyquist)
+  evaluated only at the kept samples (polyphase, scipy's upfirdn) and centered on them, so that the samples are not delayed
+  freqmax: upper corner of the band-pass of the data, the factor is reduced so that the new Nyquist stays above it
+  """
+  factor = max(int(tr.stats.sampling_rate/sampling_rate + 1e-9), 1)
+  if freqmax is not None:
+    factor = max(min(factor, int(np.ceil(tr.stats.sampling_rate/(2.*freqmax))) - 1), 1)
+  header = {'network': tr.stats.network, 'station': tr.stats.station, 'location': tr.stats.location, 'channel': tr.stats.channel,
+            'sampling_rate': tr.stats.sampling_rate/factor, 'starttime': tr.stats.starttime}
+  dtype = np.float32 if tr.data.dtype == np.float32 else np.float64   # float32 data stays float32
+  if factor == 1:
+    return Trace(data=np.asarray(tr.data, dtype=dtype), header=header)
+  if factor not in _fir:
+    _fir[factor] = firwin(8*factor + 1, 1./factor, window=("kaiser", 5.))
+  # output m of upfirdn is centered on input sample (m - 4)*factor
+  data = upfirdn(_fir[factor].astype(dtype), np.asarray(tr.data, dtype=dtype), 1, factor)[4:4 + (len(tr.data) + factor - 1)//factor]
+  return Trace(data=data, header=header)
+
+
+def map_traces(func, traces, threads=None):
+  """
+  runs func(tr) on every trace, in a pool of threads (default: number of cores; 1: one after the other)
+  """
+  if threads is None:
+    threads = os.cpu_count() or 1
+  traces = list(traces)
+  if threads > 1 and len(traces) > 1:
+    with ThreadPoolExecutor(max_workers=min(threads, len(traces))) as pool:
+      return list(pool.map(func, traces))
+  return [func(tr) for tr in traces]
@@ -0,0 +1,259 @@
+import time
+import numpy as np
+from scipy.signal import sosfilt, sosfilt_zi
+from obspy.core import UTCDateTime
+from obspy.signal import trigger
+from stalta import recursive_sta_lta_2d
+from preprocess import bandpass_sos
+from scripts import bcolors, trace_view
+from msindex import read_window
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  NEAR-REAL-TIME DETECTION
+#  the autodetect logic (bandpass + recursive sta/lta + trigger coincidence + P/S picking)
+#  run incrementally over successive packets of each channel: the filter state, the sta/lta
+#  state and the trigger on/off state are carried from one packet to the next, so each
+#  sample is filtered and triggered only once
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+class _Channel(object):
+  """
+  state of one channel between two packets
+  """
+  __slots__ = ("sampling_rate", "sos", "zi", "stalta", "nseen", "next_time", "on")
+
+  def __init__(self, sampling_rate, sos, first_sample):
+    self.sampling_rate = sampling_rate
+    self.sos = sos
+    self.zi = sosfilt_zi(sos)*first_sample   # start the filter in steady state for the offset of the data
+    self.stalta = np.array([[0., 1e-99]])     # (sta, lta) of the last sample, as in obspy's recursion
+    self.nseen = 0                            # samples processed since the (re)start of the channel
+    self.next_time = None                     # expected epoch of the next sample
+    self.on = False                           # trigger on at the end of the last packet
+
+
+class RealTimeDetector(object):
+  """
+  incremental version of scripts.autodetect
+  feed it packets (Traces) of every Z, N and E channel with process(); it returns the new coincidences and picks as soon as
+  they are found, and keeps coincidences_dict in the same format as autodetect (to use export_picksfile / runHypo71)
+  """
+
+  def __init__(self, freqmin, freqmax, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_after, deadtime_after_pphase, corners=4):
+    self.freqmin = freqmin
+    self.freqmax = freqmax
+    self.corners = corners
+    self.sta = sta
+    self.lta = lta
+    self.thr_on = thr_on
+    self.thr_off = thr_off
+    self.min_num_stations = min_num_stations
+    self.deadtime_between_coincidences = deadtime_between_coincidences
+    self.time_after = time_after
+    self.deadtime_after_pphase = deadtime_after_pphase
+
+    self.channels = {}       # trace id -> _Channel
+    self.group = None        # overlapping Z triggers: {'members': {trace id: [station, on time, off time or None]}, 'event'}
+    self.events = []         # {'name', 'time', 'picks': {station: [P time, P weight, S time, S weight]}}
+    self.open_events = []    # events still waiting for late P and S picks
+    self.last_coincidence = None
+
+
+  # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+  def process(self, tr):
+    """
+    processes one packet of one channel; returns a list of messages:
+      ('coincidence', evname, time, stations)   when min_num_stations Z triggers overlap
+      ('pick', evname, station, phase, time, weight)
+    """
+    messages = []
+    ch = self._channel(tr)
+    data = tr.data
+
+    # DROP SAMPLES ALREADY PROCESSED, RESTART THE CHANNEL AFTER A GAP
+    t0 = tr.stats.starttime.timestamp
+    if ch.next_time is not None:
+      offset = int(round((ch.next_time - t0)*ch.sampling_rate))
+      if offset > 0:
+        data = data[offset:]
+        t0 += offset/ch.sampling_rate
+      elif offset < -1:
+        self._z_off(tr.id, ch.next_time)
+        ch = self._channel(tr, restart=True)
+    if len(data) == 0:
+      return messages
+    ch.next_time = t0 + len(data)/ch.sampling_rate
+
+    # BANDPASS (causal, carrying the filter state) + RECURSIVE STA/LTA (carrying sta and lta)
+    filtered, ch.zi = sosfilt(ch.sos, data, zi=ch.zi)
+    cft, ch.stalta = recursive_sta_lta_2d(filtered[None, :], int(ch.sampling_rate*self.sta), int(ch.sampling_rate*self.lta), zi=ch.stalta)
+    cft = cft[0]
+    nlta = int(ch.sampling_rate*self.lta)
+    if ch.nseen < nlta:
+      cft[:nlta - ch.nseen] = 0
+    ch.nseen += len(cft)
+
+    # TRIGGER ON/OFF (carrying the trigger state)
+    for on_time, off_time in self._triggers(ch, cft, t0):
+      if tr.stats.channel.endswith("Z"):
+        if on_time is not None:
+          messages += self._z_on(tr.id, tr.stats.station, on_time)
+        if off_time is not None:
+          self._z_off(tr.id, off_time)
+      elif on_time is not None:
+        messages += self._horizontal_on(tr.stats.station, on_time)
+
+    self._close_events(t0)
+    return messages
+
+
+  @property
+  def coincidences_dict(self):
+    """
+    events found so far, as returned by autodetect: {"Event_001": [(station, P time, P weight, S time, S weight), ...], ...}
+    """
+    return dict((event['name'], [tuple([stname] + pick) for stname, pick in event['picks'].items()]) for event in self.events)
+
+
+  # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+  def _channel(self, tr, restart=False):
+    if restart or tr.id not in self.channels:
+      # same filter as the pre-processing of autodetect (a high-pass when freqmax is at or above Nyquist, e.g. 10 Hz at 20 Hz)
+      sos = bandpass_sos(self.freqmin, self.freqmax, tr.stats.sampling_rate, self.corners)
+      self.channels[tr.id] = _Channel(tr.stats.sampling_rate, sos, float(tr.data[0]) if len(tr.data) > 0 else 0.)
+    return self.channels[tr.id]
+
+
+  def _triggers(self, ch, cft, t0):
+    """
+    returns the (on time, off time) of the triggers of this packet; None for an on time before the packet
+    (trigger still on from the previous one) or for an off time after it (trigger still on at the end)
+    """
+    triggers = []
+    start = 0
+    if ch.on:
+      below = np.flatnonzero(cft < self.thr_off)
+      if len(below) == 0:
+        return triggers
+      triggers.append((None, t0 + (below[0] - 1)/ch.sampling_rate))
+      ch.on = False
+      start = below[0]
+
+    for on, off in trigger.trigger_onset(cft[start:], self.thr_on, self.thr_off):
+      on_time = t0 + (start + on)/ch.sampling_rate
+      if start + off == len(cft) - 1 and cft[-1] >= self.thr_off:
+        ch.on = True
+        triggers.append((on_time, None))
+      else:
+        triggers.append((on_time, t0 + (start + off)/ch.sampling_rate))
+    return triggers
+
+
+  def _z_on(self, trace_id, station, on_time):
+    """
+    a Z trigger switched on: it joins the current group of overlapping Z triggers (or starts a new one), which becomes 
+    a coincidence as soon as min_num_stations stations are in it
+    """
+    messages = []
+    group = self.group
+    if group is not None:
+      offs = [member[2] for member in group['members'].values()]
+      group_off = np.inf if None in offs else max(offs)
+    if group is None or on_time > group_off:
+      group = self.group = {'members': {}, 'event': None}
+    if trace_id in group['members']:
+      return messages
+    group['members'][trace_id] = [station, on_time, None]
+
+    # LATE STATION OF A COINCIDENCE ALREADY FOUND
+    if group['event'] is not None:
+      return self._p_pick(group['event'], station, on_time)
+
+    first_on = {}
+    for stname, on, off in group['members'].values():
+      first_on[stname] = min(on, first_on.get(stname, on))
+    if len(first_on) < self.min_num_stations:
+      return messages
+
+    # NEW COINCIDENCE (unless it repeats the previous one)
+    timeX = min(first_on.values())
+    if self.last_coincidence is not None and abs(timeX - self.last_coincidence) < self.deadtime_between_coincidences:
+      group['event'] = False
+      return messages
+    self.last_coincidence = timeX
+
+    event = {'name': "Event_%03i" % (len(self.events) + 1), 'time': timeX, 'picks': {}}
+    self.events.append(event)
+    self.open_events.append(event)
+    group['event'] = event
+    print(bcolors.BOLD + "\n[%s] Coincident found at %s ..." % (event['name'], UTCDateTime(timeX).strftime("%Y-%m-%d %H:%M:%S")) + bcolors.ENDC)
+    messages.append(('coincidence', event['name'], UTCDateTime(timeX), sorted(first_on, key=first_on.get)))
+    for stname in sorted(first_on, key=first_on.get):
+      messages += self._p_pick(event, stname, first_on[stname])
+    return messages
+
+
+  def _z_off(self, trace_id, off_time):
+    if self.group is not None and trace_id in self.group['members']:
+      self.group['members'][trace_id][2] = off_time
+
+
+  def _p_pick(self, event, station, on_time):
+    if not event or station in event['picks'] or on_time - event['time'] > self.time_after:
+      return []
+    event['picks'][station] = [on_time, 0, None, None]
+    print(" "*4 + bcolors.OKGREEN + "%s P %.2f %i" % (station, on_time, 0) + bcolors.ENDC)
+    return [('pick', event['name'], station, 'P', on_time, 0)]
+
+
+  def _horizontal_on(self, station, on_time):
+    """
+    a N or E trigger switched on: it is the S-phase of the station if it comes after the P-phase + deadtime_after_pphase
+    (and within time_after) in an open event
+    """
+    messages = []
+    for event in self.open_events:
+      pick = event['picks'].get(station)
+      if pick is None or pick[2] is not None:
+        continue
+      if pick[0] + self.deadtime_after_pphase < on_time <= pick[0] + self.time_after:
+        pick[2:] = [on_time, 0]
+        print(" "*4 + bcolors.OKGREEN + "%s S %.2f %i" % (station, on_time, 0) + bcolors.ENDC)
+        messages.append(('pick', event['name'], station, 'S', on_time, 0))
+    return messages
+
+
+  def _close_events(self, now):
+    # events older than time_after cannot get new picks anymore
+    self.open_events = [event for event in self.open_events if now - event['time'] <= self.time_after + self.deadtime_after_pphase]
+
+
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+def replay_mseed(msfile, packet_length=1., starttime=None, endtime=None, speed=None):
+  """
+  local file-replay source for RealTimeDetector: reads msfile and yields it as packets of packet_length seconds per channel, 
+  in time order (all channels of a time slot, then the next slot)
+  speed: None to replay as fast as possible, 1 to replay in real time, 10 for ten times faster, ...
+  """
+  st = read_window(msfile, starttime, endtime)
+  st.merge(method=1, fill_value='interpolate')
+  st.sort()
+  t = min(tr.stats.starttime for tr in st).timestamp
+  tend = max(tr.stats.endtime for tr in st).timestamp
+  clock = time.time()
+  while t <= tend:
+    for tr in st:
+      packet = trace_view(tr, t, t + packet_length - tr.stats.delta/2.)
+      if packet.stats.npts > 0:
+        yield packet
+    t += packet_length
+    if speed:
+      clock += packet_length/speed
+      time.sleep(max(clock - time.time(), 0))
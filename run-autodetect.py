@@ -1,8 +1,10 @@
-import os, glob
+import os, glob, argparse
 import numpy as np
 from copy import deepcopy as cp
 from obspy.core import read, UTCDateTime, Stream
-from scripts import autodetect, runHypo71
+from scripts import autodetect_archive, runHypo71
+from picks import PickStore
+from magnitude import event_magnitudes
 #from pygema.read import get_stations_info, get_waveforms
 
 class bcolors:
@@ -16,6 +18,27 @@ class bcolors:
   UNDERLINE = '\033[4m'
 
 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# COMMAND LINE OPTIONS
+parser = argparse.ArgumentParser(description="automatic detection and location of local events (sta/lta + hypo71)")
+parser.add_argument("--workers", type=int, default=1, help="number of processes used to run the time windows in parallel (default: 1)")
+parser.add_argument("--threads", type=int, default=None, help="number of threads pre-processing the traces of a window (default: number of cores, divided among the workers)")
+parser.add_argument("--trigger-rate", type=float, default=None, help="run the coincidence trigger on the Z channels decimated to this rate in Hz, e.g. 25 (the picks stay at full rate); only channels sampled well above 2*freqmax are decimated, so on the 20/25/50 Hz GM archive only LONQ is")
+parser.add_argument("--float32", action="store_true", help="carry the filtered waveforms, characteristic functions and pick segments as float32 (half the memory)")
+parser.add_argument("--cache-cft", action="store_true", help="compute the STA/LTA of each channel once and reuse it for the coincidence trigger and the P/S picking")
+parser.add_argument("--cache-dir", default=None, help="keep the pre-processed windows in this directory and reuse them in the next runs (e.g. src/wavecache)")
+parser.add_argument("--cache-max-lta", type=float, default=60., help="with --cache-dir, windows padded for the warm-up of this lta in s, so that runs with any lta up to it reuse them (default: %(default)s)")
+parser.add_argument("--associate", action="store_true", help="group the P/S onsets of all stations into events by travel-time consistency instead of trigger coincidence + deadtime")
+parser.add_argument("--save-picks", default=None, help="also write the picks of all events to this binary file (.npz, see picks.PickStore.load)")
+parser.add_argument("--hypo71-batch", action="store_true", help="locate all events with one single HYPO71 run")
+parser.add_argument("--locator", choices=["hypo71", "numpy"], default="hypo71", help="hypo71pc or the native in-process locator (default: %(default)s)")
+parser.add_argument("--bootstrap", type=int, default=0, help="number of relocations with perturbed arrival times for the location errors (default: 0, no errors)")
+parser.add_argument("--bootstrap-sigma", type=float, default=0.2, help="standard deviation in s of the perturbation of the arrival times (default: %(default)s)")
+parser.add_argument("--magnitude", action="store_true", help="local magnitude Ml of the located events from the raw waveforms and the dataless metadata (src/dataless)")
+args = parser.parse_args()
+
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 # READ WAVEFORMS
@@ -27,9 +50,6 @@ endtime   = UTCDateTime("2019-09-30 19:25:00")
 msfile = "src/msfiles/STREAM_2019.09.29_2019.10.01"
 
 
-st = read(msfile, starttime=starttime, endtime=endtime )
-
-
 # READ STATION INFORMATION
 network_info = np.loadtxt("src/stations.net", dtype="str")
 networks = network_info[0]
@@ -45,10 +65,12 @@ freqmin = 3.5
 freqmax = 10
 tapering = 0.05
 
+if args.trigger_rate is not None and args.trigger_rate/2. <= freqmax:
+  parser.error("--trigger-rate %g Hz: its Nyquist (%g Hz) must be above the upper corner of the band-pass (freqmax = %g Hz)" % (args.trigger_rate, args.trigger_rate/2., freqmax))
 
 
 # SET PARAMETERS FOR TRIGGER COINCIDENT
-time_window_length = 30*60
+time_window_length = 30*60 # the archive is processed in windows of this length (only one window in memory at a time)
 
 sta = 0.5
 lta = 10
@@ -66,11 +88,11 @@ deadtime_after_pphase = 3 # deadtime after the trigger coincidence when trimming
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-#  1) RUN TRIGGER COINCIDENT IN A LONG TIME-WINDOW (take in consideration the lta parameter length)
+#  1) RUN TRIGGER COINCIDENT IN LONG TIME-WINDOWS OF time_window_length (padded by the lta warm-up and the taper width)
 #  2) IF ANY COINCIDENCE EXISTS, COMPUTE STA/LTA FOR P-PHASE AND S-PHASE IN A SHORT TIME WINDOW
 #  3) THEN, RETURN DICTIONARY OF EVENTS IN HYPO71 FORMAT
 
-coincidences_dict = autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase)
+coincidences_dict = autodetect_archive(msfile, starttime, endtime, time_window_length, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase, workers=args.workers, threads=args.threads, dtype=np.float32 if args.float32 else np.float64, trigger_rate=args.trigger_rate, cache_cft=args.cache_cft, associate=args.associate, cache_dir=args.cache_dir, cache_max_lta=args.cache_max_lta)
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -78,7 +100,15 @@ coincidences_dict = autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on,
 
 # RUN HYPO71
 if len(coincidences_dict)>0:
-  events_dict = runHypo71(coincidences_dict, maxgap=360)
+  store = PickStore.from_coincidences(coincidences_dict)
+  if args.save_picks is not None:
+    store.save(args.save_picks)
+  events_dict = runHypo71(store, maxgap=360, batch=args.hypo71_batch, backend=args.locator, 
+                          nboot=args.bootstrap, sigma=args.bootstrap_sigma)
+
+  # LOCAL MAGNITUDE (raw segments around the P picks, Wood-Anderson simulation)
+  if args.magnitude:
+    event_magnitudes(msfile, store, events_dict, workers=args.workers)
 
   # LOOP OVER EACH EVENT
   for evid in events_dict:
@@ -88,13 +118,13 @@ if len(coincidences_dict)>0:
     evlon  = infodict['evlon']
     evlat  = infodict['evlat']
     evdep  = infodict['evdep']
-    evmag  = -99 
+    evmag  = infodict.get('ml', -99)
     evnstats = infodict['nphases']
     evgap  = infodict['gap']
     evrms  = infodict['rms']
-    everrx = -99
-    everry = -99
-    everrz = -99
+    everrx = infodict.get('errx', -99)
+    everry = infodict.get('erry', -99)
+    everrz = infodict.get('errz', -99)
     status = "automatic"
     #print(bcolors.WARNING+"[insert]  %s  %.4f %.4f  %.1f km   Ml %.1f  %i %.1f %.1f    %.1f km %.1f km %.1f km  (%s) " % (evtime.strftime("%Y-%m-%d %H:%M:%S"), evlon, evlat, evdep, evmag, evnstats, evgap, evrms, everrx, everry, everrz, status  ) + bcolors.ENDC )
 
@@ -0,0 +1,36 @@
+import argparse
+from obspy.core import UTCDateTime
+from scripts import bcolors
+from catalog import read_catalog, read_events, compare, format_report, format_matches
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  COMPARISON OF THE LOCATED EVENTS (hypo71/eq.pha) WITH THE MANUAL CATALOG src/catalogo.txt
+
+parser = argparse.ArgumentParser(description="compare the located events with the reference catalog")
+parser.add_argument("--events", default="hypo71/eq.pha", help="located events (default: %(default)s)")
+parser.add_argument("--catalog", default="src/catalogo.txt", help="reference catalog (default: %(default)s)")
+parser.add_argument("--max-dt", type=float, default=5., help="largest origin time difference of a match in s (default: %(default)s)")
+parser.add_argument("--max-distance", type=float, default=20., help="largest epicentral distance of a match in km (default: %(default)s)")
+parser.add_argument("--output", default="matches.txt", help="file with the hits, misses and false alarms (default: %(default)s)")
+args = parser.parse_args()
+
+
+# TIME SPAN OF THE COMPARISON (the one processed by run-autodetect.py)
+starttime = UTCDateTime("2019-09-30 18:45:00")
+endtime   = UTCDateTime("2019-09-30 19:25:00")
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+reference = read_catalog(args.catalog, starttime, endtime)
+events = read_events(args.events, starttime, endtime)
+report = compare(reference, events, max_dt=args.max_dt, max_distance=args.max_distance)
+
+outfile = open(args.output, "w")
+outfile.write("\n".join(format_matches(report, reference, events)) + "\n")
+outfile.close()
+
+print(bcolors.BOLD + "\n+ %s vs %s  (%s - %s, matches within %.1f s and %.1f km, list in %s)\n" % (args.events, args.catalog, starttime.strftime("%Y-%m-%d %H:%M:%S"), 
+      endtime.strftime("%Y-%m-%d %H:%M:%S"), args.max_dt, args.max_distance, args.output) + bcolors.ENDC)
+for line in format_report(report):
+  print(line)
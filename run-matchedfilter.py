@@ -0,0 +1,49 @@
+import argparse
+from obspy.core import UTCDateTime
+from matchedfilter import templates_from_pha, scan_archive, detections_to_coincidences
+from scripts import number_coincidences, export_picksfile
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  MATCHED-FILTER DETECTION WITH THE EVENTS OF hypo71/eq.pha AS TEMPLATES
+#  (same pre-processing as run-autodetect.py)
+
+parser = argparse.ArgumentParser(description="matched-filter detection using the located events of hypo71/eq.pha as templates")
+parser.add_argument("--workers", type=int, default=1, help="number of processes scanning the chunks in parallel (default: 1)")
+parser.add_argument("--threshold", type=float, default=8., help="detection threshold, in MADs of the stacked correlation (default: 8)")
+parser.add_argument("--event-file", default="hypo71/eq.pha", help="located events used as templates (default: %(default)s)")
+args = parser.parse_args()
+
+
+# READ WAVEFORMS
+starttime = UTCDateTime("2019-09-30 18:45:00")
+endtime   = UTCDateTime("2019-09-30 19:25:00")
+
+msfile = "src/msfiles/STREAM_2019.09.29_2019.10.01"
+chunk_length = 60*60   # seconds of data scanned at a time by each worker
+
+
+# SET PARAMETERS FOR PRE-PROCESSING OF RAWDATA
+freqmin = 3.5
+freqmax = 10
+tapering = 0.05
+
+
+# SET PARAMETERS FOR THE TEMPLATES
+prepick = 0.5      # seconds before the P/S arrival
+length = 4.        # seconds of each channel window
+min_channels = 3
+
+
+# SET PARAMETERS FOR THE DETECTION
+trig_int = 2.               # minimum time between two detections
+similarity_threshold = 0.7  # picks correlating less than this get weight 1
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+templates = templates_from_pha(msfile, freqmin, freqmax, tapering, event_file=args.event_file, prepick=prepick, length=length, min_channels=min_channels)
+detections = scan_archive(msfile, starttime, endtime, templates, freqmin, freqmax, tapering, chunk_length=chunk_length, workers=args.workers, 
+                          threshold=args.threshold, trig_int=trig_int, min_channels=min_channels)
+
+coincidences_dict = number_coincidences(detections_to_coincidences(detections, trig_int=trig_int, similarity_threshold=similarity_threshold), 0)
+export_picksfile(coincidences_dict, pickfile="picks_matchedfilter.txt")
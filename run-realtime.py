@@ -0,0 +1,50 @@
+import argparse
+from obspy.core import UTCDateTime
+from realtime import RealTimeDetector, replay_mseed
+from scripts import export_picksfile
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  NEAR-REAL-TIME DETECTION, REPLAYING A LOCAL MINISEED FILE PACKET BY PACKET
+#  (same parameters as run-autodetect.py)
+
+parser = argparse.ArgumentParser(description="near-real-time detection (sta/lta) replaying a miniseed file")
+parser.add_argument("--packet-length", type=float, default=0.5, help="length of the replayed packets in seconds (default: 0.5)")
+parser.add_argument("--speed", type=float, default=None, help="replay speed (1 = real time; default: as fast as possible)")
+args = parser.parse_args()
+
+
+# READ WAVEFORMS
+starttime = UTCDateTime("2019-09-30 18:45:00")
+endtime   = UTCDateTime("2019-09-30 19:25:00")
+
+msfile = "src/msfiles/STREAM_2019.09.29_2019.10.01"
+
+
+# SET PARAMETERS FOR PRE-PROCESSING OF RAWDATA
+freqmin = 3.5
+freqmax = 10
+
+
+# SET PARAMETERS FOR TRIGGER COINCIDENT
+sta = 0.5
+lta = 10
+thr_on = 3.
+thr_off = 1.5
+
+min_num_stations = 4
+deadtime_between_coincidences = 10
+
+
+# SET PARAMETERS FOR P/S PICKING
+time_after = 60*2     # picks are accepted up to this time after the trigger coincidence
+deadtime_after_pphase = 3 # deadtime after the p-phase before looking for the s-phase
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+detector = RealTimeDetector(freqmin, freqmax, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_after, deadtime_after_pphase)
+
+for packet in replay_mseed(msfile, packet_length=args.packet_length, starttime=starttime, endtime=endtime, speed=args.speed):
+  detector.process(packet)
+
+export_picksfile(detector.coincidences_dict, pickfile="picks.txt")
@@ -0,0 +1,61 @@
+import argparse
+from obspy.core import UTCDateTime
+from scripts import bcolors
+from sweep import sweep, format_table
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  PARAMETER SWEEP OF THE TRIGGER COINCIDENCE (sta, lta, thr_on, thr_off, min_num_stations)
+#  SCORED AGAINST THE MANUAL CATALOG src/catalogo.txt (same pre-processing as run-autodetect.py)
+
+parser = argparse.ArgumentParser(description="grid search of the trigger parameters against the catalog")
+parser.add_argument("--sta", type=float, nargs="+", default=[0.3, 0.5, 1.], help="sta lengths in s (default: %(default)s)")
+parser.add_argument("--lta", type=float, nargs="+", default=[5., 10., 20.], help="lta lengths in s (default: %(default)s)")
+parser.add_argument("--thr-on", type=float, nargs="+", default=[2., 2.5, 3., 4., 5.], help="trigger on thresholds (default: %(default)s)")
+parser.add_argument("--thr-off", type=float, nargs="+", default=[0.8, 1., 1.5], help="trigger off thresholds (default: %(default)s)")
+parser.add_argument("--min-stations", type=int, nargs="+", default=[3, 4, 5, 6], help="minimum number of stations of a coincidence (default: %(default)s)")
+parser.add_argument("--workers", type=int, default=1, help="number of processes (default: 1)")
+parser.add_argument("--cache-dir", default="src/wavecache", help="waveform cache of the pre-processed windows (default: %(default)s)")
+parser.add_argument("--catalog", default="src/catalogo.txt", help="reference catalog (default: %(default)s)")
+parser.add_argument("--top", type=int, default=20, help="number of combinations printed (default: %(default)s)")
+parser.add_argument("--output", default="sweep.txt", help="file with the whole ranked table (default: %(default)s)")
+args = parser.parse_args()
+
+
+# READ WAVEFORMS
+starttime = UTCDateTime("2019-09-30 18:45:00")
+endtime   = UTCDateTime("2019-09-30 19:25:00")
+
+msfile = "src/msfiles/STREAM_2019.09.29_2019.10.01"
+time_window_length = 30*60
+
+
+# SET PARAMETERS FOR PRE-PROCESSING OF RAWDATA
+freqmin = 3.5
+freqmax = 10
+tapering = 0.05
+
+
+# SET PARAMETERS KEPT FIXED
+deadtime_between_coincidences = 10
+time_after = 60*2
+
+
+# SET MATCHING WINDOW AROUND THE CATALOG ORIGIN TIMES
+before = 5.
+after = 30.
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+table = sweep(msfile, starttime, endtime, time_window_length, freqmin, freqmax, tapering, args.sta, args.lta, args.thr_on, args.thr_off, args.min_stations,
+              deadtime_between_coincidences, time_after=time_after, catalog_file=args.catalog, cache_dir=args.cache_dir, workers=args.workers,
+              before=before, after=after)
+
+lines = format_table(table)
+outfile = open(args.output, "w")
+outfile.write("\n".join(lines) + "\n")
+outfile.close()
+
+print(bcolors.BOLD + "\n+ Best %i of %i combinations (whole table in %s)\n" % (min(args.top, len(table)), len(table), args.output) + bcolors.ENDC)
+for line in lines[:args.top+1]:
+  print(line)
@@ -1,11 +1,20 @@
 import os, glob
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 from copy import deepcopy as cp
-from obspy.core import read, UTCDateTime, Stream
+from obspy.core import read, UTCDateTime, Stream, Trace
 from obspy.signal import trigger 
 from obspy.geodetics.base import degrees2kilometers, calc_vincenty_inverse
 from hypo71 import hypo71
+import locator
+from associator import Associator
+from picks import PickStore
+from bootstrap import bootstrap_events
+from timing import sample_time, sample_index
+from msindex import load_index, read_window
+from preprocess import map_traces, demean_taper, bandpass_inplace, decimate_trace
+from stalta import coincidence_events
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 
@@ -22,19 +31,17 @@ class bcolors:
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 
-def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase):
+def preprocess_stream(st, freqmin, freqmax, tapering, threads=None, zerophase=False, dtype=np.float64):
   """ 
-  + RUN TRIGGER COINCIDENT IN A LONG TIME-WINDOW (take in consideration the lta parameter length)
-  + IF ANY COINCIDENCE EXISTS, COMPUTE STA/LTA FOR P-PHASE AND S-PHASE IN A SHORT TIME WINDOW
-  + THEN, RETURN DICTIONARY OF EVENTS IN HYPO71 FORMAT
+  + DETREND, TAPER, MERGE AND BANDPASS THE RAWDATA (in place, trace by trace in a pool of threads, see preprocess.py)
+  + THEN REMOVE THE TAPERED CORNERS OF EACH TRACE
+  threads: number of threads (default: number of cores)
+  zerophase: band-pass forwards and backwards (default: causal, as before)
+  dtype: dtype of the pre-processed samples (np.float32: half the memory, the filter still computes in float64)
   """
-
-  # PRE-PROCESSING OF RAWDATA
-  print(bcolors.BOLD + "\n+ Pre-processing rawdata..." + bcolors.ENDC)
-  st.detrend("demean")
-  st.taper(max_percentage=tapering, type="hann")
+  map_traces(lambda tr: demean_taper(tr, tapering, dtype), st, threads)
   st.merge(method=1, fill_value='interpolate')
-  st.filter("bandpass",freqmin=freqmin,freqmax=freqmax)
+  map_traces(lambda tr: bandpass_inplace(tr, freqmin, freqmax, zerophase=zerophase), st, threads)
   st.sort()
 
 
@@ -43,18 +50,98 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
     dt = tapering*(tr.stats.endtime-tr.stats.starttime)
     tr.trim(tr.stats.starttime+dt, tr.stats.endtime-dt)
 
+  return st
+
+
+
+
+def trace_view(tr, t1, t2):
+  """ 
+  returns a Trace with the samples of tr between t1 and t2 (UTCDateTime or epoch floats; nearest samples, like Trace.trim) 
+  without copying them: the data is a read-only NumPy view on tr.data, so it must be copied (e.g. trace.copy()) before writing on it
+  """
+  i1 = min(max(sample_index(tr, t1), 0), tr.stats.npts)
+  i2 = min(max(sample_index(tr, t2) + 1, i1), tr.stats.npts)
+
+  data = tr.data[i1:i2]
+  data.flags.writeable = False
+  header = {'network': tr.stats.network, 'station': tr.stats.station, 'location': tr.stats.location, 'channel': tr.stats.channel, 
+            'sampling_rate': tr.stats.sampling_rate, 'starttime': UTCDateTime(sample_time(tr, i1))}
+  return Trace(data=data, header=header)
+
+
+
+
+def characteristic_functions(st, sta, lta):
+  """ 
+  returns a Stream with the recursive STA/LTA of every trace of st (same stats), computed once over the whole trace
+  (kept in float32 for float32 data)
+  """
+  st_cft = Stream()
+  for tr in st:
+    cft = trigger.recursive_sta_lta(tr.data, int(tr.stats.sampling_rate*sta), int(tr.stats.sampling_rate*lta))
+    if tr.data.dtype == np.float32:
+      cft = cft.astype(np.float32)
+    st_cft.append(Trace(data=cft, header=tr.stats))
+  return st_cft
+
+
+
+
+def decimated_triggers(st, sampling_rate, sta, lta, thr_on, thr_off, freqmax=None):
+  """ 
+  returns the single channel triggers (on, off, trace id; epoch floats) of the recursive STA/LTA of the traces of st decimated to 
+  about sampling_rate (preprocess.decimate_trace), one trace at a time: only one low-rate copy and its cft are in memory
+  freqmax: upper corner of the band-pass of st, no trace is decimated to a Nyquist at or below it
+  """
+  triggers = []
+  for tr in st:
+    tr = decimate_trace(tr, sampling_rate, freqmax)
+    cft = trigger.recursive_sta_lta(tr.data, int(tr.stats.sampling_rate*sta), int(tr.stats.sampling_rate*lta))
+    triggers += [(sample_time(tr, on), sample_time(tr, off), tr.id) for on, off in trigger.trigger_onset(cft, thr_on, thr_off)]
+  return triggers
+
+
+
+
+def find_coincidences(st, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase, window=None, cache_cft=False, associate=False, trigger_rate=None, freqmax=None):
+  """ 
+  + RUN TRIGGER COINCIDENT OVER A PRE-PROCESSED STREAM
+  + PICK P-PHASE AND S-PHASE FOR EACH STATION OF EACH COINCIDENCE
+  + RETURN A TIME-ORDERED LIST OF (coincidence time, picks list)
+  window: optional (t1, t2) tuple, only coincidences with t1 <= time < t2 are returned
+  cache_cft: if True, the recursive STA/LTA of every Z, N and E channel is computed once over the whole stream and 
+             both the coincidence trigger and the P/S onset search index into it (no per-event recomputation, no 
+             cold start of the lta at the beginning of each short segment)
+  associate: if True, the P and S onsets of all stations are grouped into events by travel-time consistency 
+             (see associate_onsets) instead of the trigger coincidence and the deadtime between coincidences
+  trigger_rate: if given (Hz, e.g. 25), the coincidence trigger runs on the Z channels decimated to about that rate 
+                (see decimated_triggers); the P and S picks are still searched in the full-rate data
+  freqmax: upper corner of the band-pass of st, the decimation of trigger_rate keeps the Nyquist of every trace above it
+  """
+  if associate:
+    return associate_onsets(st, sta, lta, thr_on, thr_off, min_num_stations, window=window)
 
   # RUN COINCIDENCE TRIGGER (STA/LTA + CORRELATION)
   print(bcolors.BOLD + "\n+ Running trigger coincidence..." + bcolors.ENDC)
-  st_z = st.copy().select(channel="*Z")
-  output = trigger.coincidence_trigger("recstalta", thr_on=thr_on, thr_off=thr_off, 
-                                        stream=st_z, 
-                                        thr_coincidence_sum=min_num_stations, sta=sta, lta=lta,  
-                                        trigger_off_extension=0, similarity_threshold=0.7, 
-                                        details=True)
-
-  # CREATE OUTPUT DICTIONARY OF EVENTS
-  coincidences_dict = {}
+  if cache_cft:
+    st_pick = characteristic_functions(st, sta, lta)
+    trigger_type = None
+  else:
+    st_pick = st
+    trigger_type = "recstalta"
+  if trigger_rate is not None:
+    output = coincidence_events(decimated_triggers(st.select(channel="*Z"), trigger_rate, sta, lta, thr_on, thr_off, freqmax), min_num_stations)
+  else:
+    st_z = st_pick.select(channel="*Z") # coincidence_trigger works on its own copy of each trace
+    output = trigger.coincidence_trigger(trigger_type, thr_on=thr_on, thr_off=thr_off, 
+                                          stream=st_z, 
+                                          thr_coincidence_sum=min_num_stations, sta=sta, lta=lta,  
+                                          trigger_off_extension=0, similarity_threshold=0.7, 
+                                          details=True)
+
+  # CREATE OUTPUT LIST OF EVENTS
+  coincidences = []
 
   # LOOP OVER EACH EVENT (if anyone is found)
   timeX_old = 0
@@ -69,24 +156,24 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
       continue
     timeX_old = cp(timeX)
 
+    # IF EVENT IS OUTSIDE THE REQUESTED WINDOW (i.e. in the padding), THEN CONTINUE
+    if window is not None and not (window[0] <= timeX < window[1]):
+      continue
+
     # PRINT TRIGGER COINCIDENCE TIME
     print( bcolors.BOLD + "\n[%i] Coincident found at %s ..." % (evnum, timeX.strftime("%Y-%m-%d %H:%M:%S")) + bcolors.ENDC   )
 
-
     # LOOP OVER EACH STATION + CUT SHORT SEGMENT
     picks_list = []
     for stname in traces:
       try:
-        st_short = st.copy().select(station=stname)
         t1 = timeX - time_before
         t2 = timeX + time_after
-        st_short.trim(t1, t2)
+        st_short = st_pick.select(station=stname)
 
         ######## RUN STA/LTA FOR P-PHASE ########
         tr_z = st_short.select(channel="*Z")[0]
-        cft = trigger.recursive_sta_lta(tr_z.data, int(tr_z.stats.sampling_rate*sta), int(tr_z.stats.sampling_rate*lta))
-        on_off = trigger.trigger_onset(cft, thr_on, thr_off)
-        #trigger.plot_trigger(tr_z, cft,thr_on, thr_off, show=True)
+        on_off = _segment_onsets(tr_z, t1, t2, sta, lta, thr_on, thr_off, cache_cft)
         if len(on_off) > 0:
           weight = 0
           if len(on_off) > 1: 
@@ -94,8 +181,8 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
             #print(bcolors.WARNING + "(warning: more than one alert for P-phase at %s)"%(tr_z.stats.station) + bcolors.ENDC  )
 
           # DEFINE ARRIVAL TIME OF THE P-PHASE AS THE FIRST TRIGGER FOUND
-          alert_P = tr_z.times("UTCDateTime")[on_off[0][0]]   
-          alert_pattern = "%s P %.2f %i" % (tr_z.stats.station, alert_P.timestamp, weight)
+          alert_P = on_off[0]
+          pick = [tr_z.stats.station, alert_P, weight, None, None]
 
 
 
@@ -103,10 +190,7 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
           flag_Snorth = False
           try:
             tr_n = st_short.select(channel="*N")[0]
-            tr_n.trim(alert_P+deadtime_after_pphase, tr_n.stats.endtime)
-            cft_n = trigger.recursive_sta_lta(tr_n.data, int(tr_n.stats.sampling_rate*sta), int(tr_n.stats.sampling_rate*lta))
-            on_off_Sn = trigger.trigger_onset(cft_n, thr_on, thr_off)
-            #trigger.plot_trigger(tr_n, cft_n,thr_on, thr_off, show=True)
+            on_off_Sn = _segment_onsets(tr_n, alert_P+deadtime_after_pphase, t2, sta, lta, thr_on, thr_off, cache_cft)
             if len(on_off_Sn) > 0:
               flag_Snorth = True
               weight_Sn = 0
@@ -115,7 +199,7 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
                 #print(bcolors.WARNING + "(Warning: more than one alert for S-phase north component)" + bcolors.ENDC)
 
               # DEFINE ARRIVAL TIME OF THE S-PHASE AS THE FIRST TRIGGER FOUND
-              alert_Sn = tr_n.times("UTCDateTime")[on_off_Sn[0][0]]   
+              alert_Sn = on_off_Sn[0]
 
           except:
             continue
@@ -125,10 +209,7 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
           flag_Seast = False
           try:
             tr_e = st_short.select(channel="*E")[0]
-            tr_e.trim(alert_P+deadtime_after_pphase, tr_e.stats.endtime)
-            cft_e = trigger.recursive_sta_lta(tr_e.data, int(tr_e.stats.sampling_rate*sta), int(tr_e.stats.sampling_rate*lta))
-            on_off_Se = trigger.trigger_onset(cft_e, thr_on, thr_off)
-            #trigger.plot_trigger(tr_e, cft_e,thr_on, thr_off, show=True)
+            on_off_Se = _segment_onsets(tr_e, alert_P+deadtime_after_pphase, t2, sta, lta, thr_on, thr_off, cache_cft)
             if len(on_off_Se) > 0:
               flag_Seast = True
               weight_Se = 0
@@ -137,7 +218,7 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
                 #print(bcolors.WARNING + "(Warning: more than one alert for S-phase east component)" + bcolors.ENDC)
 
               # DEFINE ARRIVAL TIME OF THE S-PHASE AS THE FIRST TRIGGER FOUND
-              alert_Se = tr_e.times("UTCDateTime")[on_off_Se[0][0]]   
+              alert_Se = on_off_Se[0]
 
           except:
             continue
@@ -149,13 +230,13 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
               if alert_Sn-alert_P<=deadtime_after_pphase and alert_Sn-alert_P>0:
                 alert_S = cp(alert_Sn)
                 weight_S = cp(weight_Sn)
-                alert_pattern += " S %.2f %i" % (alert_S.timestamp, weight_S)      
+                pick[3:] = [alert_S, weight_S]
 
             elif weight_Sn>weight_Se:
               if alert_Se-alert_P<=deadtime_after_pphase and alert_Se-alert_P>0:
                 alert_S = cp(alert_Se)
                 weight_S = cp(weight_Se)
-                alert_pattern += " S %.2f %i" % (alert_S.timestamp, weight_S)      
+                pick[3:] = [alert_S, weight_S]
 
             else:
               timediff = abs(alert_Sn-alert_Se)
@@ -165,28 +246,108 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
                 else:
                   alert_S = alert_Sn-timediff/2.
                 weight_S = cp(weight_Sn)
-                alert_pattern += " S %.2f %i" % (alert_S.timestamp, weight_S)      
+                pick[3:] = [alert_S, weight_S]
 
           elif flag_Snorth and not flag_Seast:
             if alert_Sn-alert_P<=deadtime_after_pphase and alert_Sn-alert_P>0:
               alert_S = cp(alert_Sn)
-              alert_pattern += " S %.2f %i" % (alert_S.timestamp, weight_Sn)      
+              pick[3:] = [alert_S, weight_Sn]
 
           elif not flag_Snorth and flag_Seast:
             if alert_Se-alert_P<=deadtime_after_pphase and alert_Se-alert_P>0:
               alert_S = cp(alert_Se)
-              alert_pattern += " S %.2f %i" % (alert_S.timestamp, weight_Se)      
+              pick[3:] = [alert_S, weight_Se]
 
 
           # PRINT OUTPUT
-          print(" "*4 + bcolors.OKGREEN + alert_pattern + bcolors.ENDC)
-          picks_list.append(alert_pattern)
+          print(" "*4 + bcolors.OKGREEN + format_pick(pick) + bcolors.ENDC)
+          picks_list.append(tuple(pick))
 
 
       except:
         continue
 
-    # APPEND PICKS TO DICTIONARY
+    # APPEND PICKS TO LIST
+    coincidences.append((timeX, cp(picks_list)))
+    evnum += 1
+
+  return coincidences
+
+
+
+
+def _segment_onsets(tr, t1, t2, sta, lta, thr_on, thr_off, cache_cft):
+  """ 
+  returns the trigger onset times (epoch floats) found between t1 and t2 in trace tr
+  tr: filtered data (the STA/LTA of the [t1, t2] segment is computed here) or, with cache_cft, the cached characteristic function
+  """
+  if not cache_cft:
+    tr = trace_view(tr, t1, t2)
+    if tr.stats.npts == 0:
+      return []
+    cft = trigger.recursive_sta_lta(tr.data, int(tr.stats.sampling_rate*sta), int(tr.stats.sampling_rate*lta))
+    return [sample_time(tr, on) for on, off in trigger.trigger_onset(cft, thr_on, thr_off)]
+
+  cft = tr.data
+  i1 = min(max(sample_index(tr, t1), 0), len(cft))
+  i2 = min(max(sample_index(tr, t2) + 1, i1), len(cft))
+
+  # a trigger still on at t1 started before the segment: go back to where the cft was last below thr_off, 
+  # so that the trigger hysteresis is the same as over the whole trace
+  j = i1
+  step = max(int(tr.stats.sampling_rate*lta), 1)
+  while 0 < j < len(cft) and cft[j] >= thr_off:
+    k = max(j - step, 0)
+    below = np.flatnonzero(cft[k:j] < thr_off)
+    j = k + below[-1] if len(below) > 0 else k
+    if len(below) > 0:
+      break
+
+  return [sample_time(tr, j + on) for on, off in trigger.trigger_onset(cft[j:i2], thr_on, thr_off) if j + on >= i1]
+
+
+
+
+def associate_onsets(st, sta, lta, thr_on, thr_off, min_num_stations, window=None):
+  """ 
+  + P ONSETS ON EVERY Z CHANNEL, S ONSETS ON EVERY N AND E CHANNEL (recursive STA/LTA over the whole stream)
+  + GROUP THEM INTO EVENTS BY TRAVEL-TIME CONSISTENCY WITH THE 1-D MODEL AND THE STATIONS OF src/stations.net (associator.Associator)
+  + RETURN A TIME-ORDERED LIST OF (first P time, picks list), as find_coincidences
+  window: optional (t1, t2) tuple, only events with their first P at t1 <= time < t2 are returned
+  """
+  print(bcolors.BOLD + "\n+ Running phase association..." + bcolors.ENDC)
+  onsets = []
+  for tr in characteristic_functions(st, sta, lta):
+    phase = "P" if tr.stats.channel.endswith("Z") else "S"
+    onsets += [(tr.stats.station, phase, sample_time(tr, on)) for on, off in trigger.trigger_onset(tr.data, thr_on, thr_off)]
+
+  coincidences = []
+  for timeX, picks_list in Associator(min_num_stations=min_num_stations).associate(onsets):
+    if window is not None and not (window[0] <= timeX < window[1]):
+      continue
+    print( bcolors.BOLD + "\n[%i] Event associated at %s ..." % (len(coincidences)+1, timeX.strftime("%Y-%m-%d %H:%M:%S")) + bcolors.ENDC   )
+    for pick in picks_list:
+      print(" "*4 + bcolors.OKGREEN + format_pick(pick) + bcolors.ENDC)
+    coincidences.append((timeX, picks_list))
+  return coincidences
+
+
+
+
+def number_coincidences(coincidences, deadtime_between_coincidences):
+  """ 
+  + SORT COINCIDENCES BY TIME AND DROP REPEATED ONES (e.g. found twice at the seam of two windows)
+    (deadtime_between_coincidences=0 keeps them all, e.g. for associated events)
+  + RETURN DICTIONARY OF EVENTS IN HYPO71 FORMAT (Event_001, Event_002, ...)
+  """
+  coincidences_dict = {}
+  timeX_old = 0
+  evnum = 1
+  for timeX, picks_list in sorted(coincidences, key=lambda c: c[0]):
+    if abs(timeX - timeX_old) < deadtime_between_coincidences:
+      continue
+    timeX_old = cp(timeX)
+
     evname = "Event_%03i" % (evnum)
     coincidences_dict.update({evname: cp(picks_list)})
     evnum += 1
@@ -196,9 +357,145 @@ def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_nu
 
 
 
+def autodetect(st, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase, threads=None, dtype=np.float64, **options):
+  """ 
+  + RUN TRIGGER COINCIDENT IN A LONG TIME-WINDOW (take in consideration the lta parameter length)
+  + IF ANY COINCIDENCE EXISTS, COMPUTE STA/LTA FOR P-PHASE AND S-PHASE IN A SHORT TIME WINDOW
+  + THEN, RETURN DICTIONARY OF EVENTS IN HYPO71 FORMAT
+  threads: number of threads of the pre-processing (default: number of cores)
+  dtype: np.float32 to carry the filtered data, characteristic functions and pick segments as float32 (half the memory)
+  options: passed on to find_coincidences (e.g. cache_cft=True, associate=True)
+  """
+
+  # PRE-PROCESSING OF RAWDATA
+  print(bcolors.BOLD + "\n+ Pre-processing rawdata..." + bcolors.ENDC)
+  preprocess_stream(st, freqmin, freqmax, tapering, threads=threads, dtype=dtype)
+
+  # TRIGGER COINCIDENCE + PICKING
+  coincidences = find_coincidences(st, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase, freqmax=freqmax, **options)
+
+  # associated events are already separated by their moveout, no deadtime between them
+  if options.get("associate"):
+    deadtime_between_coincidences = 0
+  return number_coincidences(coincidences, deadtime_between_coincidences)
+
+
+
+
+def window_padding(time_window_length, tapering, lta, time_after, lta_warmup=3):
+  """ 
+  returns the (before, after) padding in seconds needed around a window of time_window_length seconds, so that
+  after removing the tapered corners (tapering*total length on each side) the STA/LTA is warmed up at the
+  start of the window and the short picking segment (time_after) still fits for coincidences at its end
+  lta_warmup: number of lta lengths kept before the window (the recursive lta only reaches ~95% after 3*lta)
+  """
+  warmup = lta_warmup*lta
+  taper = tapering*(time_window_length + warmup + time_after)/(1. - 2.*tapering)
+  return warmup + taper, time_after + taper
+
+
+
+
+def archive_windows(starttime, endtime, time_window_length):
+  """ 
+  returns the consecutive (t1, t2) windows of time_window_length seconds covering [starttime, endtime] (the last one may be shorter)
+  """
+  windows = []
+  t1 = starttime
+  while t1 < endtime:
+    t2 = min(t1 + time_window_length, endtime)
+    windows.append((t1, t2))
+    t1 = t2
+  return windows
+
+
+
+
+def detect_window(msfile, t1, t2, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase, pad_before=0, pad_after=0, cache_dir=None, threads=None, dtype=np.float64, **options):
+  """ 
+  + READ [t1-pad_before, t2+pad_after] FROM msfile, PRE-PROCESS IT AND RUN THE DETECTION
+  + RETURN ONLY THE COINCIDENCES FOUND INSIDE [t1, t2)
+  cache_dir: if given, the pre-processed window is taken from (or stored in) the waveform cache of that directory (wavecache.py)
+  threads: number of threads of the pre-processing (default: number of cores)
+  dtype: np.float32 to carry the filtered data, characteristic functions and pick segments as float32 (also the samples
+         stored in the waveform cache)
+  options: passed on to find_coincidences
+  """
+  print(bcolors.HEADER + "\n+ Window %s - %s" % (t1.strftime("%Y-%m-%d %H:%M:%S"), t2.strftime("%Y-%m-%d %H:%M:%S")) + bcolors.ENDC)
+  if cache_dir is not None:
+    from wavecache import WaveformCache
+    st = WaveformCache(cache_dir, dtype=dtype).read_preprocessed(msfile, t1-pad_before, t2+pad_after, freqmin, freqmax, tapering, threads=threads)
+    if len(st) == 0:
+      return []
+  else:
+    st = read_window(msfile, t1-pad_before, t2+pad_after)
+    if len(st) == 0:
+      return []
+    preprocess_stream(st, freqmin, freqmax, tapering, threads=threads, dtype=dtype)
+
+  return find_coincidences(st, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase, window=(t1, t2), freqmax=freqmax, **options)
+
+
+
+
+def autodetect_archive(msfile, starttime, endtime, time_window_length, freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase, workers=1, cache_max_lta=60., cache_max_time_after=120., **options):
+  """ 
+  + WALK OVER [starttime, endtime] OF msfile IN WINDOWS OF time_window_length SECONDS
+  + EACH WINDOW IS PADDED (lta warm-up + taper before, picking segment + taper after) SO NO TRIGGER IS LOST AT THE EDGES
+  + ONLY ONE WINDOW IS KEPT IN MEMORY AT A TIME (per worker)
+  + THEN, RETURN DICTIONARY OF EVENTS IN HYPO71 FORMAT (coincidences repeated at the seams are removed)
+  workers: number of processes; with workers > 1 the windows are pre-processed, triggered and picked in a process pool
+           (and, unless threads is given, each window is pre-processed with number of cores / workers threads)
+  cache_max_lta, cache_max_time_after: with cache_dir, the windows are padded for these largest lta and time_after (unless lta or 
+           time_after are larger), so that the cached windows do not depend on the lta and time_after tested (as sweep.py)
+  options: passed on to detect_window and find_coincidences (e.g. cache_dir="src/wavecache", cache_cft=True, associate=True)
+  """
+  if options.get("cache_dir") is not None:
+    pad_before, pad_after = window_padding(time_window_length, tapering, max(lta, cache_max_lta), max(time_after, cache_max_time_after))
+  else:
+    pad_before, pad_after = window_padding(time_window_length, tapering, lta, time_after)
+  windows = archive_windows(starttime, endtime, time_window_length)
+
+  args = (freqmin, freqmax, tapering, sta, lta, thr_on, thr_off, min_num_stations, deadtime_between_coincidences, time_before, time_after, deadtime_after_pphase)
+  coincidences = []
+  if workers > 1:
+    if options.get("threads") is None:
+      options["threads"] = max((os.cpu_count() or 1)//workers, 1)
+    load_index(msfile)   # scanned once here, the workers load the saved index
+    print(bcolors.BOLD + "\n+ Running %i windows on %i workers..." % (len(windows), workers) + bcolors.ENDC)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = [pool.submit(detect_window, msfile, t1, t2, *args, pad_before=pad_before, pad_after=pad_after, **options) for t1, t2 in windows]
+      for future in futures:
+        coincidences += future.result()
+  else:
+    for t1, t2 in windows:
+      coincidences += detect_window(msfile, t1, t2, *args, pad_before=pad_before, pad_after=pad_after, **options)
+
+  # associated events are already separated by their moveout, no deadtime between them
+  if options.get("associate"):
+    deadtime_between_coincidences = 0
+  return number_coincidences(coincidences, deadtime_between_coincidences)
+
+
+
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 
 
+def format_pick(pick):
+  """ 
+  formats a (station, P time, P weight, S time, S weight) pick (epoch floats, S time None if there is no S-phase) 
+  as a line of the picks file, e.g. "COPA P 1569869939.92 0 S 1569869961.02 0"
+  """
+  stname, alert_P, weight_P, alert_S, weight_S = pick
+  alert_pattern = "%s P %.2f %i" % (stname, alert_P, weight_P)
+  if alert_S is not None:
+    alert_pattern += " S %.2f %i" % (alert_S, weight_S)
+  return alert_pattern
+
+
+
+
 def export_picksfile(coincidences_dict, pickfile="picks.txt"):
 
   if len(coincidences_dict)>0:
@@ -211,9 +508,8 @@ def export_picksfile(coincidences_dict, pickfile="picks.txt"):
       outfile.write("#"*40)
       outfile.write("\n")
 
-      for alert_pattern in coincidences_dict[event]:
-        alert_pattern += "\n"
-        outfile.write(alert_pattern)
+      for pick in coincidences_dict[event]:
+        outfile.write(format_pick(pick) + "\n")
 
     outfile.write("\n")
     outfile.close()
@@ -229,48 +525,56 @@ def export_picksfile(coincidences_dict, pickfile="picks.txt"):
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 
 
-def runHypo71(coincidences_dict, maxgap=360):
+def runHypo71(coincidences_dict, maxgap=360, workers=None, batch=False, backend="hypo71", nboot=0, sigma=0.2):
+  """ 
+  + LOCATE THE EVENTS OF coincidences_dict (or of a picks.PickStore) WITH HYPO71 (each event in its own temporary working directory, 
+    running up to workers hypo71pc processes at the same time; default: number of cores)
+    batch=True: all events in one single hypo71pc run instead (one input file, one process)
+    backend="numpy": locate in-process with the native locator (locator.py, model src/model.cru) instead of hypo71pc
+  + nboot > 0: LOCATION ERRORS OF EACH EVENT FROM nboot RELOCATIONS WITH THE ARRIVAL TIMES PERTURBED BY sigma s (bootstrap.py, 
+    up to workers processes), AS errx, erry, errz (km) AND THE ERROR ELLIPSE (smajor, sminor, azimuth)
+  + WRITE THE LOCATED EVENTS TO hypo71/eq.pha AND RETURN THEM AS A DICTIONARY
+  """
   #pathHypo71 = "%s/hypo71" % (os.environ['PYGEMADIR']) # editar solo en caso de tener claro lo que haces!
   pathHypo71 = "hypo71" 
-  phfile = "picks.txt"
-  evfile = "eq.pha"
-
-  if os.path.isfile(pathHypo71+"/"+phfile):
-    os.remove(pathHypo71+"/"+phfile)
-
-  if os.path.isfile(pathHypo71+"/"+evfile):
-    os.remove(pathHypo71+"/"+evfile)
+  phfile = pathHypo71+"/picks.txt"
+  evfile = pathHypo71+"/eq.pha"
 
-  # generate pickfile from dictionary in hypo71 format
-  export_picksfile(coincidences_dict, pickfile=pathHypo71+"/"+phfile)
-
-  # move to hypo71 work folder
-  currdir = os.getcwd()
-  os.chdir(pathHypo71)
+  if os.path.isfile(phfile):
+    os.remove(phfile)
 
+  if os.path.isfile(evfile):
+    os.remove(evfile)
 
+  # picks of all events in columnar arrays; the picks file is only written for the user
+  if isinstance(coincidences_dict, PickStore):
+    store = coincidences_dict
+    coincidences_dict = store.to_coincidences()
+  else:
+    store = PickStore.from_coincidences(coincidences_dict)
+  export_picksfile(coincidences_dict, pickfile=phfile)
 
 
 
   ######## bassicly is the do_job.py script from Sippl Summer School 2020, University of Concepcion ########
 
-  # read picks file (from "auto-detector")
-  picks = hypo71.prepare_picks(phfile)  
+  # phase lines in hypo71 format, straight from the arrays (as hypo71.prepare_picks(phfile))
+  picks = store.hypo71_picks()
+
+  # locate all events (in one hypo71pc run or in parallel, without leaving the current folder)
+  if backend == "numpy":
+    outs = locator.locate_store(store, station_file="src/stations.net", model_file="src/model.cru")
+  elif batch:
+    outs = hypo71.locate_events_batch(picks, pathHypo71+"/info_file", pathHypo71+"/velmod.hdr")
+  else:
+    outs = hypo71.locate_events(picks, pathHypo71+"/info_file", pathHypo71+"/velmod.hdr", workers=workers)
 
   # loop over each event in picks file
   events_dict = {}
+  hypocenters = {}
   evnum = 1
-  for npick in picks:
+  for event, out in zip(store.events['event'].tolist(), outs):
     try:
-      # generate input file "hypo71_input"
-      hypo71.generate_input(".", picks[npick]["hypolines"], "info_file", "velmod.hdr") 
-
-      # run hypo71
-      hypo71.call_Hypo71(".")
-
-      # read hypo71 results
-      out = hypo71.read_output(".")
-
       # write out in HYPODD format if condition is satisficed
       if float(out["gap"])<=maxgap:
         hypo71.write_pha(out, evfile, evnum)
@@ -301,21 +605,27 @@ def runHypo71(coincidences_dict, maxgap=360):
                                      'evdep'      : evdep, 
                                      'nphases'      : nphases, 
                                      'gap'      : gap, 
-                                     'rms'      : rms
+                                     'rms'      : rms,
+                                     'event'      : event
                                      } 
                             })
+        hypocenters[event] = (evname, evlat, evlon, evdep)
 
     except:
       continue
 
     evnum += 1
 
-  # return to your folder
-  os.chdir(currdir)
+  # BOOTSTRAP LOCATION ERRORS
+  if nboot > 0 and len(hypocenters) > 0:
+    print(bcolors.BOLD + "\n+ Bootstrap of %i events (%i relocations each, sigma = %.2f s)..." % (len(hypocenters), nboot, sigma) + bcolors.ENDC)
+    errors = bootstrap_events(store, dict((event, hypocenters[event][1:]) for event in hypocenters), niter=nboot, sigma=sigma, backend=backend, 
+                              workers=workers, info_file=pathHypo71+"/info_file", velmod=pathHypo71+"/velmod.hdr")
+    for event in sorted(hypocenters):
+      evname = hypocenters[event][0]
+      if errors[event] is not None:
+        events_dict[evname].update(errors[event])
+        print("[%s] errx = %.2f km  erry = %.2f km  errz = %.2f km  ellipse %.2f x %.2f km (azimuth %.0f)" % (evname, errors[event]['errx'], 
+              errors[event]['erry'], errors[event]['errz'], errors[event]['smajor'], errors[event]['sminor'], errors[event]['azimuth']))
 
   return events_dict
-
-
-
-
-
@@ -0,0 +1,200 @@
+import numpy as np
+from scipy.signal import lfilter
+from obspy.core import UTCDateTime
+from timing import round_away
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  MULTI-CHANNEL STA/LTA ENGINE
+#  all channels of a window are packed in one 2-D array (one row per channel) and the
+#  characteristic functions and trigger onsets are computed for every row at once.
+#  results match obspy.signal.trigger (classic_sta_lta, recursive_sta_lta, trigger_onset)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+def pack_stream(st, dtype=np.float64):
+  """
+  packs the traces of st (same sampling rate) into a 2-D array over their common time span
+  returns (data, starttime, sampling_rate, trace_ids); data has one row per trace
+  """
+  if len(st) == 0:
+    return np.empty((0, 0), dtype=dtype), None, None, []
+  sampling_rate = st[0].stats.sampling_rate
+  if any(tr.stats.sampling_rate != sampling_rate for tr in st):
+    raise ValueError("all traces must have the same sampling rate to be packed")
+
+  starttime = max(tr.stats.starttime for tr in st)
+  endtime = min(tr.stats.endtime for tr in st)
+  npts = max(int(round_away((endtime - starttime)*sampling_rate)) + 1, 0)
+
+  data = np.empty((len(st), npts), dtype=dtype)
+  for i, tr in enumerate(st):
+    i1 = round_away((starttime - tr.stats.starttime)*sampling_rate)
+    data[i] = tr.data[i1:i1+npts]
+  return data, starttime, sampling_rate, [tr.id for tr in st]
+
+
+def pack_groups(st, dtype=np.float64):
+  """
+  packs the traces of st into one 2-D array per time base (traces with the same sampling rate, starttime and number of samples),
+  so that nothing is cut from any trace and mixed sampling rates are allowed
+  returns a list of (data, starttime, sampling_rate, trace_ids) as pack_stream, one per time base
+  """
+  groups = {}
+  for tr in st:
+    groups.setdefault((tr.stats.sampling_rate, tr.stats.starttime.timestamp, tr.stats.npts), []).append(tr)
+  return [pack_stream(traces, dtype) for traces in groups.values()]
+
+
+def classic_sta_lta_2d(data, nsta, nlta):
+  """
+  classic STA/LTA of every row of data (moving averages from cumulative sums of the squared samples)
+  """
+  data = np.atleast_2d(data)
+  csum = np.square(data, dtype=np.float64)
+  np.cumsum(csum, axis=1, out=csum)
+
+  sta = np.empty_like(csum)
+  sta[:, :nsta] = csum[:, :nsta]
+  np.subtract(csum[:, nsta:], csum[:, :-nsta], out=sta[:, nsta:])
+  sta /= nsta
+  sta[:, :nlta-1] = 0
+
+  # the lta overwrites the cumulative sum from the end, so that the samples still needed are not modified yet
+  csum[:, nlta:] -= csum[:, :-nlta].copy()
+  csum /= nlta
+  np.maximum(csum, np.finfo(0.0).tiny, out=csum)
+
+  sta /= csum
+  return sta
+
+
+def recursive_sta_lta_2d(data, nsta, nlta, zi=None):
+  """
+  recursive STA/LTA of every row of data (the sta and lta recursions are first order IIR filters run on all rows at once)
+  zi: optional (nrows, 2) array with the (sta, lta) of the sample before data, to continue the recursion over successive 
+      blocks (no zeroing of the first nlta samples); then (cft, zf) is returned, zf being the state after the last sample
+  """
+  data = np.atleast_2d(data)
+  sq = np.square(data, dtype=np.float64)
+  csta = 1./nsta
+  clta = 1./nlta
+
+  if zi is not None:
+    zi = np.asarray(zi, dtype=np.float64)
+    sta = lfilter([csta], [1., csta - 1.], sq, axis=1, zi=(1. - csta)*zi[:, :1])[0]
+    lta = lfilter([clta], [1., clta - 1.], sq, axis=1, zi=(1. - clta)*zi[:, 1:])[0]
+    zf = np.column_stack((sta[:, -1], lta[:, -1])) if sq.shape[1] > 0 else zi.copy()
+    np.divide(sta, lta, out=sq)
+    return sq, zf
+
+  if sq.shape[1] < 2:
+    return np.zeros_like(sq)
+
+  # same recursion as obspy: starts at the second sample, with sta = 0 and lta = 1e-99
+  zi_lta = np.full((sq.shape[0], 1), (1. - clta)*1e-99)
+  sta = lfilter([csta], [1., csta - 1.], sq[:, 1:], axis=1)
+  lta = lfilter([clta], [1., clta - 1.], sq[:, 1:], axis=1, zi=zi_lta)[0]
+
+  # the squared samples are not needed anymore: the cft is written on them
+  cft = sq
+  np.divide(sta, lta, out=cft[:, 1:])
+  cft[:, :max(nlta, 1)] = 0
+  return cft
+
+
+def trigger_onset_2d(cft, thr_on, thr_off):
+  """
+  trigger on/off sample indices of every row of cft (thr_on >= thr_off)
+  returns a list with one (ntriggers, 2) int64 array per row, like obspy's trigger_onset
+  """
+  cft = np.atleast_2d(cft)
+  nrows, npts = cft.shape
+
+  # runs of samples above thr_on (a trigger can switch on at their start) and above thr_off (a trigger stays on until their end),
+  # as flat indices; runs never cross from one row to the next
+  above_on = cft >= thr_on
+  above_off = cft >= thr_off
+  on_starts = _run_edges(above_on, start=True)
+  off_starts = _run_edges(above_off, start=True)
+  off_ends = _run_edges(above_off, start=False)
+
+  # a trigger switches on at the first on-start of each run above thr_off and off at the end of that run
+  run = np.searchsorted(off_starts, on_starts, side="right") - 1
+  first = np.ones(len(run), dtype=bool)
+  first[1:] = run[1:] != run[:-1]
+  ons = on_starts[first]
+  offs = off_ends[run[first]]
+
+  rows = ons // npts
+  split = np.searchsorted(rows, np.arange(1, nrows))
+  return [np.column_stack((a % npts, b % npts)).astype(np.int64) for a, b in zip(np.split(ons, split), np.split(offs, split))]
+
+
+def trigger_onset_thresholds(cft, thr_ons, thr_off):
+  """
+  trigger_onset_2d of cft for several thr_on values (all >= thr_off) at once: the runs above thr_off are found once and
+  the first sample reaching each thr_on in every run is found with one binary search per threshold
+  returns one list per thr_on, with one (ntriggers, 2) int64 array per row
+  """
+  cft = np.atleast_2d(cft)
+  nrows, npts = cft.shape
+  above_off = cft >= thr_off
+  first = above_off.copy()
+  first[:, 1:] &= ~above_off[:, :-1]
+  ends = _run_edges(above_off, start=False)
+
+  # inside run r the samples are shifted up by r*scale (scale above any cft value), so that the running maximum of the 
+  # flat array restarts at every run and stays sorted: the first sample of run r reaching thr_on is a searchsorted of r*scale + thr_on
+  scale = float(cft.max()) + 1. if cft.size > 0 else 1.
+  run = np.cumsum(first.ravel()) - 1
+  shifted = np.where(above_off.ravel(), cft.ravel() + run*scale, -np.inf)
+  np.maximum.accumulate(shifted, out=shifted)
+
+  triggers = []
+  for thr_on in thr_ons:
+    if thr_on < thr_off:
+      raise ValueError("thr_on must be >= thr_off")
+    ons = np.searchsorted(shifted, np.arange(len(ends))*scale + thr_on, side="left")
+    found = ons <= ends
+    ons, offs = ons[found], ends[found]
+    split = np.searchsorted(ons // max(npts, 1), np.arange(1, nrows))
+    triggers.append([np.column_stack((a % npts, b % npts)).astype(np.int64) for a, b in zip(np.split(ons, split), np.split(offs, split))])
+  return triggers
+
+
+def _run_edges(mask, start=True):
+  # flat indices of the first (or last) sample of each run of True values along the rows of mask
+  edge = mask.copy()
+  if start:
+    edge[:, 1:] &= ~mask[:, :-1]
+  else:
+    edge[:, :-1] &= ~mask[:, 1:]
+  return np.flatnonzero(edge)
+
+
+def coincidence_events(triggers, thr_coincidence_sum):
+  """
+  network coincidences of single channel triggers, list of (on, off, trace id) with epoch times, with the rules of obspy's
+  coincidence_trigger (weight 1 per channel, no trigger_off_extension, no similarity): overlapping triggers of different channels are
+  chained, a coincidence ending before the previous one is dropped
+  returns a list of dictionaries with the keys of obspy's output used here: time (UTCDateTime), stations, trace_ids, coincidence_sum,
+  duration
+  """
+  triggers = sorted(triggers)
+  events = []
+  last_off = 0.
+  for i, (on, off, trace_id) in enumerate(triggers):
+    trace_ids = [trace_id]
+    for tmp_on, tmp_off, tmp_id in triggers[i+1:]:
+      if tmp_id in trace_ids:
+        continue
+      if tmp_on > off:
+        break
+      trace_ids.append(tmp_id)
+      off = max(off, tmp_off)
+    if len(trace_ids) < thr_coincidence_sum or off <= last_off:
+      continue
+    events.append({'time': UTCDateTime(on), 'stations': [tmp_id.split(".")[1] for tmp_id in trace_ids], 'trace_ids': trace_ids,
+                   'coincidence_sum': float(len(trace_ids)), 'duration': off - on})
+    last_off = off
+  return events
@@ -0,0 +1,191 @@
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scripts import bcolors, preprocess_stream, window_padding, archive_windows
+from stalta import pack_groups, recursive_sta_lta_2d, trigger_onset_thresholds
+from catalog import read_catalog, score_times
+from msindex import load_index, read_window
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  PARAMETER SWEEP OF THE TRIGGER COINCIDENCE AGAINST THE CATALOG (src/catalogo.txt)
+#  every window of the archive is pre-processed once (waveform cache), the STA/LTA of
+#  its Z channels (each on its own span and sampling rate) is computed once per
+#  (sta, lta) and all (thr_on, thr_off) pairs are evaluated on it
+#  (stalta.trigger_onset_thresholds), then the coincidences of every
+#  min_num_stations value are found as obspy's coincidence_trigger does.
+#  The (window, sta, lta) tasks run in a process pool
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+COLUMNS = ['sta', 'lta', 'thr_on', 'thr_off', 'min_num_stations']
+
+
+def coincidence_times(triggers, trace_ids, min_num_stations):
+  """
+  coincidence times (epoch floats) of the single channel triggers (one (ntriggers, 2) array of on/off epoch times per trace_id, each
+  trace on its own time base) for every value of min_num_stations, with the rules of obspy's coincidence_trigger (overlapping triggers
+  of different channels are chained, a coincidence ending before the previous one is dropped)
+  returns a dictionary min_num_stations -> list of times
+  """
+  rank = np.unique(trace_ids, return_inverse=True)[1] if len(trace_ids) > 0 else np.empty(0, dtype=int)
+  rows = np.concatenate([np.full(len(trig), rank[i], dtype=int) for i, trig in enumerate(triggers)]) if len(triggers) > 0 else np.empty(0, dtype=int)
+  trig = np.concatenate([np.reshape(t, (-1, 2)) for t in triggers]) if len(triggers) > 0 else np.empty((0, 2))
+  ons, offs = trig[:, 0], trig[:, 1]
+  order = np.lexsort((rows, offs, ons))
+  rows, ons, offs = rows[order].tolist(), ons[order].tolist(), offs[order].tolist()
+
+  times = dict((n, []) for n in min_num_stations)
+  last_off = dict((n, 0.) for n in min_num_stations)
+  for i in range(len(ons)):
+    members = set([rows[i]])
+    off = offs[i]
+    for j in range(i + 1, len(ons)):
+      if rows[j] in members:
+        continue
+      if ons[j] > off:
+        break
+      members.add(rows[j])
+      off = max(off, offs[j])
+    for n in min_num_stations:
+      if len(members) >= n and off > last_off[n]:
+        times[n].append(ons[i])
+        last_off[n] = off
+  return times
+
+
+def apply_deadtime(times, deadtime_between_coincidences):
+  """
+  drops the times closer than deadtime_between_coincidences to the previous time kept (as find_coincidences and number_coincidences)
+  """
+  kept = []
+  time_old = 0
+  for time in times:
+    if abs(time - time_old) < deadtime_between_coincidences:
+      continue
+    time_old = time
+    kept.append(time)
+  return kept
+
+
+def sweep_window(msfile, t1, t2, freqmin, freqmax, tapering, sta_lta, thr_ons, thr_offs, min_num_stations, deadtime_between_coincidences,
+                 pad_before=0, pad_after=0, cache_dir=None):
+  """
+  coincidence times inside [t1, t2) of every combination of the window [t1-pad_before, t2+pad_after] of msfile
+  sta_lta: list of (sta, lta) pairs, one STA/LTA computation each
+  returns a dictionary (sta, lta, thr_on, thr_off, min_num_stations) -> list of times (epoch floats)
+  """
+  if cache_dir is not None:
+    from wavecache import WaveformCache
+    st = WaveformCache(cache_dir).read_preprocessed(msfile, t1-pad_before, t2+pad_after, freqmin, freqmax, tapering)
+  else:
+    st = read_window(msfile, t1-pad_before, t2+pad_after)
+    if len(st) > 0:
+      preprocess_stream(st, freqmin, freqmax, tapering)
+  return sweep_stream(st, t1, t2, sta_lta, thr_ons, thr_offs, min_num_stations, deadtime_between_coincidences)
+
+
+def sweep_stream(st, t1, t2, sta_lta, thr_ons, thr_offs, min_num_stations, deadtime_between_coincidences):
+  """
+  coincidence times inside [t1, t2) of every combination on the Z channels of the pre-processed stream st
+  the STA/LTA and the triggers of each trace are computed over its own span and sampling rate (the traces sharing a time base
+  are packed together, stalta.pack_groups) and converted to epoch times before the coincidences, as obspy's coincidence_trigger
+  returns a dictionary (sta, lta, thr_on, thr_off, min_num_stations) -> list of times (epoch floats)
+  """
+  results = {}
+  groups = pack_groups(st.select(channel="*Z"))
+  trace_ids = [trace_id for group in groups for trace_id in group[3]]
+  for sta, lta in sta_lta:
+    for thr_on, thr_off, n in itertools.product(thr_ons, thr_offs, min_num_stations):
+      if thr_on >= thr_off:
+        results[(sta, lta, thr_on, thr_off, n)] = []
+    if len(groups) == 0:
+      continue
+
+    cfts = [recursive_sta_lta_2d(data, int(sampling_rate*sta), int(sampling_rate*lta)) for data, _, sampling_rate, _ in groups]
+    for thr_off in thr_offs:
+      ons = [thr_on for thr_on in thr_ons if thr_on >= thr_off]
+      triggers = [[] for thr_on in ons]
+      for cft, (_, starttime, sampling_rate, _) in zip(cfts, groups):
+        for k, group_triggers in enumerate(trigger_onset_thresholds(cft, ons, thr_off)):
+          triggers[k].extend(starttime.timestamp + trig/sampling_rate for trig in group_triggers)
+      for thr_on, epoch_triggers in zip(ons, triggers):
+        times = coincidence_times(epoch_triggers, trace_ids, min_num_stations)
+        for n in min_num_stations:
+          kept = apply_deadtime(times[n], deadtime_between_coincidences)
+          results[(sta, lta, thr_on, thr_off, n)] = [time for time in kept if t1.timestamp <= time < t2.timestamp]
+  return results
+
+
+def _preprocess_window(msfile, t1, t2, freqmin, freqmax, tapering, cache_dir):
+  # stores the pre-processed window in the waveform cache (nothing returned, so that the data is not sent back to the parent process)
+  from wavecache import WaveformCache
+  WaveformCache(cache_dir).read_preprocessed(msfile, t1, t2, freqmin, freqmax, tapering)
+
+
+def _run_tasks(calls, workers):
+  # runs the (function, args, kwargs) calls in a process pool (workers > 1) or one after the other, returns their results in order
+  if workers > 1:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = [pool.submit(function, *args, **kwargs) for function, args, kwargs in calls]
+      return [future.result() for future in futures]
+  return [function(*args, **kwargs) for function, args, kwargs in calls]
+
+
+def sweep(msfile, starttime, endtime, time_window_length, freqmin, freqmax, tapering, stas, ltas, thr_ons, thr_offs, min_num_stations,
+          deadtime_between_coincidences, time_after=120, catalog_file="src/catalogo.txt", cache_dir="src/wavecache", workers=1, before=5., after=30.):
+  """
+  + DETECT WITH EVERY COMBINATION OF stas x ltas x thr_ons x thr_offs x min_num_stations (lists) OVER [starttime, endtime] OF msfile
+  + SCORE EACH ONE AGAINST THE EVENTS OF catalog_file IN [starttime, endtime] (see catalog.score_times, before/after: matching window in s)
+  + RETURN ONE DICTIONARY PER COMBINATION (parameters + scores), RANKED BY F1, RECALL AND |median time difference|
+  cache_dir: waveform cache shared by the workers (None: each window is read and pre-processed in one task for all (sta, lta))
+  the coincidence time is the detection time, so the time difference to the catalog origin time includes the travel time to the stations
+  """
+  windows = archive_windows(starttime, endtime, time_window_length)
+  pad_before, pad_after = window_padding(time_window_length, tapering, max(ltas), time_after)
+  sta_lta = [(sta, lta) for sta in stas for lta in ltas if sta < lta]
+  args = (freqmin, freqmax, tapering)
+  params = (thr_ons, thr_offs, min_num_stations, deadtime_between_coincidences)
+
+  if cache_dir is not None:
+    tasks = [(t1, t2, [pair]) for t1, t2 in windows for pair in sta_lta]
+  else:
+    tasks = [(t1, t2, sta_lta) for t1, t2 in windows]
+  print(bcolors.BOLD + "\n+ Sweeping %i combinations over %i windows (%i tasks, %i workers)..." %
+        (len(sta_lta)*len(thr_ons)*len(thr_offs)*len(min_num_stations), len(windows), len(tasks), workers) + bcolors.ENDC)
+
+  # msfile indexed once, before the workers load its index
+  load_index(msfile)
+
+  # 1) EVERY WINDOW PRE-PROCESSED ONCE, INTO THE CACHE
+  if cache_dir is not None:
+    _run_tasks([(_preprocess_window, (msfile, t1-pad_before, t2+pad_after) + args + (cache_dir,), {}) for t1, t2 in windows], workers)
+
+  # 2) STA/LTA ONCE PER (window, sta, lta), ALL THRESHOLDS ON IT
+  kwargs = {'pad_before': pad_before, 'pad_after': pad_after, 'cache_dir': cache_dir}
+  results = _run_tasks([(sweep_window, (msfile, t1, t2) + args + (pairs,) + params, kwargs) for t1, t2, pairs in tasks], workers)
+
+  times = {}
+  for result in results:
+    for key, value in result.items():
+      times.setdefault(key, []).extend(value)
+
+  # SCORE AGAINST THE CATALOG (coincidences repeated at the seams of the windows removed first)
+  origin_times = read_catalog(catalog_file, starttime, endtime)['origin_time']
+  table = []
+  for key in sorted(times):
+    row = dict(zip(COLUMNS, key))
+    row.update(score_times(apply_deadtime(sorted(times[key]), deadtime_between_coincidences), origin_times, before=before, after=after))
+    table.append(row)
+  table.sort(key=lambda row: (-row['f1'], -row['recall'], abs(row['dt_median']) if row['hits'] > 0 else np.inf))
+  return table
+
+
+def format_table(table, top=None):
+  """
+  returns the lines of the ranked table of sweep
+  """
+  lines = ["rank   sta    lta  thr_on thr_off  nsta   ndet  hits/events  precision  recall     f1   dt_med  dt_mad"]
+  for rank, row in enumerate(table[:top], 1):
+    lines.append("%4i %5.2f %6.1f  %6.2f  %6.2f  %4i  %5i   %4i/%-4i     %6.3f  %6.3f  %5.3f  %7.2f %7.2f" %
+                 (rank, row['sta'], row['lta'], row['thr_on'], row['thr_off'], row['min_num_stations'], row['ndetections'],
+                  row['hits'], row['nevents'], row['precision'], row['recall'], row['f1'], row['dt_median'], row['dt_mad']))
+  return lines
@@ -0,0 +1,4 @@
+import os, sys
+
+# the modules live at the root of the repository, next to the run-*.py drivers
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
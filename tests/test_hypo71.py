@@ -0,0 +1,27 @@
+import os, shutil
+from hypo71 import hypo71
+
+HYPO71 = os.path.dirname(hypo71.__file__)
+
+
+def test_failed_event_does_not_stop_the_others(monkeypatch):
+  picks = hypo71.prepare_picks(os.path.join(HYPO71, "picks.txt"))
+  events = sorted(picks)[:4]
+  with open(os.path.join(HYPO71, "hypo71.prt")) as infile:
+    prt = infile.readlines()
+  header = [i for i, line in enumerate(prt) if line.startswith('  DATE')][0]
+
+  # stand-in for hypo71pc: the sample hypo71.prt for every event, except no output at all for the second one (FileNotFoundError)
+  # and a summary block cut right after its header for the third one (IndexError)
+  def call_hypo71(path):
+    with open(path+'/hypo71.inp') as infile:
+      inp = infile.read()
+    if picks[events[1]]['hypolines'][0] in inp:
+      return
+    with open(path+'/hypo71.prt', 'w') as outfile:
+      outfile.writelines(prt[:header+1] if picks[events[2]]['hypolines'][0] in inp else prt)
+
+  monkeypatch.setattr(hypo71, "call_Hypo71", call_hypo71)
+  outs = hypo71.locate_events(dict((num, picks[num]) for num in events), os.path.join(HYPO71, "info_file"), os.path.join(HYPO71, "velmod.hdr"), workers=2)
+  assert [out['goodness'] for out in outs] == [True, False, False, True]
+  assert outs[0]['origin_time'] == hypo71.read_output(HYPO71)['origin_time']
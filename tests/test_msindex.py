@@ -0,0 +1,47 @@
+import io
+import numpy as np
+from obspy.core import read, Stream, Trace, UTCDateTime
+from msindex import read_window
+
+T0 = UTCDateTime(2019, 9, 30, 18, 45)
+
+# (station, channel, sampling rate, [(start, end) in s after T0]): the rates of the archive, gaps and staggered starts
+CHANNELS = [("TOL1", "HHZ", 20., [(0., 300.), (340., 600.)]), ("TOL1", "HHN", 20., [(0., 600.)]),
+            ("COPA", "BHZ", 25., [(12.3, 250.), (250.5, 420.), (480., 590.)]), ("COPA", "BHE", 25., [(30., 600.)]),
+            ("LONQ", "HHZ", 50., [(100., 450.), (451.02, 560.)])]
+
+
+def write_archive(path):
+  rng = np.random.default_rng(0)
+  parts = []
+  for station, channel, sampling_rate, spans in CHANNELS:
+    for start, end in spans:
+      tr = Trace(data=rng.integers(-5000, 5000, int((end - start)*sampling_rate)).astype(np.int32),
+                 header={'network': 'GM', 'station': station, 'channel': channel, 'sampling_rate': sampling_rate, 'starttime': T0 + start})
+      buf = io.BytesIO()
+      Stream([tr]).write(buf, format="MSEED", reclen=512, encoding="STEIM2")
+      parts.append(buf.getvalue())
+  # the records of the channels interleaved in blocks, as in an archive file
+  with open(str(path), "wb") as outfile:
+    for n in rng.permutation(len(parts)):
+      outfile.write(parts[n])
+  return str(path)
+
+
+def assert_same_stream(st, expected):
+  key = lambda tr: (tr.id, tr.stats.starttime.timestamp)
+  st, expected = sorted(st, key=key), sorted(expected, key=key)
+  assert [key(tr) + (tr.stats.npts, tr.stats.sampling_rate) for tr in st] == [key(tr) + (tr.stats.npts, tr.stats.sampling_rate) for tr in expected]
+  assert all(np.array_equal(tr.data, ref.data) for tr, ref in zip(st, expected))
+
+
+def test_read_window_matches_obspy(tmp_path):
+  msfile = write_archive(tmp_path / "archive.mseed")
+  rng = np.random.default_rng(1)
+  windows = [(None, None), (T0 - 100, T0 + 10), (T0 + 295, T0 + 345), (T0 + 590, T0 + 700), (T0 + 800, T0 + 900)]
+  windows += [(T0 + t1, T0 + t1 + length) for t1, length in zip(rng.uniform(-20., 600., 15), rng.uniform(0.01, 200., 15))]
+  selections = [{}, {'station': "TOL1"}, {'channel': "*Z"}, {'station': "CO*", 'channel': "BH?"}, {'station': "MAYA"}]
+  for starttime, endtime in windows:
+    for selection in selections:
+      expected = read(msfile, starttime=starttime, endtime=endtime).select(**selection)
+      assert_same_stream(read_window(msfile, starttime, endtime, **selection), expected)
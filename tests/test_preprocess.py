@@ -0,0 +1,17 @@
+import numpy as np
+from obspy.core import Trace
+from preprocess import decimate_trace
+
+
+def test_decimation_keeps_nyquist_above_freqmax():
+  rng = np.random.default_rng(0)
+  # (trace rate, target rate, freqmax) -> rate of the decimated copy
+  cases = {(100., 25., 10.): 25., (50., 25., 10.): 25., (25., 25., 10.): 25., (20., 25., 10.): 20.,
+           (100., 10., 10.): 25., (50., 20., 10.): 25., (40., 25., 10.): 40., (100., 25., None): 25.}
+  for (sampling_rate, target, freqmax), expected in cases.items():
+    tr = Trace(data=rng.standard_normal(1000), header={'sampling_rate': sampling_rate})
+    decimated = decimate_trace(tr, target, freqmax)
+    assert decimated.stats.sampling_rate == expected
+    assert decimated.stats.starttime == tr.stats.starttime
+    # the new Nyquist is above freqmax (TOL1 at 20 Hz is not decimated, whatever its Nyquist)
+    assert freqmax is None or expected == sampling_rate or expected/2. > freqmax
@@ -0,0 +1,50 @@
+import warnings
+import numpy as np
+from scipy.signal import sosfilt
+from obspy.core import Trace, UTCDateTime
+from obspy.signal.filter import highpass
+from realtime import RealTimeDetector
+
+T0 = UTCDateTime(2020, 1, 1)
+EVENT = 60.
+
+# TOL1 at 20 Hz (freqmax = 10 Hz is its Nyquist), the GM BH? channels at 25 Hz, LONQ at 50 Hz
+CHANNELS = [("TOL1", 20.), ("COPA", 25.), ("MANZ", 25.), ("LONQ", 50.)]
+
+
+def detector():
+  return RealTimeDetector(3.5, 10., 0.5, 10., 3., 1.5, 4, 10., 120., 3.)
+
+
+def channel_trace(station, sampling_rate, seed=0):
+  rng = np.random.default_rng(seed)
+  t = np.arange(0., 120., 1./sampling_rate)
+  data = rng.standard_normal(len(t))
+  burst = (t >= EVENT) & (t < EVENT + 3.)
+  data[burst] += 40.*np.sin(2*np.pi*5.*t[burst])
+  return Trace(data=data, header={'network': 'GM', 'station': station, 'channel': 'BHZ', 'sampling_rate': sampling_rate, 'starttime': T0})
+
+
+def test_20hz_channel_high_pass_as_obspy():
+  tr = channel_trace("TOL1", 20.)
+  with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    sos = detector()._channel(tr).sos
+    expected = highpass(np.eye(1, 200)[0], 3.5, 20., corners=4)
+  # impulse response of the channel filter = obspy's bandpass falling back to a high-pass at Nyquist
+  assert np.allclose(sosfilt(sos, np.eye(1, 200)[0]), expected)
+
+
+def test_mixed_rates_coincidence():
+  det = detector()
+  traces = [channel_trace(station, sampling_rate, seed) for seed, (station, sampling_rate) in enumerate(CHANNELS)]
+  messages = []
+  with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    for t1 in np.arange(0., 120., 5.):
+      for tr in traces:
+        messages += det.process(tr.slice(T0 + t1, T0 + t1 + 5. - 0.5/tr.stats.sampling_rate))
+  coincidences = [message for message in messages if message[0] == 'coincidence']
+  assert len(coincidences) == 1
+  assert abs(coincidences[0][2] - (T0 + EVENT)) < 1.
+  assert sorted(coincidences[0][3]) == sorted(station for station, sampling_rate in CHANNELS)
@@ -0,0 +1,42 @@
+import numpy as np
+from obspy.core import Stream, Trace, UTCDateTime
+from obspy.signal.trigger import coincidence_trigger
+from sweep import sweep_stream
+
+T0 = UTCDateTime(2020, 1, 1)
+
+# (station, sampling rate, start and end in s after T0): TOL1 at 20 Hz, GM BH? at 25 Hz, LONQ at 50 Hz, staggered spans
+CHANNELS = [("TOL1", 20., 0., 600.), ("COPA", 25., 100., 700.), ("LONQ", 50., 200., 800.), ("MANZ", 25., 0., 800.)]
+EVENTS = [400., 650.]   # the second one is after the end of TOL1
+
+
+def mixed_rate_stream(seed=0):
+  rng = np.random.default_rng(seed)
+  st = Stream()
+  for station, sampling_rate, start, end in CHANNELS:
+    t = np.arange(start, end, 1./sampling_rate)
+    data = rng.standard_normal(len(t))
+    for event in EVENTS:
+      burst = (t >= event) & (t < event + 4.)
+      data[burst] += 20.*np.sin(2*np.pi*3.*t[burst])
+    st += Trace(data=data, header={'network': 'GM', 'station': station, 'channel': 'BHZ', 'sampling_rate': sampling_rate,
+                                   'starttime': T0 + start})
+  return st
+
+
+def test_sweep_mixed_rates_matches_obspy():
+  st = mixed_rate_stream()
+  sta, lta, thr_on, thr_off = 1., 10., 4., 1.5
+  results = sweep_stream(st, T0, T0 + 1000, [(sta, lta)], [thr_on], [thr_off], [2, 3, 4], 0)
+  for n in (2, 3, 4):
+    expected = [event['time'].timestamp for event in coincidence_trigger("recstalta", thr_on, thr_off, st.copy(), n, sta=sta, lta=lta)]
+    assert np.allclose(results[(sta, lta, thr_on, thr_off, n)], expected)
+
+
+def test_sweep_mixed_rates_keeps_the_whole_span():
+  st = mixed_rate_stream()
+  results = sweep_stream(st, T0, T0 + 1000, [(1., 10.)], [4.], [1.5], [3, 4], 10)
+  times = [time - T0.timestamp for time in results[(1., 10., 4., 1.5, 3)]]
+  assert len(times) == 2 and all(abs(time - event) < 1. for time, event in zip(times, EVENTS))
+  # the event after the end of TOL1 is seen by the three other stations only
+  assert [round(time - T0.timestamp) for time in results[(1., 10., 4., 1.5, 4)]] == [400]
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+from obspy.core import Stream, Trace, UTCDateTime
+from scripts import autodetect_archive, preprocess_stream
+from msindex import read_window
+from wavecache import WaveformCache
+
+T0 = UTCDateTime(2019, 9, 30, 18, 45)
+
+
+def write_archive(path):
+  rng = np.random.default_rng(0)
+  st = Stream()
+  for station, sampling_rate in (("TOL1", 20.), ("COPA", 25.), ("LONQ", 50.)):
+    st += Trace(data=rng.normal(0., 1000., int(1200*sampling_rate)).astype(np.int32),
+                header={'network': 'GM', 'station': station, 'channel': 'BHZ', 'sampling_rate': sampling_rate, 'starttime': T0})
+  st.write(str(path), format="MSEED")
+  return str(path)
+
+
+def detect(msfile, cache_dir, lta, **options):
+  return autodetect_archive(msfile, T0 + 300, T0 + 900, 300, 3.5, 10., 0.05, 0.5, lta, 3., 1.5, 3, 10, lta, 120, 3,
+                            cache_dir=cache_dir, threads=1, **options)
+
+
+def test_cached_windows_do_not_depend_on_lta(tmp_path):
+  msfile = write_archive(tmp_path / "archive.mseed")
+  cache_dir = str(tmp_path / "wavecache")
+  detect(msfile, cache_dir, 10.)
+  entries = sorted(os.listdir(cache_dir))
+  assert len(entries) == 2
+  detect(msfile, cache_dir, 20.)
+  assert sorted(os.listdir(cache_dir)) == entries
+
+
+def test_cached_windows_keep_the_detection_dtype(tmp_path):
+  msfile = write_archive(tmp_path / "archive.mseed")
+  for dtype in (np.float64, np.float32):
+    cache_dir = str(tmp_path / ("wavecache_%s" % np.dtype(dtype).name))
+    detect(msfile, cache_dir, 10., dtype=dtype)
+    for entry in os.listdir(cache_dir):
+      assert np.load(os.path.join(cache_dir, entry, "000.npy")).dtype == dtype
+
+
+def test_float64_cache_is_bitwise_unchanged(tmp_path):
+  msfile = write_archive(tmp_path / "archive.mseed")
+  expected = preprocess_stream(read_window(msfile, T0 + 100, T0 + 700), 3.5, 10., 0.05, threads=1)
+  cache = WaveformCache(str(tmp_path / "wavecache"), dtype=np.float64)
+  for n in range(2):   # stored, then read back
+    st = cache.read_preprocessed(msfile, T0 + 100, T0 + 700, 3.5, 10., 0.05, threads=1)
+    assert [tr.id for tr in st] == [tr.id for tr in expected]
+    assert all(np.array_equal(tr.data, ref.data) and tr.data.dtype == np.float64 for tr, ref in zip(st, expected))
@@ -0,0 +1,37 @@
+import numpy as np
+from obspy.core import UTCDateTime
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  SAMPLE INDEX <-> TIME ARITHMETIC ON EPOCH FLOATS
+#  (instead of tr.times("UTCDateTime"), which builds one UTCDateTime object per sample)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+def epoch(t):
+  """
+  returns t (UTCDateTime or float) as a float timestamp
+  """
+  if isinstance(t, UTCDateTime):
+    return t.timestamp
+  return float(t)
+
+
+def round_away(x):
+  """
+  rounds half away from zero (as obspy does for nearest_sample trimming)
+  """
+  return int(np.sign(x)*np.floor(abs(x) + 0.5))
+
+
+def sample_time(tr, idx):
+  """
+  returns the epoch float of sample idx of trace tr (starttime + idx*delta)
+  """
+  return tr.stats.starttime.timestamp + idx*tr.stats.delta
+
+
+def sample_index(tr, t):
+  """
+  returns the index of the sample of trace tr nearest to t (UTCDateTime or epoch float), not clipped to the trace
+  """
+  return round_away((epoch(t) - tr.stats.starttime.timestamp)*tr.stats.sampling_rate)
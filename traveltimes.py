@@ -0,0 +1,175 @@
+import os, hashlib
+import numpy as np
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  1-D TRAVEL-TIME TABLES
+#  P and S first-arrival times over epicentral distance x source depth for the layered
+#  model of src/model.cru (or hypo71/velmod.hdr), built once and cached on disk as a
+#  .npy keyed by a hash of the model file and the grid, loaded memory-mapped afterwards
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# grid of the tables (km)
+MAX_DISTANCE = 1000.
+MAX_DEPTH = 100.
+DDISTANCE = 1.
+DDEPTH = 0.5
+
+_tables = {}   # tables already loaded by this process, by cache key
+
+
+def read_model(model_file="src/model.cru", vpvs=1.73):
+  """
+  reads the layered model: depth of layer top (km), Vp, Vs (km/s) as in src/model.cru ('#' lines are comments),
+  or Vp, depth of layer top as in hypo71/velmod.hdr (then Vs = Vp/vpvs)
+  returns three arrays (tops, vp, vs)
+  """
+  model = np.loadtxt(model_file, comments="#", ndmin=2)
+  if model.shape[1] == 2:
+    return model[:, 1], model[:, 0], model[:, 0]/vpvs
+  return model[:, 0], model[:, 1], model[:, 2]
+
+
+def first_arrivals(tops, v, depth, distances, nrays=3000):
+  """
+  first-arrival times (s) at the surface for a source at depth (km) and the epicentral distances (km, array)
+  of the flat layered model (tops, v): direct wave and head waves along the top of every layer below the source
+  """
+  tops = np.asarray(tops, dtype=float)
+  v = np.asarray(v, dtype=float)
+  bottoms = np.append(tops[1:], np.inf)
+  source_layer = np.searchsorted(tops, depth, side="right") - 1
+
+  # DIRECT WAVE: shooting over the ray parameter, interpolated at the distances
+  h = np.clip(np.minimum(bottoms, depth) - tops, 0., None)
+  if h.sum() == 0:
+    times = distances/v[source_layer]
+  else:
+    vmax = v[h > 0].max()
+    q = np.logspace(-10, 0, nrays)   # 1 - p*vmax, from (nearly) grazing to vertical rays
+    p = (1. - q)/vmax
+    cos = np.sqrt(1. - np.square(np.outer(p, v[h > 0])))
+    x = np.sum(h[h > 0]*np.outer(p, v[h > 0])/cos, axis=1)
+    t = np.sum(h[h > 0]/(v[h > 0]*cos), axis=1)
+    order = np.argsort(x)
+    times = np.interp(distances, x[order], t[order], right=np.inf)
+
+  # HEAD WAVES: along the top of each faster layer below the source
+  for n in range(source_layer + 1, len(tops)):
+    if np.any(v[:n] >= v[n]):
+      continue
+    up = bottoms[:n] - tops[:n]                                          # surface -> top of layer n
+    down = np.clip(bottoms[:n] - np.maximum(tops[:n], depth), 0., None)  # source -> top of layer n
+    path = up + down
+    x_min = np.sum(path*v[:n]/np.sqrt(v[n]**2 - v[:n]**2))
+    t_head = distances/v[n] + np.sum(path*np.sqrt(1./v[:n]**2 - 1./v[n]**2))
+    times = np.where(distances >= x_min, np.minimum(times, t_head), times)
+  return times
+
+
+def grid_axes(max_distance=MAX_DISTANCE, max_depth=MAX_DEPTH, ddistance=DDISTANCE, ddepth=DDEPTH):
+  """
+  distance and depth axes (km) of the tables
+  """
+  return np.arange(0., max_distance + ddistance/2., ddistance), np.arange(0., max_depth + ddepth/2., ddepth)
+
+
+def build_tables(model_file="src/model.cru", **grid):
+  """
+  computes the tables of model_file; returns an array (2, ndepths, ndistances) with the P and S times
+  """
+  tops, vp, vs = read_model(model_file)
+  distances, depths = grid_axes(**grid)
+  tables = np.empty((2, len(depths), len(distances)))
+  for j, z in enumerate(depths):
+    tables[0, j] = first_arrivals(tops, vp, z, distances)
+    tables[1, j] = first_arrivals(tops, vs, z, distances)
+  return tables
+
+
+def cache_key(model_file, **grid):
+  """
+  hash of the content of model_file and of the grid of the tables
+  """
+  infile = open(model_file, 'rb')
+  content = infile.read()
+  infile.close()
+  axes = grid_axes(**grid)
+  return hashlib.sha1(content + repr([(a[0], a[1] - a[0], len(a)) for a in axes]).encode()).hexdigest()[:16]
+
+
+def load(model_file="src/model.cru", cache_dir="src/ttcache", **grid):
+  """
+  returns the TravelTimeTable of model_file: from this process' memory, else memory-mapped from cache_dir,
+  else built and saved to cache_dir (cache_dir=None: no disk cache)
+  grid: max_distance, max_depth, ddistance, ddepth (see grid_axes)
+  """
+  key = cache_key(model_file, **grid)
+  if key in _tables:
+    return _tables[key]
+
+  distances, depths = grid_axes(**grid)
+  path = os.path.join(cache_dir, "tt_%s.npy" % key) if cache_dir is not None else None
+  if path is not None and os.path.isfile(path):
+    tables = np.load(path, mmap_mode='r')
+  else:
+    tables = build_tables(model_file, **grid)
+    if path is not None:
+      if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+      # written under a temporary name first, so that concurrent processes never load a partial file
+      tmp = "%s.%i.tmp.npy" % (path[:-4], os.getpid())
+      np.save(tmp, tables)
+      os.replace(tmp, path)
+      tables = np.load(path, mmap_mode='r')
+
+  _tables[key] = TravelTimeTable(distances, depths, tables[0], tables[1])
+  return _tables[key]
+
+
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+class TravelTimeTable(object):
+  """
+  P and S first-arrival times on a regular grid of epicentral distance x depth, with bilinear lookup
+  """
+
+  def __init__(self, distances, depths, tp, ts):
+    self.distances = distances
+    self.depths = depths
+    self.tables = {'P': tp, 'S': ts}
+
+  @classmethod
+  def from_model(cls, model_file="src/model.cru", **grid):
+    """
+    builds the tables of model_file without using the disk cache (see load)
+    """
+    distances, depths = grid_axes(**grid)
+    tables = build_tables(model_file, **grid)
+    return cls(distances, depths, tables[0], tables[1])
+
+  def lookup(self, phase, distance, depth):
+    """
+    travel times of phase ('P' or 'S', or an array of them) for arrays of distances and depths (broadcast together),
+    e.g. every station x every source of a grid in one call
+    """
+    distance, depth = np.broadcast_arrays(distance, depth)
+    if np.ndim(phase) == 0:
+      return self._bilinear(self.tables[phase], distance, depth)
+    phase = np.broadcast_to(phase, distance.shape)
+    times = np.empty(distance.shape)
+    for name, table in self.tables.items():
+      sel = phase == name
+      times[sel] = self._bilinear(table, distance[sel], depth[sel])
+    return times
+
+  def _bilinear(self, table, distance, depth):
+    fi = np.clip((distance - self.distances[0])/(self.distances[1] - self.distances[0]), 0, len(self.distances) - 1.000001)
+    fj = np.clip((depth - self.depths[0])/(self.depths[1] - self.depths[0]), 0, len(self.depths) - 1.000001)
+    i = fi.astype(int)
+    j = fj.astype(int)
+    wi = fi - i
+    wj = fj - j
+    return ((1 - wj)*((1 - wi)*table[j, i] + wi*table[j, i+1]) + wj*((1 - wi)*table[j+1, i] + wi*table[j+1, i+1]))
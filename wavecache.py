@@ -0,0 +1,121 @@
+import os, json, shutil, hashlib
+import numpy as np
+from obspy.core import UTCDateTime, Stream, Trace
+from scripts import preprocess_stream
+from msindex import read_window
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#  ON-DISK CACHE OF PRE-PROCESSED WAVEFORMS
+#  the output of preprocess_stream (detrend, taper, merge, bandpass, corners removed)
+#  for one window of one miniSEED file, stored as one .npy per channel and loaded
+#  memory-mapped; keyed by the file (path, size, mtime), the window and freqmin,
+#  freqmax, tapering, so that sweeps over sta, lta, thr_on, thr_off, ... skip reading
+#  and filtering. The least recently used entries are removed above max_size bytes.
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+class WaveformCache(object):
+  """
+  cache_dir: directory of the cache (one sub-directory per entry)
+  max_size: largest total size of the cache in bytes
+  dtype: dtype of the pre-processing and of the stored samples (float32 halves the size; detect_window uses the dtype of the detection)
+  """
+
+  def __init__(self, cache_dir="src/wavecache", max_size=4*1024**3, dtype=np.float32):
+    self.cache_dir = cache_dir
+    self.max_size = max_size
+    self.dtype = np.dtype(dtype)
+
+
+  def key(self, msfile, t1, t2, freqmin, freqmax, tapering):
+    """
+    name of the entry of the window [t1, t2] of msfile pre-processed with freqmin, freqmax and tapering
+    """
+    info = os.stat(msfile)
+    params = (os.path.abspath(msfile), info.st_size, info.st_mtime, UTCDateTime(t1).timestamp, UTCDateTime(t2).timestamp,
+              float(freqmin), float(freqmax), float(tapering), self.dtype.str)
+    return hashlib.sha1(repr(params).encode()).hexdigest()[:20]
+
+
+  def read_preprocessed(self, msfile, t1, t2, freqmin, freqmax, tapering, threads=None):
+    """
+    returns the window [t1, t2] of msfile after preprocess_stream: from the cache, or read, pre-processed (with threads threads) and stored
+    """
+    key = self.key(msfile, t1, t2, freqmin, freqmax, tapering)
+    st = self.get(key)
+    if st is None:
+      st = read_window(msfile, t1, t2)
+      if len(st) > 0:
+        preprocess_stream(st, freqmin, freqmax, tapering, threads=threads, dtype=self.dtype)
+      self.put(key, st)
+      # the same (stored) samples as in the next runs
+      st = self.get(key) or st
+    return st
+
+
+  def get(self, key):
+    """
+    returns the cached Stream of key (read-only memory-mapped data) or None
+    """
+    path = os.path.join(self.cache_dir, key)
+    try:
+      infile = open(os.path.join(path, "traces.json"), "r")
+      headers = json.load(infile)
+      infile.close()
+      st = Stream()
+      for n, header in enumerate(headers):
+        header['starttime'] = UTCDateTime(header['starttime'])
+        st.append(Trace(data=np.load(os.path.join(path, "%03i.npy" % n), mmap_mode='r'), header=header))
+      os.utime(path)   # most recently used
+      return st
+    except (IOError, OSError, ValueError):
+      return None
+
+
+  def put(self, key, st):
+    """
+    stores the Stream st under key, then removes the least recently used entries above max_size
+    """
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir, exist_ok=True)
+    path = os.path.join(self.cache_dir, key)
+    tmp = "%s.%i.tmp" % (path, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    headers = []
+    for n, tr in enumerate(st):
+      np.save(os.path.join(tmp, "%03i.npy" % n), np.asarray(tr.data, dtype=self.dtype))
+      headers.append({'network': tr.stats.network, 'station': tr.stats.station, 'location': tr.stats.location, 'channel': tr.stats.channel,
+                      'sampling_rate': tr.stats.sampling_rate, 'starttime': tr.stats.starttime.timestamp})
+    outfile = open(os.path.join(tmp, "traces.json"), "w")
+    json.dump(headers, outfile)
+    outfile.close()
+
+    # entries are written under a temporary name and renamed, so that concurrent processes never read a partial one
+    try:
+      os.rename(tmp, path)
+    except OSError:   # stored meanwhile by another process
+      shutil.rmtree(tmp, ignore_errors=True)
+    self.evict()
+
+
+  def evict(self):
+    """
+    removes the least recently used entries until the cache is below max_size bytes
+    """
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      path = os.path.join(self.cache_dir, name)
+      if name.endswith(".tmp") or not os.path.isdir(path):
+        continue
+      try:
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+      except OSError:   # removed meanwhile by another process
+        continue
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+      if total <= self.max_size:
+        break
+      shutil.rmtree(path, ignore_errors=True)
+      total -= size